@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный бенчмарк backend'а. Поднимает server.py во временном каталоге
+против локальных заглушек map.ru и YandexGPT с настраиваемой задержкой,
+прогоняет типовые сценарии и выводит JSON: пропускная способность,
+p50/p95/p99 задержек по сценариям и пиковый RSS процессов сервера.
+
+Сценарии:
+    page_load      всплеск загрузок страницы: статика + GET /notes
+    notes_writers  параллельные POST /notes поверх большого notes.json
+    proxy_map      веер GET /proxy-map (промахи и попадания в кеш границ)
+    ai_describe    веер POST /ai/describe (промахи и попадания в кеш ответов)
+
+Examples:
+    python benchmark.py > bench_output.txt
+    python benchmark.py --async --workers 4 --map-latency 200 --output runs/async.json
+    python benchmark.py --scenarios notes_writers --backend sqlite --compare runs/before.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+import server
+
+SCENARIOS = ("page_load", "notes_writers", "proxy_map", "ai_describe")
+PAGE_ASSETS = ("/", "/styles.css", "/script.js", "/notes")
+STARTUP_TIMEOUT = 120.0
+
+
+# --- Заглушки внешних сервисов ---------------------------------------------
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        pass
+
+    def _reply(self, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        if self.latency:
+            time.sleep(self.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MapStubHandler(StubHandler):
+    """Ответ в формате map.ru: квадрат ~50 м в EPSG:3857 где-то на Алтае."""
+
+    def do_GET(self) -> None:  # noqa: N802
+        query = parse_qs(urlparse(self.path).query).get("query", [""])[0]
+        rng = random.Random(query)
+        x = 9_500_000 + rng.uniform(0, 200_000)
+        y = 6_600_000 + rng.uniform(0, 200_000)
+        ring = [[x, y], [x + 50, y], [x + 50, y + 50], [x, y + 50], [x, y]]
+        self._reply(
+            {
+                "success": True,
+                "features": [
+                    {"geometry": {"type": "Polygon", "coordinates": [ring]}, "properties": {"cn": query}}
+                ],
+            }
+        )
+
+
+class GptStubHandler(StubHandler):
+    """Ответ в формате YandexGPT completion: текст зависит от запроса."""
+
+    def do_POST(self) -> None:  # noqa: N802
+        body = self.rfile.read(int(self.headers.get("Content-Length", "0") or 0))
+        text = f"Описание участка ({len(body)} байт запроса). " * 20
+        self._reply({"result": {"alternatives": [{"message": {"role": "assistant", "text": text}}]}})
+
+
+def start_stub(handler: type[StubHandler], latency_ms: float) -> ThreadingHTTPServer:
+    handler_class = type(handler.__name__, (handler,), {"latency": latency_ms / 1000})
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), handler_class)
+    stub.daemon_threads = True
+    threading.Thread(target=stub.serve_forever, name=handler.__name__, daemon=True).start()
+    return stub
+
+
+# --- Сервер под нагрузкой ----------------------------------------------------
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def load_catalog() -> tuple[list[dict[str, Any]], list[str]]:
+    columns = server.read_csv_columns(server.PARCELS_CSV_PATH)
+    names = list(columns)
+    rows = [dict(zip(names, values)) for values in zip(*columns.values())]
+    numbers: dict[str, None] = {}
+    for row in rows:
+        for number in server.split_cadastral_numbers(row.get("cadastral_number")):
+            numbers.setdefault(number, None)
+    return rows, list(numbers)
+
+
+def prepare_workspace(args: argparse.Namespace, numbers: list[str]) -> Path:
+    """Копия server.py с пустым data/ и заранее заполненным notes.json на args.notes заметок."""
+    workdir = Path(tempfile.mkdtemp(prefix="notes-bench-"))
+    shutil.copy2(server.ROOT_DIR / "server.py", workdir / "server.py")
+    try:
+        (workdir / "public").symlink_to(server.PUBLIC_DIR, target_is_directory=True)
+    except OSError:
+        shutil.copytree(server.PUBLIC_DIR, workdir / "public")
+    data_dir = workdir / "data"
+    data_dir.mkdir()
+    filler = "Участок у реки, подъезд круглый год, электричество по границе. " * max(args.note_bytes // 64, 1)
+    notes = {}
+    for index in range(args.notes):
+        key = numbers[index] if index < len(numbers) else f"99:99:{index // 10000:07d}:{index % 10000}"
+        notes[key] = {"description": filler[: args.note_bytes], "avito_link": f"https://www.avito.ru/{index}"}
+    (data_dir / "notes.json").write_text(json.dumps(notes, ensure_ascii=False, indent=2), encoding="utf-8")
+    return workdir
+
+
+def start_server(args: argparse.Namespace, workdir: Path, port: int, map_url: str, gpt_url: str) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        MAP_API_URL=map_url,
+        YANDEX_GPT_API_URL=gpt_url,
+        YANDEX_GPT_API_KEY="bench",
+        YANDEX_GPT_MODEL_URI="gpt://bench/yandexgpt-lite",
+        NOTES_BACKEND=args.backend,
+        DATASET_RELOAD_INTERVAL="0",
+        PYTHONUNBUFFERED="1",
+    )
+    command = [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(port)]
+    if args.async_mode:
+        command.append("--async")
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    log = (workdir / "server.log").open("wb")
+    return subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def wait_until_ready(process: subprocess.Popen, port: int, workdir: Path) -> float:
+    started = time.monotonic()
+    while time.monotonic() - started < STARTUP_TIMEOUT:
+        if process.poll() is not None:
+            break
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/parcels/regions")
+            if conn.getresponse().status == 200:
+                return time.monotonic() - started
+        except OSError:
+            time.sleep(0.1)
+    log = (workdir / "server.log").read_text(encoding="utf-8", errors="replace")
+    raise SystemExit(f"server.py не поднялся за {STARTUP_TIMEOUT:.0f}s:\n{log[-2000:]}")
+
+
+def process_tree(pid: int) -> list[int]:
+    pids = [pid]
+    for current in pids:
+        try:
+            children = Path(f"/proc/{current}/task/{current}/children").read_text().split()
+        except OSError:
+            continue
+        pids.extend(int(child) for child in children)
+    return pids
+
+
+def peak_rss_mb(pid: int) -> Optional[dict[str, Any]]:
+    """VmHWM (пиковый RSS) сервера и воркеров из /proc; None — нет /proc (не Linux)."""
+    per_process = {}
+    for current in process_tree(pid):
+        try:
+            status = Path(f"/proc/{current}/status").read_text()
+        except OSError:
+            continue
+        for line in status.splitlines():
+            if line.startswith("VmHWM:"):
+                per_process[current] = round(int(line.split()[1]) / 1024, 1)
+    if not per_process:
+        return None
+    return {"total": round(sum(per_process.values()), 1), "max": max(per_process.values()), "processes": len(per_process)}
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    if process.poll() is None:
+        process.send_signal(signal.SIGTERM if sys.platform != "win32" else signal.CTRL_BREAK_EVENT)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+# --- Нагрузка ----------------------------------------------------------------
+
+Request = tuple[str, str, Optional[dict]]
+
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return round((values[low] + (values[high] - values[low]) * (position - low)) * 1000, 2)
+
+
+def run_scenario(port: int, requests: list[Request], concurrency: int, timeout: float) -> dict[str, Any]:
+    """
+    Выполняет запросы пулом из concurrency потоков, у каждого своё соединение.
+    Держится оно только в режиме --async (HTTP/1.1 keep-alive): потоковый сервер
+    отвечает по HTTP/1.0 и закрывает соединение, так что там каждый запрос
+    подключается заново. Время подключения входит в latency_ms и отдельно
+    показано в connect_ms — по нему видно переполнение очереди приёма.
+    """
+    local = threading.local()
+    latencies: list[float] = []
+    connects: list[float] = []
+    statuses: dict[str, int] = {}
+    errors: dict[str, int] = {}
+    received = 0
+    lock = threading.Lock()
+
+    def perform(request: Request) -> None:
+        nonlocal received
+        method, path, payload = request
+        conn = getattr(local, "conn", None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8") if payload is not None else None
+        headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"} if body else {"Accept-Encoding": "gzip"}
+        started = time.perf_counter()
+        try:
+            if conn.sock is None:
+                conn.connect()
+                with lock:
+                    connects.append(time.perf_counter() - started)
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            size = len(response.read())
+            if response.will_close:
+                conn.close()
+        except (OSError, http.client.HTTPException) as error:
+            conn.close()
+            local.conn = None
+            with lock:
+                errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[str(response.status)] = statuses.get(str(response.status), 0) + 1
+            received += size
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        list(pool.map(perform, requests))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    connects.sort()
+    return {
+        "requests": len(requests),
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(latencies) / duration, 1) if duration else None,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.5),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": round(latencies[-1] * 1000, 2) if latencies else None,
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        },
+        "connections": len(connects),
+        "connect_ms": {
+            "p50": percentile(connects, 0.5),
+            "p95": percentile(connects, 0.95),
+            "max": round(connects[-1] * 1000, 2) if connects else None,
+        },
+        "statuses": statuses,
+        "errors": errors,
+        "received_bytes": received,
+    }
+
+
+def build_requests(
+    name: str, args: argparse.Namespace, rng: random.Random, rows: list[dict], numbers: list[str]
+) -> list[Request]:
+    if name == "page_load":
+        return [("GET", path, None) for _ in range(args.page_loads) for path in PAGE_ASSETS]
+    if name == "notes_writers":
+        return [
+            (
+                "POST",
+                "/notes",
+                {
+                    "cadastral_number": rng.choice(numbers[: max(args.notes, 1)]),
+                    "description": f"Правка {index}: " + "текст заметки " * 20,
+                },
+            )
+            for index in range(args.writes)
+        ]
+    if name == "proxy_map":
+        # Половина уникальных номеров — промахи, остальное повторы уже запрошенных.
+        pool = numbers[: max(args.map_requests // 2, 1)]
+        return [("GET", f"/proxy-map?query={quote(rng.choice(pool), safe=':')}", None) for _ in range(args.map_requests)]
+    if name == "ai_describe":
+        pool = rows[: max(args.ai_requests // 2, 1)]
+        return [("POST", "/ai/describe", {"record": rng.choice(pool)}) for _ in range(args.ai_requests)]
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+# --- Отчёт -------------------------------------------------------------------
+
+
+def git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=server.ROOT_DIR, capture_output=True, text=True, timeout=10
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(previous: dict[str, Any], current: dict[str, Any]) -> list[str]:
+    """Строки «сценарий: rps и p95 было → стало» для сравнения прогонов."""
+
+    def change(before: Optional[float], after: Optional[float]) -> str:
+        if not before or after is None:
+            return f"{before} → {after}"
+        return f"{before} → {after} ({(after - before) / before * 100:+.1f}%)"
+
+    lines = []
+    for name, result in current["scenarios"].items():
+        before = previous.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        lines.append(
+            f"{name}: rps {change(before['throughput_rps'], result['throughput_rps'])}, "
+            f"p95 ms {change(before['latency_ms']['p95'], result['latency_ms']['p95'])}"
+        )
+    before_rss = (previous.get("server", {}).get("peak_rss_mb") or {}).get("total")
+    after_rss = (current["server"].get("peak_rss_mb") or {}).get("total")
+    lines.append(f"peak RSS MB: {change(before_rss, after_rss)}")
+    return lines
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="через запятую: " + ", ".join(SCENARIOS))
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="запустить сервер с --async")
+    parser.add_argument("--workers", type=int, default=1, help="запустить сервер с --workers N")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="NOTES_BACKEND сервера")
+    parser.add_argument("--map-latency", type=float, default=50.0, help="задержка заглушки map.ru, мс")
+    parser.add_argument("--gpt-latency", type=float, default=300.0, help="задержка заглушки YandexGPT, мс")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных клиентов в чтениях")
+    parser.add_argument("--writers", type=int, default=16, help="одновременных писателей POST /notes")
+    parser.add_argument("--page-loads", type=int, default=200, help="загрузок страницы (по 4 запроса)")
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--map-requests", type=int, default=300)
+    parser.add_argument("--ai-requests", type=int, default=100)
+    parser.add_argument("--notes", type=int, default=3000, help="заметок в исходном notes.json")
+    parser.add_argument("--note-bytes", type=int, default=1024, help="размер описания в заметке")
+    parser.add_argument("--timeout", type=float, default=60.0, help="таймаут одного запроса, сек")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=Path, help="куда записать JSON (по умолчанию stdout)")
+    parser.add_argument("--compare", type=Path, help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--keep", action="store_true", help="не удалять временный каталог с server.log")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(args.seed)
+    rows, numbers = load_catalog()
+    workdir = prepare_workspace(args, numbers)
+    map_stub = start_stub(MapStubHandler, args.map_latency)
+    gpt_stub = start_stub(GptStubHandler, args.gpt_latency)
+    port = free_port()
+    process = start_server(
+        args,
+        workdir,
+        port,
+        f"http://127.0.0.1:{map_stub.server_address[1]}/api/kad/search",
+        f"http://127.0.0.1:{gpt_stub.server_address[1]}/foundationModels/v1/completion",
+    )
+    report: dict[str, Any] = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        "server": {},
+        "scenarios": {},
+    }
+    try:
+        report["server"]["startup_s"] = round(wait_until_ready(process, port, workdir), 3)
+        for name in scenarios:
+            requests = build_requests(name, args, rng, rows, numbers)
+            concurrency = args.writers if name == "notes_writers" else args.concurrency
+            print(f"[bench] {name}: {len(requests)} запросов, {concurrency} клиентов", file=sys.stderr)
+            result = run_scenario(port, requests, concurrency, args.timeout)
+            report["scenarios"][name] = result
+            print(
+                f"[bench]   {result['throughput_rps']} rps, p50 {result['latency_ms']['p50']} ms, "
+                f"p95 {result['latency_ms']['p95']} ms, p99 {result['latency_ms']['p99']} ms, "
+                f"подключений {result['connections']} (p95 {result['connect_ms']['p95']} ms), "
+                f"ошибок {sum(result['errors'].values())}",
+                file=sys.stderr,
+            )
+        report["server"]["peak_rss_mb"] = peak_rss_mb(process.pid)
+    finally:
+        stop_server(process)
+        map_stub.shutdown()
+        gpt_stub.shutdown()
+        if args.keep:
+            print(f"[bench] каталог прогона: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    if report["server"].get("peak_rss_mb") is None:
+        # Без /proc остаётся максимум RSS среди завершившихся дочерних процессов.
+        maxrss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+        report["server"]["peak_rss_mb"] = {"total": None, "max": round(maxrss / scale, 1), "processes": None}
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.compare:
+        previous = json.loads(args.compare.read_text(encoding="utf-8"))
+        for line in compare(previous, report):
+            print(f"[bench] {line}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
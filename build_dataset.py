@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Сборка data/parcels.bin — каталога участков в колоночном бинарном формате,
+который сервер отображает в память при старте вместо разбора CSV.
+
+Подборки (urgent_sales, kedrograd, avito_mentions) сохраняются как списки
+номеров строк: строка подборки, совпадающая со строкой каталога по всем своим
+полям, ссылается на неё, остальные дописываются в файл один раз.
+
+Examples:
+    python build_dataset.py
+    python build_dataset.py --catalog public/all_regions.csv --output data/parcels.bin
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+import server
+
+
+def merge_subset(
+    columns: dict[str, list],
+    rows: dict[tuple, int],
+    by_cadastral: dict[str, list[int]],
+    subset: dict[str, list],
+) -> tuple[list[int], int]:
+    """Номера строк подборки в общих колонках; второе значение — сколько нашлось в каталоге."""
+    names = list(subset)
+    size = len(next(iter(subset.values()), []))
+    total = len(next(iter(columns.values()), []))
+    row_ids: list[int] = []
+    reused = 0
+    for index in range(size):
+        values = [subset[name][index] for name in names]
+        found = None
+        for row in by_cadastral.get(str(subset.get("cadastral_number", [None] * size)[index]), []):
+            if all(columns[name][row] == value for name, value in zip(names, values)):
+                found = row
+                break
+        if found is not None:
+            reused += 1
+        else:
+            key = (tuple(names), tuple(values))
+            found = rows.get(key)
+            if found is None:
+                found = rows[key] = total
+                total += 1
+                for name in columns:
+                    columns[name].append(None)
+                for name, value in zip(names, values):
+                    columns[name][found] = value
+        row_ids.append(found)
+    return row_ids, reused
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--catalog", type=Path, default=server.PARCELS_CSV_PATH, help="основной каталог CSV")
+    parser.add_argument("--subsets-dir", type=Path, default=server.PUBLIC_DIR, help="каталог с CSV подборок")
+    parser.add_argument("--output", type=Path, default=server.PARCELS_BIN_PATH)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    started = time.perf_counter()
+    columns = server.read_csv_columns(args.catalog)
+    catalog_rows = len(next(iter(columns.values()), []))
+    print(f"{args.catalog.name}: {catalog_rows} строк, {len(columns)} колонок")
+
+    by_cadastral: dict[str, list[int]] = {}
+    for row, value in enumerate(columns.get("cadastral_number", [])):
+        by_cadastral.setdefault(str(value), []).append(row)
+
+    subsets: dict[str, tuple[Path, list[str], list[int]]] = {}
+    appended: dict[tuple, int] = {}
+    for name in server.PARCEL_SUBSETS:
+        path = args.subsets_dir / f"{name}.csv"
+        if not path.exists():
+            print(f"  {name}: нет {path}, пропускаю")
+            continue
+        subset = server.read_csv_columns(path)
+        for column in subset:
+            if column not in columns:
+                columns[column] = [None] * len(next(iter(columns.values()), []))
+        row_ids, reused = merge_subset(columns, appended, by_cadastral, subset)
+        subsets[name] = (path, list(subset), row_ids)
+        print(f"  {name}: {len(row_ids)} строк, из каталога {reused}, дописано {len(row_ids) - reused}")
+
+    size = server.write_columnar(args.output, columns, catalog_rows, args.catalog, subsets)
+    total_rows = len(next(iter(columns.values()), []))
+    print(
+        f"Готово: {args.output} — {total_rows} строк, {size / 1024:.0f} KB "
+        f"за {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Массовая предзагрузка границ участков с map.ru в локальный кеш геометрии и
+хранилище границ (data/geometry.sqlite3), чтобы карта не ждала map.ru.
+
+Examples:
+    python prefetch_boundaries.py                          # весь каталог
+    python prefetch_boundaries.py --dataset public/urgent_sales.csv
+    python prefetch_boundaries.py --concurrency 8 --rate 4 --export data/parcels.geojson
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+import server
+
+DEFAULT_CHECKPOINT = server.DATA_DIR / "prefetch_checkpoint.json"
+CHECKPOINT_EVERY = 25
+
+
+def collect_cadastral_numbers(path: Path) -> list[str]:
+    numbers: dict[str, None] = {}
+    with path.open("r", encoding="utf-8", newline="") as fh:
+        for row in csv.DictReader(fh):
+            for number in server.split_cadastral_numbers(row.get("cadastral_number")):
+                numbers.setdefault(number, None)
+    return list(numbers)
+
+
+def load_checkpoint(path: Path) -> dict:
+    if not path.exists():
+        return {"done": [], "failed": {}}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except json.JSONDecodeError:
+        return {"done": [], "failed": {}}
+    return {"done": list(data.get("done", [])), "failed": dict(data.get("failed", {}))}
+
+
+def save_checkpoint(path: Path, done: set[str], failed: dict[str, str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    tmp_path.write_text(
+        json.dumps({"done": sorted(done), "failed": failed, "updated_at": time.time()}, ensure_ascii=False),
+        encoding="utf-8",
+    )
+    os.replace(tmp_path, path)
+
+
+def fetch_with_retry(
+    cache: server.GeometryCache,
+    features: server.FeatureStore,
+    limiter: server.TokenBucket,
+    number: str,
+    retries: int,
+    backoff: float,
+) -> str:
+    attempt = 0
+    while True:
+        if not cache.is_fresh(number):
+            limiter.acquire()
+        try:
+            body, state = cache.get(number)
+        except Exception:  # noqa: BLE001
+            attempt += 1
+            if attempt > retries:
+                raise
+            # Экспоненциальная пауза с разбросом, чтобы потоки не били в map.ru синхронно.
+            time.sleep(backoff * (2 ** (attempt - 1)) * (0.5 + random.random()))
+            continue
+        if state == "HIT" and not features.has(number):
+            features.upsert_from_response(number, body)
+        return "not_found" if server.is_map_not_found(body) else "ok"
+
+
+def export_geojson(features: server.FeatureStore, path: Path) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    count = 0
+    with path.open("w", encoding="utf-8") as fh:
+        fh.write('{"type":"FeatureCollection","features":[\n')
+        for feature in features.iter_features():
+            if count:
+                fh.write(",\n")
+            fh.write(json.dumps(feature, ensure_ascii=False, separators=(",", ":")))
+            count += 1
+        fh.write("\n]}\n")
+    return count
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", type=Path, default=server.PARCELS_CSV_PATH, help="CSV с колонкой cadastral_number")
+    parser.add_argument("--concurrency", type=int, default=4, help="одновременных запросов к map.ru")
+    parser.add_argument("--rate", type=float, default=2.0, help="запросов в секунду к map.ru (0 — без ограничения)")
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--backoff", type=float, default=1.0, help="базовая пауза между повторами, сек")
+    parser.add_argument("--checkpoint", type=Path, default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--reset", action="store_true", help="начать заново, игнорируя checkpoint")
+    parser.add_argument("--limit", type=int, default=0, help="обработать не больше N номеров")
+    parser.add_argument("--export", type=Path, help="выгрузить все сохранённые границы в GeoJSON")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    numbers = collect_cadastral_numbers(args.dataset)
+    checkpoint = {"done": [], "failed": {}} if args.reset else load_checkpoint(args.checkpoint)
+    done = set(checkpoint["done"])
+    failed: dict[str, str] = {}
+    pending = [number for number in numbers if number not in done]
+    already_done = len(numbers) - len(pending)
+    if args.limit:
+        pending = pending[: args.limit]
+
+    print(f"{args.dataset.name}: {len(numbers)} номеров, уже готово {already_done}, в очереди {len(pending)}")
+
+    features = server.get_feature_store()
+    cache = server.get_geometry_cache()
+    limiter = server.TokenBucket(args.rate)
+    lock = threading.Lock()
+    stats = {"ok": 0, "not_found": 0, "failed": 0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+        futures = {
+            pool.submit(fetch_with_retry, cache, features, limiter, number, args.retries, args.backoff): number
+            for number in pending
+        }
+        try:
+            for index, future in enumerate(as_completed(futures), start=1):
+                number = futures[future]
+                with lock:
+                    try:
+                        stats[future.result()] += 1
+                        done.add(number)
+                    except Exception as error:  # noqa: BLE001
+                        stats["failed"] += 1
+                        failed[number] = str(error)
+                    if index % CHECKPOINT_EVERY == 0 or index == len(pending):
+                        save_checkpoint(args.checkpoint, done, failed)
+                        elapsed = time.monotonic() - started
+                        eta = elapsed / index * (len(pending) - index)
+                        print(
+                            f"  {index}/{len(pending)}  ok={stats['ok']} "
+                            f"not_found={stats['not_found']} failed={stats['failed']}  ETA {eta:.0f}s"
+                        )
+        except KeyboardInterrupt:
+            print("\nПрервано — прогресс сохранён, повторный запуск продолжит с этого места.")
+            for future in futures:
+                future.cancel()
+            save_checkpoint(args.checkpoint, done, failed)
+            raise SystemExit(130)
+
+    save_checkpoint(args.checkpoint, done, failed)
+    print(f"Готово: ok={stats['ok']} not_found={stats['not_found']} failed={stats['failed']}, в хранилище {features.count()} границ")
+    if args.export:
+        count = export_geojson(features, args.export)
+        print(f"GeoJSON: {args.export} ({count} объектов)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 const DATA_URL = "all_regions.csv";
+const PARCELS_API_URL = "/parcels";
 const NOTES_API_URL = "/notes";
 const AI_API_URL = "/ai/describe";
 
@@ -28,6 +29,8 @@ const areaMinInput = document.getElementById("areaMin");
 const areaMaxInput = document.getElementById("areaMax");
 const priceMinInput = document.getElementById("priceMin");
 const priceMaxInput = document.getElementById("priceMax");
+const cadastralSuggestions = document.getElementById("cadastralSuggestions");
+const articleSuggestions = document.getElementById("articleSuggestions");
 
 const detailFields = {
   detailsTitle: "cadastral_number",
@@ -104,11 +107,21 @@ const usageDescriptions = {
 };
 
 const PAGE_SIZE = 15;
+const FILTER_DEBOUNCE_MS = 150;
 
 let records = [];
 let filteredRecords = [];
+// remoteMode: фильтрация и постраничная выдача идут на сервере (/parcels),
+// иначе — прежний режим с полным CSV в браузере.
+let remoteMode = false;
+let totalCount = 0;
+let filterTimer = null;
+let filterController = null;
+const suggestTimers = {};
 let selectedRecord = null;
 let notesIndex = {};
+let notesVersion = null;
+let notesEpoch = null;
 let currentNoteEntry = null;
 let visibleCount = 0;
 
@@ -171,6 +184,14 @@ function refreshSelectedRow() {
   }
 }
 
+function isSameRecord(a, b) {
+  if (!a || !b) return false;
+  if (a.row_id !== undefined && b.row_id !== undefined) {
+    return a.row_id === b.row_id;
+  }
+  return a === b;
+}
+
 function buildIndex(data) {
   const regions = new Set();
   data.forEach((row) => {
@@ -180,7 +201,10 @@ function buildIndex(data) {
     }
   });
 
-  const sortedRegions = Array.from(regions).sort((a, b) => a.localeCompare(b, "ru"));
+  populateRegions(Array.from(regions).sort((a, b) => a.localeCompare(b, "ru")));
+}
+
+function populateRegions(sortedRegions) {
   sortedRegions.forEach((region) => {
     const option = document.createElement("option");
     option.value = region;
@@ -191,7 +215,7 @@ function buildIndex(data) {
 
 function updateLoadMoreButton() {
   if (!loadMoreButton) return;
-  const total = filteredRecords.length;
+  const total = remoteMode ? totalCount : filteredRecords.length;
   const hasMore = visibleCount < total;
   loadMoreButton.hidden = !hasMore;
   loadMoreButton.disabled = !hasMore;
@@ -200,7 +224,9 @@ function updateLoadMoreButton() {
 function renderTable(data, options = {}) {
   const { append = false } = options;
 
-  if (!append) {
+  if (remoteMode) {
+    visibleCount = data.length;
+  } else if (!append) {
     visibleCount = Math.min(PAGE_SIZE, data.length);
   } else {
     visibleCount = Math.min(visibleCount + PAGE_SIZE, data.length);
@@ -225,7 +251,7 @@ function renderTable(data, options = {}) {
   });
   resultsBody.appendChild(fragment);
 
-  resultsCount.textContent = data.length;
+  resultsCount.textContent = remoteMode ? totalCount : data.length;
   updateLoadMoreButton();
   refreshSelectedRow();
 }
@@ -276,9 +302,12 @@ function selectRecord(record, rowElement) {
   const matchIndexEl = document.getElementById("detailsMatchIndex");
   if (matchIndexEl) {
     const rawValue = normalizeString(record.cadastral_number_raw);
-    const totalMatches = rawValue
-      ? records.filter((item) => normalizeString(item.cadastral_number_raw) === rawValue).length
-      : 0;
+    let totalMatches = 0;
+    if (typeof record.match_total === "number") {
+      totalMatches = record.match_total;
+    } else if (rawValue) {
+      totalMatches = records.filter((item) => normalizeString(item.cadastral_number_raw) === rawValue).length;
+    }
     const index = Number(record.match_index);
     if (!Number.isNaN(index)) {
       if (totalMatches > 1) {
@@ -391,6 +420,104 @@ function selectRecord(record, rowElement) {
 }
 
 function applyFilters(options = {}) {
+  if (remoteMode) {
+    clearTimeout(filterTimer);
+    filterTimer = setTimeout(() => fetchParcels(options), FILTER_DEBOUNCE_MS);
+    return;
+  }
+  applyLocalFilters(options);
+}
+
+function buildParcelQuery(offset) {
+  const params = new URLSearchParams({ offset: String(offset), limit: String(PAGE_SIZE) });
+  const setParam = (name, value) => {
+    if (value !== null && value !== undefined && value !== "") {
+      params.set(name, String(value));
+    }
+  };
+  setParam("region", regionFilter.value.trim());
+  setParam("cadastral", cadastralSearch.value.trim());
+  setParam("article", articleSearch ? articleSearch.value.trim() : "");
+  setParam("area_min", parseInputNumber(areaMinInput));
+  setParam("area_max", parseInputNumber(areaMaxInput));
+  setParam("price_min", parseInputNumber(priceMinInput));
+  setParam("price_max", parseInputNumber(priceMaxInput));
+  return params;
+}
+
+function requestSuggestions(field, inputElement, listElement) {
+  if (!remoteMode || !inputElement || !listElement) return;
+  clearTimeout(suggestTimers[field]);
+  const query = inputElement.value.trim();
+  if (!query) {
+    listElement.innerHTML = "";
+    return;
+  }
+  suggestTimers[field] = setTimeout(async () => {
+    try {
+      const params = new URLSearchParams({ q: query, field, limit: "10" });
+      const response = await fetch(`${PARCELS_API_URL}/suggest?${params}`);
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      const data = await response.json();
+      if (inputElement.value.trim() !== query) return;
+      listElement.innerHTML = (data[field] || [])
+        .map((item) => `<option value="${escapeHtml(String(item.value))}"></option>`)
+        .join("");
+    } catch (error) {
+      console.warn("Не удалось получить подсказки", error);
+    }
+  }, FILTER_DEBOUNCE_MS);
+}
+
+async function fetchParcels(options = {}) {
+  const { autoSelect = false, append = false } = options;
+  if (filterController) {
+    filterController.abort();
+  }
+  const controller = new AbortController();
+  filterController = controller;
+  const offset = append ? filteredRecords.length : 0;
+
+  try {
+    const response = await fetch(`${PARCELS_API_URL}?${buildParcelQuery(offset)}`, {
+      signal: controller.signal,
+    });
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    const data = await response.json();
+    totalCount = data.total;
+    filteredRecords = append ? filteredRecords.concat(data.items) : data.items;
+
+    if (!append && selectedRecord) {
+      const match = filteredRecords.find((row) => isSameRecord(row, selectedRecord));
+      if (match) {
+        selectedRecord = match;
+      } else {
+        clearSelection();
+      }
+    }
+    renderTable(filteredRecords, { append });
+
+    if (!append && autoSelect && filteredRecords.length > 0) {
+      const firstRow = resultsBody.querySelector("tr");
+      if (firstRow) {
+        selectRecord(filteredRecords[0], firstRow);
+      }
+    }
+  } catch (error) {
+    if (error.name === "AbortError") return;
+    console.error("Не удалось получить участки", error);
+  } finally {
+    if (filterController === controller) {
+      filterController = null;
+    }
+  }
+}
+
+function applyLocalFilters(options = {}) {
   const { autoSelect = false } = options;
   const regionValue = regionFilter.value.trim();
   const cadastralValue = cadastralSearch.value.trim().toLowerCase();
@@ -497,6 +624,44 @@ function handleGenerate() {
   descriptionDraft.value = fragments.join("\n\n");
 }
 
+async function readGptStream(response, onText) {
+  const contentType = response.headers.get("Content-Type") || "";
+  if (!contentType.includes("text/event-stream") || !response.body) {
+    return response.json();
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let text = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      const event = /^event: (.*)$/m.exec(block)?.[1];
+      const dataLine = /^data: (.*)$/m.exec(block)?.[1];
+      if (!event || !dataLine) continue;
+      const payload = JSON.parse(dataLine);
+      if (event === "delta") {
+        text += payload.text;
+        onText(text);
+      } else if (event === "reset") {
+        text = payload.text;
+        onText(text);
+      } else if (event === "done") {
+        return payload;
+      } else if (event === "error") {
+        throw new Error(payload.details || payload.error);
+      }
+    }
+  }
+  return { text };
+}
+
 async function handleGenerateGpt() {
   if (!selectedRecord || !generateGptButton) return;
 
@@ -511,7 +676,7 @@ async function handleGenerateGpt() {
     : descriptionDraft.value.trim();
 
   try {
-    const response = await fetch(AI_API_URL, {
+    const response = await fetch(`${AI_API_URL}?stream=1`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
@@ -525,7 +690,9 @@ async function handleGenerateGpt() {
       throw new Error(message || `HTTP ${response.status}`);
     }
 
-    const data = await response.json();
+    const data = await readGptStream(response, (text) => {
+      descriptionDraft.value = text;
+    });
     if (data && typeof data.text === "string" && data.text.trim()) {
       descriptionDraft.value = data.text.trim();
       if (primary) {
@@ -937,7 +1104,10 @@ function handleExportPdf() {
 
 function initEvents() {
   regionFilter.addEventListener("change", () => applyFilters({ autoSelect: true }));
-  cadastralSearch.addEventListener("input", () => applyFilters());
+  cadastralSearch.addEventListener("input", () => {
+    applyFilters();
+    requestSuggestions("cadastral", cadastralSearch, cadastralSuggestions);
+  });
   resetButton.addEventListener("click", handleReset);
   generateButton.addEventListener("click", handleGenerate);
   if (generateGptButton) {
@@ -947,7 +1117,10 @@ function initEvents() {
   copyLinkButton.addEventListener("click", handleCopyLink);
   openLinkButton.addEventListener("click", handleOpenLink);
   if (articleSearch) {
-    articleSearch.addEventListener("input", () => applyFilters());
+    articleSearch.addEventListener("input", () => {
+      applyFilters();
+      requestSuggestions("article", articleSearch, articleSuggestions);
+    });
   }
   [areaMinInput, areaMaxInput, priceMinInput, priceMaxInput].forEach((input) => {
     if (input) {
@@ -968,7 +1141,24 @@ function initEvents() {
   }
 }
 
-function loadData() {
+async function loadData() {
+  try {
+    const response = await fetch(`${PARCELS_API_URL}/regions`);
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    const data = await response.json();
+    remoteMode = true;
+    populateRegions(data.regions.map((region) => region.name));
+    applyFilters({ autoSelect: true });
+    loadNotes();
+  } catch (error) {
+    console.warn("Каталог на сервере недоступен, загружаю CSV целиком", error);
+    loadCsvData();
+  }
+}
+
+function loadCsvData() {
   Papa.parse(DATA_URL, {
     download: true,
     header: true,
@@ -989,7 +1179,8 @@ function loadData() {
 
 async function loadNotes() {
   try {
-    const response = await fetch(NOTES_API_URL, { cache: "no-store" });
+    // no-cache: браузер перепроверяет копию по ETag и получает 304, если заметки не менялись.
+    const response = await fetch(NOTES_API_URL, { cache: "no-cache" });
     if (!response.ok) {
       throw new Error(`HTTP ${response.status}`);
     }
@@ -999,6 +1190,9 @@ async function loadNotes() {
     } else {
       notesIndex = {};
     }
+    const version = Number(response.headers.get("X-Notes-Version"));
+    notesVersion = Number.isFinite(version) ? version : null;
+    notesEpoch = response.headers.get("X-Notes-Epoch");
     refreshSelectedRow();
   } catch (error) {
     console.warn("Не удалось загрузить заметки", error);
@@ -1006,6 +1200,32 @@ async function loadNotes() {
   }
 }
 
+async function syncNotes() {
+  if (notesVersion === null) {
+    return loadNotes();
+  }
+  try {
+    const params = new URLSearchParams({ since: String(notesVersion) });
+    if (notesEpoch) {
+      params.set("epoch", notesEpoch);
+    }
+    const response = await fetch(`${NOTES_API_URL}?${params}`, { cache: "no-store" });
+    if (!response.ok) {
+      throw new Error(`HTTP ${response.status}`);
+    }
+    const data = await response.json();
+    if (!data || typeof data.changes !== "object") return;
+    notesIndex = data.full ? data.changes : { ...notesIndex, ...data.changes };
+    notesVersion = data.version;
+    notesEpoch = data.epoch;
+    if (data.full || Object.keys(data.changes).length) {
+      refreshSelectedRow();
+    }
+  } catch (error) {
+    console.warn("Не удалось обновить заметки", error);
+  }
+}
+
 async function saveNote(partialPayload, buttonElement, successLabel) {
   if (!selectedRecord) return;
   const cadastral = getPrimaryCadastral(selectedRecord);
@@ -1051,8 +1271,17 @@ document.addEventListener("DOMContentLoaded", () => {
   initEvents();
   if (loadMoreButton) {
     loadMoreButton.addEventListener("click", () => {
-      renderTable(filteredRecords, { append: true });
+      if (remoteMode) {
+        fetchParcels({ append: true });
+      } else {
+        renderTable(filteredRecords, { append: true });
+      }
     });
   }
+  document.addEventListener("visibilitychange", () => {
+    if (document.visibilityState === "visible") {
+      syncNotes();
+    }
+  });
   loadData();
 });
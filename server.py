@@ -5,17 +5,52 @@
 Использует стандартную библиотеку Python, чтобы не требовать дополнительных зависимостей.
 """
 
+import abc
+import argparse
+import asyncio
+import bisect
+import copy
+import csv
+import gzip
+import hashlib
+import http.client
+import io
 import json
+import math
 import mimetypes
+import mmap
 import os
+import random
+import re
+import select
+import signal
+import socket
+import sqlite3
+import ssl
+import struct
+import sys
 import threading
-import urllib.error
-import urllib.request
+import time
+import uuid
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, parsedate_to_datetime
 from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
-from typing import Dict, Any
-from urllib.parse import parse_qs, unquote, urlparse
+from typing import Any, Callable, Dict, Iterator, Optional
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировки только между потоками одного процесса
+    fcntl = None
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него отдаём gzip
+    brotli = None
 
 
 ROOT_DIR = Path(__file__).resolve().parent
@@ -23,13 +58,16 @@ DATA_DIR = ROOT_DIR / "data"
 DATA_PATH = DATA_DIR / "notes.json"
 PUBLIC_DIR = ROOT_DIR / "public"
 
-LOCK = threading.Lock()
-YANDEX_GPT_API_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+YANDEX_GPT_API_URL = (
+    os.getenv("YANDEX_GPT_API_URL", "").strip()
+    or "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+)
 YANDEX_GPT_API_KEY = os.getenv("YANDEX_GPT_API_KEY", "").strip()
 YANDEX_GPT_MODEL_URI = os.getenv("YANDEX_GPT_MODEL_URI", "").strip()
 YANDEX_GPT_ENABLED = bool(YANDEX_GPT_API_KEY and YANDEX_GPT_MODEL_URI)
 YANDEX_GPT_SYSTEM_PROMPT = os.getenv("YANDEX_GPT_SYSTEM_PROMPT", "").strip()
 YANDEX_GPT_FOLDER_ID = os.getenv("YANDEX_GPT_FOLDER_ID", "").strip()
+YANDEX_GPT_TIMEOUT = float(os.getenv("YANDEX_GPT_TIMEOUT", "60"))
 
 DEFAULT_SYSTEM_PROMPT = (
     "Вы — профессиональный аналитик и копирайтер в сфере земельной недвижимости. "
@@ -56,6 +94,10 @@ DEFAULT_SYSTEM_PROMPT = (
 )
 
 SYSTEM_PROMPT = YANDEX_GPT_SYSTEM_PROMPT or DEFAULT_SYSTEM_PROMPT
+YANDEX_GPT_COMPLETION_OPTIONS = {
+    "temperature": 0.25,
+    "maxTokens": 1000,
+}
 
 SUMMARY_FIELDS = [
     ("Кадастровый номер", "cadastral_number"),
@@ -76,15 +118,21 @@ SUMMARY_FIELDS = [
 ]
 
 
-def ensure_data_file() -> None:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    if not DATA_PATH.exists():
-        DATA_PATH.write_text("{}", encoding="utf-8")
+NOTES_BACKEND = os.getenv("NOTES_BACKEND", "sqlite").strip().lower()
+NOTES_DB_PATH = DATA_DIR / "notes.sqlite3"
+NOTES_COMPACT_EVERY = int(os.getenv("NOTES_COMPACT_EVERY", "500"))
+NOTE_FIELDS = ("description", "avito_link")
 
 
-def load_notes() -> Dict[str, Dict[str, Any]]:
-    ensure_data_file()
-    with DATA_PATH.open("r", encoding="utf-8") as fh:
+def ensure_data_file(path: Path = DATA_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists():
+        path.write_text("{}", encoding="utf-8")
+
+
+def load_notes(path: Path = DATA_PATH) -> Dict[str, Dict[str, Any]]:
+    ensure_data_file(path)
+    with path.open("r", encoding="utf-8") as fh:
         try:
             data = json.load(fh)
             if isinstance(data, dict):
@@ -94,118 +142,4455 @@ def load_notes() -> Dict[str, Dict[str, Any]]:
     return {}
 
 
-def save_notes(notes: Dict[str, Dict[str, Any]]) -> None:
-    ensure_data_file()
-    with DATA_PATH.open("w", encoding="utf-8") as fh:
+def save_notes(notes: Dict[str, Dict[str, Any]], path: Path = DATA_PATH) -> None:
+    # Пишем во временный файл и атомарно подменяем, чтобы падение посреди
+    # записи не оставило обрезанный notes.json.
+    ensure_data_file(path)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as fh:
         json.dump(notes, fh, ensure_ascii=False, indent=2)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
 
 
-def humanize_value(value: Any) -> str:
-    if value is None:
+def connect_sqlite(path: Path) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class FileLock:
+    """
+    Исключительная блокировка и между процессами (flock на файле-замке), и
+    между потоками одного процесса. Файл открывается на каждый захват, чтобы
+    унаследованный после fork дескриптор не делил блокировку с родителем.
+    """
+
+    def __init__(self, path: Path, name: str = "") -> None:
+        self.path = path
+        self.name = name or path.stem
+        self._thread_lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._acquired_at = 0.0
+
+    def __enter__(self) -> "FileLock":
+        started = time.perf_counter()
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+        self._acquired_at = time.perf_counter()
+        METRICS.observe("lock_wait_seconds", self._acquired_at - started, METRICS_LOCK_BUCKETS, lock=self.name)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        held = time.perf_counter() - self._acquired_at
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        self._thread_lock.release()
+        METRICS.observe("lock_hold_seconds", held, METRICS_LOCK_BUCKETS, lock=self.name)
+
+
+NOTES_LOCK = FileLock(DATA_DIR / "notes.lock", name="notes")
+
+
+# --- Metrics ------------------------------------------------------------
+#
+# Счётчики и гистограммы в памяти процесса, GET /metrics отдаёт их в
+# текстовом формате Prometheus. В режиме --workers у каждого воркера свои
+# значения (метка pid в notes_server_process_info).
+
+METRICS_PREFIX = "notes_server"
+METRICS_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_LOCK_BUCKETS = (0.00001, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "0"))
+SLOW_REQUEST_SAMPLE_INTERVAL = float(os.getenv("SLOW_REQUEST_SAMPLE_INTERVAL", "0.005"))
+SLOW_REQUEST_TOP_STACKS = 5
+
+METRIC_HELP = {
+    "http_requests_total": ("counter", "HTTP requests by route and status"),
+    "http_request_duration_seconds": ("histogram", "HTTP request handling time"),
+    "http_response_size_bytes": ("histogram", "HTTP response body size"),
+    "http_slow_requests_total": ("counter", "Requests slower than SLOW_REQUEST_SECONDS"),
+    "upstream_requests_total": ("counter", "Upstream requests by outcome"),
+    "upstream_request_duration_seconds": ("histogram", "Upstream time to response headers"),
+    "lock_wait_seconds": ("histogram", "Time spent waiting to acquire a lock"),
+    "lock_hold_seconds": ("histogram", "Time a lock was held"),
+}
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
         return ""
-    if isinstance(value, bool):
-        return "да" if value else "нет"
-    if isinstance(value, (int, float)):
-        return f"{value:,}".replace(",", " ")
-    return str(value).strip()
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
 
 
-def build_prompt(record: Dict[str, Any], existing_note: Any, instruction: Any) -> str:
-    lines: list[str] = []
-    for label, key in SUMMARY_FIELDS:
-        value = humanize_value(record.get(key))
-        if value:
-            lines.append(f"- {label}: {value}")
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
 
-    if not lines:
-        lines.append("- информации почти нет — коротко отметь это, не выдумывая фактов.")
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
 
-    extras: list[str] = []
-    if instruction:
-        extras.append(f"- Особые пожелания менеджера: {instruction}")
-    if existing_note:
-        extras.append(f"- Текущий черновик клиента (если нужно улучшить): {existing_note}")
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
 
-    prompt_sections = [
-        "Исходные данные по участку (используй факты без искажений):",
-        "\n".join(lines),
+
+class Metrics:
+    """Реестр метрик процесса: счётчики и гистограммы с метками."""
+
+    def __init__(self) -> None:
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = METRICS_LATENCY_BUCKETS, **labels: Any) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    def render(self) -> str:
+        lines: list[str] = []
+
+        def header(name: str, kind: str) -> None:
+            help_text = METRIC_HELP.get(name, (kind, name.replace("_", " ")))[1]
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: (h.buckets, list(h.counts), h.total, h.count) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+        for name in sorted(counters):
+            header(name, "counter")
+            for labels, value in sorted(counters[name].items()):
+                lines.append(f"{METRICS_PREFIX}_{name}{_format_labels(labels)} {_format_value(value)}")
+        for name in sorted(histograms):
+            header(name, "histogram")
+            for labels, (buckets, counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    bound_label = "+Inf" if bound == math.inf else f"{bound:g}"
+                    lines.append(
+                        f"{METRICS_PREFIX}_{name}_bucket{_format_labels(labels + (('le', bound_label),))} {cumulative}"
+                    )
+                lines.append(f"{METRICS_PREFIX}_{name}_sum{_format_labels(labels)} {total:.6f}")
+                lines.append(f"{METRICS_PREFIX}_{name}_count{_format_labels(labels)} {count}")
+        for name, kind, help_text, samples in collect_runtime_metrics():
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{METRICS_PREFIX}_{name}{_format_labels(tuple(labels.items()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+WORKER_INDEX: Optional[int] = None
+
+
+def collect_runtime_metrics() -> list[tuple[str, str, str, list[tuple[Dict[str, Any], float]]]]:
+    """Значения, которые читаются в момент запроса /metrics: потоки, пулы, кеши."""
+    metrics: list[tuple[str, str, str, list[tuple[Dict[str, Any], float]]]] = [
+        ("process_info", "gauge", "Serving process", [({"pid": os.getpid(), "worker": WORKER_INDEX if WORKER_INDEX is not None else ""}, 1)]),
+        ("threads", "gauge", "Active Python threads", [({}, threading.active_count())]),
+        ("http_requests_in_flight", "gauge", "Requests being handled", [({}, len(_ACTIVE_REQUESTS))]),
     ]
 
-    if extras:
-        prompt_sections.extend(["", "Дополнительные пометки:", *extras])
+    pools = upstream_stats()
+    metrics.append(("upstream_connections_in_use", "gauge", "Upstream connections checked out",
+                    [({"upstream": name}, stats["in_use"]) for name, stats in pools.items()]))
+    metrics.append(("upstream_connections_idle", "gauge", "Idle keep-alive upstream connections",
+                    [({"upstream": name}, stats["idle"]) for name, stats in pools.items()]))
+    metrics.append(("upstream_circuit_open", "gauge", "1 while the upstream circuit breaker is open",
+                    [({"upstream": name}, int(stats["circuit"] == "open")) for name, stats in pools.items()]))
+
+    with _GEOMETRY_CACHE_COUNTS_LOCK:
+        geometry = (_GEOMETRY_CACHE_COUNTS["hit"], _GEOMETRY_CACHE_COUNTS["miss"])
+    caches: Dict[str, tuple[int, int]] = {
+        "static": (_STATIC_CACHE.hits, _STATIC_CACHE.misses),
+        "tiles": (_TILE_CACHE.hits, _TILE_CACHE.misses),
+        "geometry": geometry,
+    }
+    if _AI_CACHE is not None:
+        caches["ai"] = (_AI_CACHE.hits, _AI_CACHE.misses)
+    if _PARCELS is not None:
+        caches["parcels_query"] = (_PARCELS.query_hits, _PARCELS.query_misses)
+    metrics.append(("cache_hits_total", "counter", "Cache hits",
+                    [({"cache": name}, hits) for name, (hits, _) in caches.items()]))
+    metrics.append(("cache_misses_total", "counter", "Cache misses",
+                    [({"cache": name}, misses) for name, (_, misses) in caches.items()]))
+    metrics.append(("cache_hit_ratio", "gauge", "Cache hits / lookups since start",
+                    [({"cache": name}, hits / (hits + misses)) for name, (hits, misses) in caches.items() if hits + misses]))
+
+    if _PARCELS is not None:
+        metrics.append(("dataset_rows", "gauge", "Rows in the parcel catalog snapshot", [({}, _PARCELS.size)]))
+        metrics.append(("dataset_version", "gauge", "Parcel catalog snapshot version", [({}, _PARCELS.version)]))
+    return metrics
+
+
+class RequestTrace:
+    """Выполняющийся запрос: для медленного лога копятся сэмплы стека его потока."""
+
+    __slots__ = ("label", "started", "samples")
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.started = time.perf_counter()
+        self.samples: Dict[str, int] = {}
+
+
+_ACTIVE_REQUESTS: Dict[int, RequestTrace] = {}
+# /proxy-map: HIT — из кеша, остальное (MISS, STALE, REFRESH) — считалось промахом.
+_GEOMETRY_CACHE_COUNTS = {"hit": 0, "miss": 0}
+# += над словарём не атомарен: без блокировки параллельные запросы теряют отсчёты.
+_GEOMETRY_CACHE_COUNTS_LOCK = threading.Lock()
+_SAMPLER_LOCK = threading.Lock()
+_SAMPLER: Optional[threading.Thread] = None
+# Сэмплер дописывает trace.samples из своей копии _ACTIVE_REQUESTS и после
+# завершения запроса, поэтому и запись, и чтение сэмплов — под этим замком.
+_TRACE_SAMPLES_LOCK = threading.Lock()
+
+
+def _collapse_stack(frame: Any) -> str:
+    """Стек в строку «внешний;…;внутренний» (формат flamegraph), только кадры проекта."""
+    names: list[str] = []
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(str(ROOT_DIR)):
+            names.append(f"{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names)) or "<stdlib>"
+
+
+def _sample_stacks() -> None:
+    while True:
+        time.sleep(SLOW_REQUEST_SAMPLE_INTERVAL)
+        if not _ACTIVE_REQUESTS:
+            continue
+        frames = sys._current_frames()
+        for thread_id, trace in list(_ACTIVE_REQUESTS.items()):
+            frame = frames.get(thread_id)
+            if frame is not None:
+                stack = _collapse_stack(frame)
+                with _TRACE_SAMPLES_LOCK:
+                    trace.samples[stack] = trace.samples.get(stack, 0) + 1
+
+
+def begin_request_trace(label: str) -> RequestTrace:
+    global _SAMPLER
+    trace = RequestTrace(label)
+    _ACTIVE_REQUESTS[threading.get_ident()] = trace
+    if SLOW_REQUEST_SECONDS > 0 and _SAMPLER is None:
+        with _SAMPLER_LOCK:
+            if _SAMPLER is None:
+                _SAMPLER = threading.Thread(target=_sample_stacks, name="stack-sampler", daemon=True)
+                _SAMPLER.start()
+    return trace
+
+
+def end_request_trace(trace: RequestTrace, method: str, route: str, status: str, size: int) -> None:
+    _ACTIVE_REQUESTS.pop(threading.get_ident(), None)
+    elapsed = time.perf_counter() - trace.started
+    METRICS.inc("http_requests_total", method=method, route=route, status=status)
+    METRICS.observe("http_request_duration_seconds", elapsed, method=method, route=route)
+    METRICS.observe("http_response_size_bytes", size, METRICS_SIZE_BUCKETS, method=method, route=route)
+    if SLOW_REQUEST_SECONDS > 0 and elapsed >= SLOW_REQUEST_SECONDS:
+        METRICS.inc("http_slow_requests_total", method=method, route=route)
+        with _TRACE_SAMPLES_LOCK:
+            samples = dict(trace.samples)
+        total = sum(samples.values())
+        print(f"[slow] {trace.label} {status} {elapsed * 1000:.0f} ms, {size} B, сэмплов стека: {total}")
+        for stack, count in sorted(samples.items(), key=lambda item: -item[1])[:SLOW_REQUEST_TOP_STACKS]:
+            print(f"[slow]   {count * 100 // max(total, 1):3d}%  {stack}")
+
+
+def route_label(path: str) -> str:
+    """Шаблон маршрута для меток: без кадастровых номеров и идентификаторов."""
+    path = urlparse(path).path
+    if path.startswith("/notes/"):
+        return "/notes/<cad>"
+    if path.startswith("/ai/jobs/"):
+        return "/ai/jobs/<id>"
+    if path.startswith("/tiles/"):
+        return "/tiles/<z>/<x>/<y>"
+    if path in KNOWN_ROUTES:
+        return path
+    return "static"
+
+
+KNOWN_ROUTES = frozenset(
+    {
+        "/notes", "/parcels", "/parcels/regions", "/parcels/subsets", "/parcels/snapshot", "/parcels/search",
+        "/parcels/suggest", "/parcels/within", "/stats", "/proxy-map", "/upstreams", "/metrics",
+        "/ai/cache", "/ai/describe", "/ai/describe/batch", "/knowledge/context",
+    }
+)
+
+
+# --- Notes storage ------------------------------------------------------
+
+
+class NotesStore(abc.ABC):
+    """Хранилище заметок менеджеров по кадастровым номерам."""
+
+    @abc.abstractmethod
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def get(self, cadastral: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def upsert(self, cadastral: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        ...
+
+    @abc.abstractmethod
+    def version(self) -> int:
+        """Монотонный номер последней записи."""
+
+    @abc.abstractmethod
+    def epoch(self) -> str:
+        """Идентификатор «жизни» счётчика версий: при его смене клиенту нужна полная выгрузка."""
+
+    @abc.abstractmethod
+    def changes_since(self, version: int) -> Dict[str, Dict[str, Any]]:
+        ...
+
+    def compact(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JsonNotesStore(NotesStore):
+    """
+    Прежний формат: весь словарь в data/notes.json, переписывается целиком.
+    Счётчик версий лежит рядом, в notes.versions.json, и общий для всех
+    процессов --workers. Там же запомнена подпись notes.json (inode, mtime,
+    размер) после последней записи через сервер: если файл поменяли в обход
+    сервера, начинается новая эпоха и клиенты получают полную выгрузку.
+    """
+
+    def __init__(self, path: Path = DATA_PATH) -> None:
+        self.path = path
+        self.versions_path = path.with_name(f"{path.stem}.versions.json")
+        self._lock = threading.Lock()
+        self._state: Dict[str, Any] = {}
+        self._state_signature: Optional[tuple] = None
+
+    @staticmethod
+    def _signature(path: Path) -> Optional[tuple]:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _read_state(self) -> Dict[str, Any]:
+        """Состояние версий с диска; перечитывается, только если файл версий сменился."""
+        signature = self._signature(self.versions_path)
+        with self._lock:
+            if signature is not None and signature == self._state_signature:
+                return self._state
+        state: Dict[str, Any] = {}
+        if signature is not None:
+            try:
+                state = json.loads(self.versions_path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                state = {}
+        with self._lock:
+            self._state, self._state_signature = state, signature
+        return state
+
+    def _write_state(self, state: Dict[str, Any]) -> None:
+        tmp_path = self.versions_path.with_name(f"{self.versions_path.name}.tmp")
+        tmp_path.write_text(json.dumps(state, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.versions_path)
+        with self._lock:
+            self._state, self._state_signature = state, self._signature(self.versions_path)
+
+    def _current_state(self) -> Dict[str, Any]:
+        state = self._read_state()
+        if state.get("epoch") and state.get("notes") == list(self._signature(self.path) or ()):
+            return state
+        with NOTES_LOCK:
+            return self._locked_state()
+
+    def _locked_state(self) -> Dict[str, Any]:
+        """Состояние версий под NOTES_LOCK; notes.json изменён в обход сервера — новая эпоха."""
+        state = self._read_state()
+        ensure_data_file(self.path)
+        notes_signature = list(self._signature(self.path) or ())
+        if state.get("epoch") and state.get("notes") == notes_signature:
+            return state
+        state = {
+            "epoch": uuid.uuid4().hex[:12],
+            "version": int(state.get("version", 0)) + 1,
+            "versions": {},
+            "notes": notes_signature,
+        }
+        self._write_state(state)
+        return state
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        with NOTES_LOCK:
+            return load_notes(self.path)
+
+    def get(self, cadastral: str) -> Optional[Dict[str, Any]]:
+        return self.all().get(cadastral)
+
+    def upsert(self, cadastral: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        with NOTES_LOCK:
+            state = self._locked_state()
+            notes = load_notes(self.path)
+            entry = notes.get(cadastral, {})
+            entry.update(fields)
+            notes[cadastral] = entry
+            save_notes(notes, self.path)
+            version = int(state["version"]) + 1
+            self._write_state(
+                {
+                    "epoch": state["epoch"],
+                    "version": version,
+                    "versions": {**state.get("versions", {}), cadastral: version},
+                    "notes": list(self._signature(self.path) or ()),
+                }
+            )
+        return entry
+
+    def version(self) -> int:
+        return int(self._current_state()["version"])
+
+    def epoch(self) -> str:
+        return str(self._current_state()["epoch"])
+
+    def changes_since(self, version: int) -> Dict[str, Dict[str, Any]]:
+        versions = self._current_state().get("versions", {})
+        notes = self.all()
+        return {
+            cadastral: entry
+            for cadastral, entry in notes.items()
+            if versions.get(cadastral, 1) > version
+        }
+
+
+class SqliteNotesStore(NotesStore):
+    """
+    Заметки в SQLite (WAL): запись затрагивает одну строку, читатели не
+    блокируются писателями, а незавершённая транзакция откатывается при сбое.
+    Писатели разных процессов упорядочивает сам SQLite (BEGIN IMMEDIATE),
+    счётчик версий лежит в базе и общий для всех процессов.
+    """
+
+    def __init__(self, path: Path, legacy_path: Optional[Path] = None) -> None:
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        # Схему и миграцию процессы-воркеры выполняют по очереди.
+        with NOTES_LOCK:
+            conn = self._conn()
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS notes ("
+                " cadastral TEXT PRIMARY KEY,"
+                " data TEXT NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 1)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(notes)")}
+            if "version" not in columns:
+                conn.execute("ALTER TABLE notes ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+            conn.execute("CREATE INDEX IF NOT EXISTS notes_version ON notes (version)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', '1')")
+            conn.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)",
+                (uuid.uuid4().hex[:12],),
+            )
+            self._epoch = conn.execute("SELECT value FROM meta WHERE key='epoch'").fetchone()[0]
+            if legacy_path is not None:
+                self._migrate_from_json(conn, legacy_path)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+        return conn
+
+    def _migrate_from_json(self, conn: sqlite3.Connection, legacy_path: Path) -> None:
+        if conn.execute("SELECT 1 FROM meta WHERE key='migrated_from_json'").fetchone():
+            return
+        legacy: Dict[str, Any] = {}
+        if legacy_path.exists():
+            try:
+                data = json.loads(legacy_path.read_text(encoding="utf-8") or "{}")
+                if isinstance(data, dict):
+                    legacy = data
+            except json.JSONDecodeError:
+                print(f"[notes] {legacy_path} повреждён, миграция пропущена")
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO notes (cadastral, data, updated_at) VALUES (?, ?, ?)",
+                [
+                    (str(cadastral), json.dumps(entry, ensure_ascii=False), now)
+                    for cadastral, entry in legacy.items()
+                    if isinstance(entry, dict)
+                ],
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)",
+                (str(len(legacy)),),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if legacy:
+            print(f"[notes] перенесено заметок из {legacy_path.name}: {len(legacy)}")
+
+    def all(self) -> Dict[str, Dict[str, Any]]:
+        rows = self._conn().execute("SELECT cadastral, data FROM notes").fetchall()
+        return {cadastral: json.loads(data) for cadastral, data in rows}
+
+    def get(self, cadastral: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute(
+            "SELECT data FROM notes WHERE cadastral=?", (cadastral,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def upsert(self, cadastral: str, fields: Dict[str, Any]) -> Dict[str, Any]:
+        conn = self._conn()
+        # Ожидание BEGIN IMMEDIATE — это очередь за блокировкой записи SQLite.
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        acquired = time.perf_counter()
+        METRICS.observe("lock_wait_seconds", acquired - started, METRICS_LOCK_BUCKETS, lock="notes_sqlite")
+        try:
+            row = conn.execute(
+                "SELECT data FROM notes WHERE cadastral=?", (cadastral,)
+            ).fetchone()
+            entry = json.loads(row[0]) if row else {}
+            entry.update(fields)
+            version = self._read_version(conn) + 1
+            conn.execute("UPDATE meta SET value=? WHERE key='version'", (str(version),))
+            conn.execute(
+                "INSERT INTO notes (cadastral, data, updated_at, version) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(cadastral) DO UPDATE SET "
+                "data=excluded.data, updated_at=excluded.updated_at, version=excluded.version",
+                (cadastral, json.dumps(entry, ensure_ascii=False), time.time(), version),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            METRICS.observe(
+                "lock_hold_seconds", time.perf_counter() - acquired, METRICS_LOCK_BUCKETS, lock="notes_sqlite"
+            )
+        with self._lock:
+            self._writes += 1
+            should_compact = NOTES_COMPACT_EVERY > 0 and self._writes % NOTES_COMPACT_EVERY == 0
+        if should_compact:
+            self.compact()
+        return entry
+
+    @staticmethod
+    def _read_version(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM meta WHERE key='version'").fetchone()
+        return int(row[0]) if row else 1
+
+    def version(self) -> int:
+        return self._read_version(self._conn())
+
+    def epoch(self) -> str:
+        return self._epoch
+
+    def changes_since(self, version: int) -> Dict[str, Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT cadastral, data FROM notes WHERE version > ?", (version,)
+        ).fetchall()
+        return {cadastral: json.loads(data) for cadastral, data in rows}
+
+    def compact(self) -> None:
+        # Переносим WAL в основной файл и обрезаем журнал, чтобы он не рос бесконечно.
+        self._conn().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self) -> None:
+        """
+        Закрывает соединение только вызывающего потока. Соединения других
+        потоков закрываются, когда те завершаются и освобождают threading.local;
+        держать их в общем списке нельзя — потоковый сервер заводит поток на
+        каждый запрос, и список удерживал бы соединения давно завершённых.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class NotesCache:
+    """
+    Готовый к отдаче JSON всех заметок. Пересобирается, только когда версия
+    хранилища ушла вперёд, поэтому повторные GET /notes не трогают диск.
+    """
+
+    def __init__(self, store: NotesStore) -> None:
+        self.store = store
+        self._lock = threading.Lock()
+        self._version = -1
+        self._payload = b"{}"
+        self._etag = ""
+
+    def snapshot(self) -> tuple[int, str, bytes]:
+        with self._lock:
+            version = self.store.version()
+            if version != self._version:
+                # Payload помечаем версией, прочитанной до выгрузки: запись между
+                # version() и all() даст лишнюю пересборку, но не устаревшие данные
+                # под новой версией (и 304 на них до следующей записи).
+                notes = self.store.all()
+                self._payload = json.dumps(notes, ensure_ascii=False).encode("utf-8")
+                self._version = version
+                self._etag = f'"notes-{self.store.epoch()}-{version}"'
+            return self._version, self._etag, self._payload
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._version = -1
+
+
+_NOTES_STORE: Optional[NotesStore] = None
+_NOTES_CACHE: Optional[NotesCache] = None
+_NOTES_STORE_LOCK = threading.Lock()
+
+
+def create_notes_store() -> NotesStore:
+    if NOTES_BACKEND == "json":
+        ensure_data_file()
+        return JsonNotesStore()
+    if NOTES_BACKEND != "sqlite":
+        raise RuntimeError(f"Unknown NOTES_BACKEND: {NOTES_BACKEND}")
+    return SqliteNotesStore(NOTES_DB_PATH, legacy_path=DATA_PATH)
+
+
+def get_notes_store() -> NotesStore:
+    global _NOTES_STORE
+    if _NOTES_STORE is None:
+        with _NOTES_STORE_LOCK:
+            if _NOTES_STORE is None:
+                _NOTES_STORE = create_notes_store()
+    return _NOTES_STORE
+
+
+def get_notes_cache() -> NotesCache:
+    global _NOTES_CACHE
+    if _NOTES_CACHE is None:
+        store = get_notes_store()
+        with _NOTES_STORE_LOCK:
+            if _NOTES_CACHE is None:
+                _NOTES_CACHE = NotesCache(store)
+    return _NOTES_CACHE
+
+
+# --- Parcels dataset ----------------------------------------------------
+
+PARCELS_CSV_PATH = Path(os.getenv("PARCELS_CSV", "").strip() or PUBLIC_DIR / "all_regions.csv")
+PARCELS_BIN_PATH = Path(os.getenv("PARCELS_BIN", "").strip() or DATA_DIR / "parcels.bin")
+# Подборки из public/<name>.csv; в parcels.bin хранятся как списки номеров строк.
+PARCEL_SUBSETS = ("urgent_sales", "kedrograd", "avito_mentions")
+PARCELS_PAGE_LIMIT = 50
+PARCELS_MAX_LIMIT = 500
+PARCELS_QUERY_CACHE_SIZE = 64
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+NUMERIC_COLUMNS = frozenset(
+    {
+        "number",
+        "source_row",
+        "match_index",
+        "area_ha",
+        "price_per_sotka_rub",
+        "price_per_plot_rub",
+        "sale_price_rub",
+        "discount_limit_percent",
+        "balance_value",
+        "valuation_per_sotka",
+        "valuation_per_plot",
+    }
+)
+# Колонки, по которым есть отсортированный индекс: фильтр диапазона и сортировка.
+RANGE_COLUMNS = ("area_ha", "price_per_plot_rub", "price_per_sotka_rub")
+RANGE_PARAMS = {
+    "area": "area_ha",
+    "price": "price_per_plot_rub",
+    "price_sotka": "price_per_sotka_rub",
+}
+# Свободный текст для GET /parcels/search.
+SEARCH_COLUMNS = ("context", "location_description", "recommendations", "best_use", "service_notes")
+SEARCH_BM25_K1 = 1.2
+SEARCH_BM25_B = 0.75
+SEARCH_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+SEARCH_PHRASE_RE = re.compile(r'"([^"]*)"')
+# Окончания для усечения, от длинных к коротким; основа не короче трёх букв.
+SEARCH_SUFFIXES = (
+    "иями", "ость", "ости", "ение", "ения", "ении", "ться",
+    "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "ией", "тся", "ают", "яют", "ует", "уют",
+    "ных", "ная", "ное", "ные", "ной", "ную",
+    "ая", "яя", "ое", "ее", "ые", "ие", "ый", "ий", "ой", "ей", "ую", "юю", "ом", "ем",
+    "ам", "ям", "ах", "ях", "ов", "ев", "их", "ых", "ым", "им", "ть",
+    "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+)
+SEARCH_MIN_STEM = 3
+
+
+def parse_csv_value(column: str, raw: str) -> Any:
+    if not raw.strip():
+        return None
+    if column in NUMERIC_COLUMNS:
+        text = raw.strip().replace(" ", "").replace(",", ".")
+        try:
+            return int(text)
+        except ValueError:
+            try:
+                return float(text)
+            except ValueError:
+                return sys.intern(raw)
+    return sys.intern(raw)
+
+
+def normalize_raw_cadastral(value: Any) -> str:
+    # В cadastral_number_raw встречаются хвостовые пробелы и переносы — сводим
+    # варианты к одному ключу один раз при загрузке.
+    if value is None:
+        return ""
+    return " ".join(str(value).split())
+
+
+def normalize_cadastral(value: Any) -> str:
+    text = "".join(str(value or "").split())
+    return text.replace("：", ":").strip(":")
+
+
+def split_cadastral_numbers(value: Any) -> list[str]:
+    numbers = []
+    for part in re.split(r"[;,\n]", str(value or "")):
+        number = normalize_cadastral(part)
+        if number:
+            numbers.append(number)
+    return numbers
+
+
+class _TrieNode:
+    __slots__ = ("children", "keys", "rows")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.keys: list[str] = []
+        self.rows: list[int] = []
+
+
+class CadastralTrie:
+    """
+    Префиксное дерево по сегментам кадастрового номера
+    (регион:район:квартал:участок). Последний, недописанный сегмент
+    ищется по отсортированным ключам узла через bisect.
+    """
+
+    def __init__(self) -> None:
+        self.root = _TrieNode()
+
+    def insert(self, number: str, row: int) -> None:
+        node = self.root
+        for segment in number.split(":"):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _TrieNode()
+            node = child
+        node.rows.append(row)
+
+    def remapped(self, keep: array, additions: list[tuple[str, int]]) -> "CadastralTrie":
+        """Копия дерева для нового снимка; исходное дерево не меняется."""
+
+        def copy_node(node: _TrieNode) -> Optional[_TrieNode]:
+            result = _TrieNode()
+            result.rows = sorted(row for row in map(keep.__getitem__, node.rows) if row >= 0)
+            for segment in node.keys:
+                child = copy_node(node.children[segment])
+                if child is not None:
+                    result.children[segment] = child
+                    result.keys.append(segment)
+            return result if result.rows or result.children else None
+
+        trie = CadastralTrie()
+        trie.root = copy_node(self.root) or _TrieNode()
+        for number, row in additions:
+            node = trie.root
+            for segment in number.split(":"):
+                child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = _TrieNode()
+                    bisect.insort(node.keys, segment)
+                node = child
+            bisect.insort(node.rows, row)
+        return trie
+
+    def freeze(self) -> None:
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            node.keys = sorted(node.children)
+            stack.extend(node.children.values())
+
+    def search(self, prefix: str, limit: int) -> list[tuple[str, list[int]]]:
+        segments = normalize_cadastral(prefix).split(":") if prefix.strip() else [""]
+        if prefix.rstrip().endswith(":"):
+            segments.append("")
+        node = self.root
+        for segment in segments[:-1]:
+            node = node.children.get(segment)
+            if node is None:
+                return []
+        path = segments[:-1]
+        partial = segments[-1]
+        start = bisect.bisect_left(node.keys, partial)
+        results: list[tuple[str, list[int]]] = []
+        for key in node.keys[start:]:
+            if not key.startswith(partial):
+                break
+            self._collect(node.children[key], path + [key], results, limit)
+            if len(results) >= limit:
+                break
+        return results
+
+    def _collect(
+        self, node: _TrieNode, path: list[str], results: list[tuple[str, list[int]]], limit: int
+    ) -> None:
+        if node.rows:
+            results.append((":".join(path), node.rows))
+        for key in node.keys:
+            if len(results) >= limit:
+                return
+            self._collect(node.children[key], path + [key], results, limit)
+
+
+class TrigramIndex:
+    """Инвертированный индекс триграмм для поиска подстроки без полного перебора."""
+
+    def __init__(self, values: list[str]) -> None:
+        self.values = values
+        postings: Dict[str, list[int]] = {}
+        for row, value in enumerate(values):
+            for gram in {value[i : i + 3] for i in range(len(value) - 2)}:
+                postings.setdefault(gram, []).append(row)
+        self.postings = {gram: array("I", rows) for gram, rows in postings.items()}
+
+    def remapped(self, values: list[str], keep: array, added: list[int]) -> "TrigramIndex":
+        """Индекс для нового снимка: номера строк переводятся через keep, added индексируются заново."""
+        index = TrigramIndex.__new__(TrigramIndex)
+        index.values = values
+        postings: Dict[str, array] = {}
+        for gram, rows in self.postings.items():
+            moved = array("I", [row for row in map(keep.__getitem__, rows) if row >= 0])
+            if moved:
+                postings[gram] = moved
+        for row in added:
+            value = values[row]
+            for gram in {value[i : i + 3] for i in range(len(value) - 2)}:
+                postings.setdefault(gram, array("I")).append(row)
+        index.postings = postings
+        return index
+
+    def candidates(self, needle: str) -> Optional[set[int]]:
+        """Строки, содержащие все триграммы needle; None — если needle короче триграммы."""
+        grams = {needle[i : i + 3] for i in range(len(needle) - 2)}
+        if not grams:
+            return None
+        lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        result = set(lists[0])
+        for rows in lists[1:]:
+            if not result:
+                break
+            result.intersection_update(rows)
+        return result
+
+    def search(self, needle: str) -> list[int]:
+        candidates = self.candidates(needle)
+        rows = range(len(self.values)) if candidates is None else sorted(candidates)
+        values = self.values
+        return [row for row in rows if needle in values[row]]
+
+
+class SortedColumn:
+    """Числовая колонка, отсортированная по значению: диапазон ищется через bisect."""
+
+    def __init__(self, column: list) -> None:
+        pairs = sorted(
+            (value, row)
+            for row, value in enumerate(column)
+            if isinstance(value, (int, float)) and not isinstance(value, bool)
+        )
+        self._fill(pairs, len(column))
+
+    def _fill(self, pairs: list[tuple[float, int]], size: int) -> None:
+        self.values = array("d", (value for value, _ in pairs))
+        self.rows = array("I", (row for _, row in pairs))
+        # Ранг строки в порядке сортировки; у пустых значений — максимальный.
+        self.rank = array("I", [len(pairs)]) * size
+        for position, row in enumerate(self.rows):
+            self.rank[row] = position
+        self.missing = len(pairs)
+
+    def remapped(self, column: list, keep: array, added: list[int]) -> "SortedColumn":
+        """Колонка нового снимка: сохранившиеся пары уже упорядочены, досортировываются только added."""
+        pairs = [(value, row) for value, row in zip(self.values, map(keep.__getitem__, self.rows)) if row >= 0]
+        for row in added:
+            value = column[row]
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                pairs.append((value, row))
+        pairs.sort()
+        result = SortedColumn.__new__(SortedColumn)
+        result._fill(pairs, len(column))
+        return result
+
+    def range(self, low: Optional[float], high: Optional[float]) -> array:
+        start = bisect.bisect_left(self.values, low) if low is not None else 0
+        stop = bisect.bisect_right(self.values, high) if high is not None else len(self.values)
+        return self.rows[start:stop]
+
+
+def stem_token(token: str) -> str:
+    """Лёгкое усечение русских окончаний: одна основа для «река», «реки», «реке»."""
+    for suffix in SEARCH_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= SEARCH_MIN_STEM:
+            return token[: -len(suffix)]
+    return token
+
+
+def search_terms(text: str) -> list[str]:
+    """Нормализация для поиска: нижний регистр, ё→е, слова и числа, усечение окончаний."""
+    return [stem_token(token) for token in SEARCH_TOKEN_RE.findall(text.lower().replace("ё", "е"))]
+
+
+def parse_search_query(query: str) -> tuple[list[str], list[list[str]]]:
+    """Все слова запроса обязательны (AND); текст в кавычках — фраза подряд в одном поле."""
+    phrases = [terms for terms in map(search_terms, SEARCH_PHRASE_RE.findall(query)) if terms]
+    terms = search_terms(SEARCH_PHRASE_RE.sub(" ", query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return list(dict.fromkeys(terms)), [phrase for phrase in phrases if len(phrase) > 1]
+
+
+class TextIndex:
+    """
+    Инвертированный индекс по SEARCH_COLUMNS с ранжированием BM25. Строка —
+    документ из всех текстовых полей; для проверки фраз хранятся термы
+    каждого поля (одинаковые тексты разбираются один раз и делят кортежи).
+    """
+
+    def __init__(self, columns: Dict[str, Any], size: int) -> None:
+        self.size = size
+        self.fields: list[tuple[tuple[str, ...], ...]] = [()] * size
+        self.lengths = array("I", [0]) * size
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self._index_rows(columns, range(size), {})
+        self._update_average()
+
+    def _index_rows(self, columns: Dict[str, Any], rows: Any, cache: Dict[str, tuple[str, ...]]) -> None:
+        empty = [None] * self.size
+        sources = [columns.get(name, empty) for name in SEARCH_COLUMNS]
+        postings = self.postings
+        for row in rows:
+            fields = []
+            for source in sources:
+                value = source[row]
+                if value is None:
+                    continue
+                text = str(value)
+                terms = cache.get(text)
+                if terms is None:
+                    terms = cache[text] = tuple(search_terms(text))
+                if terms:
+                    fields.append(terms)
+            self.fields[row] = tuple(fields)
+            self.lengths[row] = sum(map(len, fields))
+            counts: Dict[str, int] = {}
+            for terms in fields:
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                postings.setdefault(term, {})[row] = count
+
+    def _update_average(self) -> None:
+        self.average_length = (sum(self.lengths) / self.size) if self.size else 0.0
+
+    def remapped(self, columns: Dict[str, Any], size: int, keep: array, added: list[int]) -> "TextIndex":
+        """Индекс нового снимка: keep — старая строка → новая (-1 — удалена), added разбираются заново."""
+        index = TextIndex.__new__(TextIndex)
+        index.size = size
+        index.fields = [()] * size
+        index.lengths = array("I", [0]) * size
+        for old, new in enumerate(keep):
+            if new >= 0:
+                index.fields[new] = self.fields[old]
+                index.lengths[new] = self.lengths[old]
+        index.postings = {}
+        for term, rows in self.postings.items():
+            moved = {keep[row]: count for row, count in rows.items() if keep[row] >= 0}
+            if moved:
+                index.postings[term] = moved
+        index._index_rows(columns, added, {})
+        index._update_average()
+        return index
+
+    def search(self, query: str, allowed: Optional[set[int]] = None) -> list[tuple[int, float]]:
+        """Пары (строка, вес BM25) без упорядочивания; allowed — ограничение структурными фильтрами."""
+        terms, phrases = parse_search_query(query)
+        if not terms:
+            return []
+        lists = sorted((self.postings.get(term, {}) for term in terms), key=len)
+        if not lists[0]:
+            return []
+        candidates = set(lists[0])
+        if allowed is not None:
+            candidates &= allowed
+        for rows in lists[1:]:
+            if not candidates:
+                return []
+            candidates.intersection_update(rows)
+        if phrases:
+            candidates = {row for row in candidates if all(self._has_phrase(row, phrase) for phrase in phrases)}
+
+        k1, b = SEARCH_BM25_K1, SEARCH_BM25_B
+        average = self.average_length or 1.0
+        lengths = self.lengths
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in terms:
+            rows = self.postings[term]
+            idf = math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+            for row in candidates:
+                tf = rows[row]
+                scores[row] += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[row] / average))
+        return list(scores.items())
+
+    def _has_phrase(self, row: int, phrase: list[str]) -> bool:
+        width = len(phrase)
+        first = phrase[0]
+        for terms in self.fields[row]:
+            for start, term in enumerate(terms[: len(terms) - width + 1]):
+                if term == first and list(terms[start : start + width]) == phrase:
+                    return True
+        return False
+
+
+def read_csv_columns(path: Path) -> Dict[str, list]:
+    with path.open("r", encoding="utf-8", newline="") as fh:
+        reader = csv.reader(fh)
+        header = next(reader, [])
+        columns: Dict[str, list] = {name: [] for name in header}
+        lists = [columns[name] for name in header]
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            for name, target, raw in zip(header, lists, row):
+                target.append(parse_csv_value(name, raw))
+            for target in lists[len(row):]:
+                target.append(None)
+    return columns
+
+
+def _lower_cadastral(value: Any) -> str:
+    return str(value).lower() if value is not None else ""
+
+
+def _lower_article(value: Any) -> str:
+    return str(value).strip().lower() if value is not None else ""
+
+
+def _is_monotonic(keep: array) -> bool:
+    previous = -1
+    for row in keep:
+        if row >= 0:
+            if row < previous:
+                return False
+            previous = row
+    return True
+
+
+def _reload_keys(columns: Dict[str, list], size: int) -> Iterator[tuple]:
+    """Ключи строк для сравнения снимков; повторы различаются порядковым номером."""
+    empty = [None] * size
+    seen: Dict[tuple, int] = {}
+    for key in zip(columns.get("cadastral_number", empty), columns.get("source_row", empty)):
+        seen[key] = occurrence = seen.get(key, 0) + 1
+        yield key + (occurrence,)
+
+
+class ParcelDataset:
+    """
+    Каталог участков в виде колонок (по списку на поле) с индексами:
+    хеш по району, отсортированные числовые колонки и заранее посчитанный
+    порядок выдачи «район → номер → строка источника».
+    """
+
+    def __init__(self, columns: Dict[str, list], source: str = "", version: int = 0) -> None:
+        self._setup(columns, source, version)
+        self._build_indexes()
+
+    def _setup(self, columns: Dict[str, list], source: str, version: int) -> None:
+        self.columns = columns
+        self.column_names = list(columns)
+        self.source = source
+        # Номер снимка: растёт при каждой перезагрузке каталога.
+        self.version = version
+        # Метка содержимого для ETag: номер снимка свой в каждом воркере, а подпись файла — общая.
+        self.content_tag = f"v{version}"
+        if source:
+            try:
+                stat = Path(source.partition("#")[0]).stat()
+                self.content_tag = f"{stat.st_size:x}{stat.st_mtime_ns:x}"
+            except OSError:
+                pass
+        self.size = len(next(iter(columns.values()), []))
+        self._query_cache: "OrderedDict[tuple, list[int]]" = OrderedDict()
+        self._query_lock = threading.Lock()
+        self._text_index: Optional[TextIndex] = None
+        self.query_hits = 0
+        self.query_misses = 0
+
+    @classmethod
+    def from_csv(cls, path: Path) -> "ParcelDataset":
+        return cls(read_csv_columns(path), source=str(path))
+
+    def _order_key(self) -> Callable[[int], tuple]:
+        empty = [None] * self.size
+        region = self.columns.get("region", empty)
+        number = self.columns.get("number", empty)
+        source_row = self.columns.get("source_row", empty)
+
+        def order_key(row: int) -> tuple:
+            num = number[row]
+            return (
+                str(region[row] or "").strip(),
+                num if isinstance(num, (int, float)) else float("inf"),
+                source_row[row] if isinstance(source_row[row], (int, float)) else 0,
+            )
+
+        return order_key
+
+    def _set_default_order(self, rows: list[int]) -> None:
+        self.default_order = array("I", rows)
+        self.default_rank = array("I", [0]) * self.size
+        for position, row in enumerate(self.default_order):
+            self.default_rank[row] = position
+
+    def _build_indexes(self) -> None:
+        empty = [None] * self.size
+        region = self.columns.get("region", empty)
+
+        region_index: Dict[str, list[int]] = {}
+        for row, value in enumerate(region):
+            key = str(value).strip() if value is not None else ""
+            if key:
+                region_index.setdefault(key, []).append(row)
+        self.region_index = {key: array("I", rows) for key, rows in region_index.items()}
+
+        self.sorted_columns = {
+            name: SortedColumn(self.columns.get(name, empty)) for name in RANGE_COLUMNS
+        }
+
+        self._set_default_order(sorted(range(self.size), key=self._order_key()))
+
+        # Поиск подстроки идёт по заранее приведённым к нижнему регистру строкам.
+        self.cadastral_lower = [_lower_cadastral(value) for value in self.columns.get("cadastral_number", empty)]
+        self.article_lower = [_lower_article(value) for value in self.columns.get("article", empty)]
+        self.cadastral_trigrams = TrigramIndex(self.cadastral_lower)
+        self.article_trigrams = TrigramIndex(self.article_lower)
+
+        self.cadastral_trie = CadastralTrie()
+        for row, value in enumerate(self.columns.get("cadastral_number", empty)):
+            for number in split_cadastral_numbers(value):
+                self.cadastral_trie.insert(number, row)
+        self.cadastral_trie.freeze()
+
+        cadastral_rows: Dict[str, list[int]] = {}
+        for row, value in enumerate(self.columns.get("cadastral_number", empty)):
+            for number in split_cadastral_numbers(value):
+                cadastral_rows.setdefault(number, []).append(row)
+        self.cadastral_rows = cadastral_rows
+
+        article_rows: Dict[str, list[int]] = {}
+        for row, value in enumerate(self.article_lower):
+            if value:
+                article_rows.setdefault(value, []).append(row)
+        self.article_rows = article_rows
+
+        self._set_raw_keys([normalize_raw_cadastral(value) for value in self.columns.get("cadastral_number_raw", empty)])
+
+    def _set_raw_keys(self, raw_keys: list[str]) -> None:
+        self.raw_cadastral_keys = raw_keys
+        raw_counts: Dict[str, int] = {}
+        for key in raw_keys:
+            if key:
+                raw_counts[key] = raw_counts.get(key, 0) + 1
+        self.match_total = [raw_counts.get(key, 0) for key in raw_keys]
+
+    def reload(self, columns: Dict[str, list], source: str = "") -> tuple["ParcelDataset", Dict[str, int]]:
+        """
+        Новый снимок по свежим колонкам. Строки сопоставляются по
+        (cadastral_number, source_row): индексы неизменившихся строк переносятся
+        с новыми номерами, заново разбираются только добавленные и изменённые.
+        Текущий снимок не меняется, читатели продолжают работать с ним;
+        если ничего не изменилось, возвращается он же.
+        """
+        size = len(next(iter(columns.values()), []))
+        if list(columns) != self.column_names:
+            rebuilt = ParcelDataset(columns, source, self.version + 1)
+            return rebuilt, {"added": size, "changed": 0, "removed": self.size, "rebuilt": 1}
+
+        positions = {key: row for row, key in enumerate(_reload_keys(self.columns, self.size))}
+        old_rows = list(zip(*self.columns.values()))
+        keep = array("i", [-1]) * self.size
+        added: list[int] = []
+        changed = 0
+        for row, (key, values) in enumerate(zip(_reload_keys(columns, size), zip(*columns.values()))):
+            old = positions.get(key)
+            if old is not None and old_rows[old] == values:
+                keep[old] = row
+            else:
+                added.append(row)
+                changed += old is not None
+        summary = {
+            "added": len(added) - changed,
+            "changed": changed,
+            "removed": self.size - (size - len(added)) - changed,
+            "rebuilt": 0,
+        }
+        if not added and size == self.size and _is_monotonic(keep):
+            # Перестановка строк без правок — не «без изменений»: номера строк у неё другие.
+            return self, summary
+        if len(added) > size // 2:
+            # Изменилась большая часть каталога — дешевле построить индексы с нуля.
+            summary["rebuilt"] = 1
+            return ParcelDataset(columns, source, self.version + 1), summary
+
+        dataset = ParcelDataset.__new__(ParcelDataset)
+        dataset._setup(columns, source, self.version + 1)
+        dataset._update_indexes(self, keep, added)
+        return dataset, summary
+
+    def text_index(self) -> TextIndex:
+        """Полнотекстовый индекс строится при первом обращении (при старте сервер вызывает его сам)."""
+        if self._text_index is None:
+            with self._query_lock:
+                if self._text_index is None:
+                    self._text_index = TextIndex(self.columns, self.size)
+        return self._text_index
+
+    def search(self, query: str, allowed: Optional[set[int]] = None) -> list[tuple[int, float]]:
+        """BM25 по SEARCH_COLUMNS; равные веса — в порядке выдачи каталога."""
+        rank = self.default_rank
+        found = self.text_index().search(query, allowed)
+        found.sort(key=lambda item: (-item[1], rank[item[0]]))
+        return found
+
+    def _update_indexes(self, previous: "ParcelDataset", keep: array, added: list[int]) -> None:
+        """Индексы по индексам прежнего снимка: keep — старая строка → новая (-1 — удалена)."""
+        empty = [None] * self.size
+        remap = keep.__getitem__
+
+        def moved(rows: Any) -> list[int]:
+            return [row for row in map(remap, rows) if row >= 0]
+
+        def carry(values: list, fresh: Callable[[Any], Any], column: str) -> list:
+            result: list = [None] * self.size
+            for old, new in enumerate(keep):
+                if new >= 0:
+                    result[new] = values[old]
+            source = self.columns.get(column, empty)
+            for row in added:
+                result[row] = fresh(source[row])
+            return result
+
+        region = self.columns.get("region", empty)
+        region_index = {key: moved(rows) for key, rows in previous.region_index.items()}
+        for row in added:
+            key = str(region[row]).strip() if region[row] is not None else ""
+            if key:
+                region_index.setdefault(key, []).append(row)
+        self.region_index = {key: array("I", sorted(rows)) for key, rows in region_index.items() if rows}
+
+        self.sorted_columns = {
+            name: previous.sorted_columns[name].remapped(self.columns.get(name, empty), keep, added)
+            for name in RANGE_COLUMNS
+        }
+        order_key = self._order_key()
+        order = moved(previous.default_order)
+        if _is_monotonic(keep):
+            # Сохранившиеся строки не поменяли взаимный порядок — вставляем только новые.
+            for row in added:
+                bisect.insort(order, row, key=lambda item: (order_key(item), item))
+        else:
+            order = sorted(order + added, key=lambda row: (order_key(row), row))
+        self._set_default_order(order)
+
+        self.cadastral_lower = carry(previous.cadastral_lower, _lower_cadastral, "cadastral_number")
+        self.article_lower = carry(previous.article_lower, _lower_article, "article")
+        self.cadastral_trigrams = previous.cadastral_trigrams.remapped(self.cadastral_lower, keep, added)
+        self.article_trigrams = previous.article_trigrams.remapped(self.article_lower, keep, added)
+
+        cadastral = self.columns.get("cadastral_number", empty)
+        additions = [(number, row) for row in added for number in split_cadastral_numbers(cadastral[row])]
+        self.cadastral_trie = previous.cadastral_trie.remapped(keep, additions)
+
+        cadastral_rows = {number: sorted(moved(rows)) for number, rows in previous.cadastral_rows.items()}
+        for number, row in additions:
+            bisect.insort(cadastral_rows.setdefault(number, []), row)
+        self.cadastral_rows = {number: rows for number, rows in cadastral_rows.items() if rows}
+
+        article_rows = {value: sorted(moved(rows)) for value, rows in previous.article_rows.items()}
+        for row in added:
+            if self.article_lower[row]:
+                bisect.insort(article_rows.setdefault(self.article_lower[row], []), row)
+        self.article_rows = {value: rows for value, rows in article_rows.items() if rows}
+
+        self._set_raw_keys(carry(previous.raw_cadastral_keys, normalize_raw_cadastral, "cadastral_number_raw"))
+        if previous._text_index is not None:
+            self._text_index = previous._text_index.remapped(self.columns, self.size, keep, added)
+
+    def record(self, row: int) -> Dict[str, Any]:
+        item = {name: self.columns[name][row] for name in self.column_names}
+        item["row_id"] = row
+        item["match_total"] = self.match_total[row]
+        return item
+
+    def regions(self) -> list[Dict[str, Any]]:
+        return [
+            {"name": name, "count": len(rows)}
+            for name, rows in sorted(self.region_index.items())
+        ]
+
+    def query(
+        self,
+        region: str = "",
+        cadastral: str = "",
+        article: str = "",
+        ranges: Optional[Dict[str, tuple[Optional[float], Optional[float]]]] = None,
+        sort: str = "",
+    ) -> list[int]:
+        ranges = {
+            column: bounds
+            for column, bounds in (ranges or {}).items()
+            if bounds[0] is not None or bounds[1] is not None
+        }
+        key = (region, cadastral.lower(), article.lower(), tuple(sorted(ranges.items())), sort)
+        with self._query_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+                self.query_hits += 1
+                return cached
+            self.query_misses += 1
+
+        rows = self._select(region, key[1], key[2], ranges, sort)
+
+        with self._query_lock:
+            self._query_cache[key] = rows
+            while len(self._query_cache) > PARCELS_QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+        return rows
+
+    def _select(
+        self,
+        region: str,
+        cadastral: str,
+        article: str,
+        ranges: Dict[str, tuple[Optional[float], Optional[float]]],
+        sort: str,
+    ) -> list[int]:
+        candidates: Optional[set[int]] = None
+        # Сначала сужаем выборку индексами, начиная с самых узких.
+        index_hits: list = []
+        if region:
+            index_hits.append(self.region_index.get(region, ()))
+        for column, (low, high) in ranges.items():
+            index_hits.append(self.sorted_columns[column].range(low, high))
+        for needle, trigrams in ((cadastral, self.cadastral_trigrams), (article, self.article_trigrams)):
+            hits = trigrams.candidates(needle) if needle else None
+            if hits is not None:
+                index_hits.append(hits)
+        for hits in sorted(index_hits, key=len):
+            candidates = set(hits) if candidates is None else candidates.intersection(hits)
+            if not candidates:
+                return []
+
+        if candidates is None:
+            rows: list[int] = list(self.default_order)
+        else:
+            rows = sorted(candidates, key=self.default_rank.__getitem__)
+
+        if cadastral:
+            lowered = self.cadastral_lower
+            rows = [row for row in rows if cadastral in lowered[row]]
+        if article:
+            lowered = self.article_lower
+            rows = [row for row in rows if article in lowered[row]]
+
+        if sort:
+            descending = sort.startswith("-")
+            column = self.sorted_columns[sort.lstrip("-")]
+            rank = column.rank
+            missing = column.missing
+            if descending:
+                rows.sort(key=lambda row: (rank[row] == missing, -rank[row]))
+            else:
+                rows.sort(key=rank.__getitem__)
+        return rows
+
+    def suggest_cadastral(self, query: str, limit: int) -> list[Dict[str, Any]]:
+        matches = self.cadastral_trie.search(query, limit)
+        seen = {number for number, _ in matches}
+        needle = normalize_cadastral(query).lower()
+        if len(matches) < limit and len(needle) >= 3:
+            # Префикс не нашёлся целиком — добираем номера, содержащие запрос внутри.
+            for row in self.cadastral_trigrams.search(needle):
+                for number in split_cadastral_numbers(self.columns["cadastral_number"][row]):
+                    if needle in number.lower() and number not in seen:
+                        seen.add(number)
+                        matches.append((number, [row]))
+                if len(matches) >= limit:
+                    break
+        return [
+            {
+                "value": number,
+                "row_id": rows[0],
+                "count": len(rows),
+                "region": self.columns["region"][rows[0]],
+                "article": self.columns["article"][rows[0]],
+            }
+            for number, rows in matches[:limit]
+        ]
+
+    def suggest_article(self, query: str, limit: int) -> list[Dict[str, Any]]:
+        needle = query.strip().lower()
+        if not needle:
+            return []
+        if len(needle) < 3:
+            values = [value for value in self.article_rows if needle in value]
+        else:
+            values = list(dict.fromkeys(self.article_lower[row] for row in self.article_trigrams.search(needle)))
+        # Сначала начинающиеся с запроса, затем более короткие.
+        values.sort(key=lambda value: (not value.startswith(needle), len(value), value))
+        suggestions = []
+        for value in values[:limit]:
+            row = self.article_rows[value][0]
+            suggestions.append(
+                {
+                    "value": self.columns["article"][row],
+                    "row_id": row,
+                    "count": len(self.article_rows[value]),
+                    "cadastral_number": self.columns["cadastral_number"][row],
+                    "region": self.columns["region"][row],
+                }
+            )
+        return suggestions
+
+
+_PARCELS: Optional[ParcelDataset] = None
+_PARCEL_SUBSETS: Dict[str, ParcelDataset] = {}
+_COLUMNAR: Optional["ColumnarFile"] = None
+_PARCELS_LOCK = threading.Lock()
+
+
+def get_parcel_dataset() -> ParcelDataset:
+    global _PARCELS
+    if _PARCELS is None:
+        with _PARCELS_LOCK:
+            if _PARCELS is None:
+                _PARCELS = load_parcel_dataset()
+    return _PARCELS
+
+
+def load_parcel_dataset() -> ParcelDataset:
+    columns, source = load_parcel_columns()
+    return ParcelDataset(columns, source=source)
+
+
+def load_parcel_columns() -> tuple[Dict[str, Any], str]:
+    """Колонки каталога из data/parcels.bin, если он собран из текущего CSV, иначе — разбор CSV."""
+    columnar = get_columnar_file()
+    if columnar is not None:
+        if columnar.is_current(PARCELS_CSV_PATH):
+            return columnar.catalog_columns(), str(PARCELS_BIN_PATH)
+        print(f"[parcels] {PARCELS_BIN_PATH.name} собран из другой версии {PARCELS_CSV_PATH.name} — "
+              "читаю CSV; пересоберите: python build_dataset.py")
+    return read_csv_columns(PARCELS_CSV_PATH), str(PARCELS_CSV_PATH)
+
+
+def get_parcel_subset(name: str) -> Optional[ParcelDataset]:
+    """Подборка (urgent_sales и т. п.): представление из parcels.bin или отдельный CSV."""
+    if name not in PARCEL_SUBSETS:
+        return None
+    subset = _PARCEL_SUBSETS.get(name)
+    if subset is None:
+        with _PARCELS_LOCK:
+            subset = _PARCEL_SUBSETS.get(name)
+            if subset is None:
+                csv_path = PUBLIC_DIR / f"{name}.csv"
+                columnar = get_columnar_file()
+                if columnar is not None and columnar.has_subset(name, csv_path):
+                    subset = ParcelDataset(columnar.subset_columns(name), source=f"{PARCELS_BIN_PATH}#{name}")
+                elif csv_path.exists():
+                    subset = ParcelDataset.from_csv(csv_path)
+                else:
+                    return None
+                _PARCEL_SUBSETS[name] = subset
+    return subset
+
+
+def parcel_subsets_summary() -> list[Dict[str, Any]]:
+    summary = []
+    for name in PARCEL_SUBSETS:
+        subset = get_parcel_subset(name)
+        if subset is not None:
+            # Наружу — только имя файла (parcels.bin или <name>.csv), без путей сервера.
+            source = Path(subset.source.partition("#")[0]).name
+            summary.append({"name": name, "count": subset.size, "source": source})
+    return summary
+
+
+def get_columnar_file() -> Optional["ColumnarFile"]:
+    global _COLUMNAR
+    if _COLUMNAR is not None and not _COLUMNAR.is_file_current():
+        # build_dataset.py заменил файл; прежнее отображение живёт, пока на него ссылаются снимки.
+        _COLUMNAR = None
+    if _COLUMNAR is None and PARCELS_BIN_PATH.exists():
+        try:
+            _COLUMNAR = ColumnarFile(PARCELS_BIN_PATH)
+        except (OSError, ValueError) as error:
+            print(f"[parcels] не удалось открыть {PARCELS_BIN_PATH}: {error}")
+            return None
+    return _COLUMNAR
+
+
+def parse_parcel_filters(params: Dict[str, list[str]]) -> Dict[str, Any]:
+    """Разбирает параметры фильтра каталога; ValueError — если число не распознано."""
+
+    def text(name: str) -> str:
+        return params.get(name, [""])[0].strip()
+
+    def number(name: str) -> Optional[float]:
+        raw = text(name).replace(" ", "").replace(",", ".")
+        if not raw:
+            return None
+        try:
+            return float(raw)
+        except ValueError:
+            raise ValueError(f"Parameter '{name}' must be a number") from None
+
+    sort = text("sort")
+    if sort and sort.lstrip("-") not in RANGE_COLUMNS:
+        raise ValueError(f"Unsupported sort: {sort}")
+
+    return {
+        "region": text("region"),
+        "cadastral": text("cadastral"),
+        "article": text("article"),
+        "ranges": {
+            column: (number(f"{prefix}_min"), number(f"{prefix}_max"))
+            for prefix, column in RANGE_PARAMS.items()
+        },
+        "sort": sort,
+    }
+
+
+# --- Parcel statistics -------------------------------------------------
+#
+# Сводки для GET /stats. По каждому району агрегаты считаются один раз при
+# загрузке каталога и при перезагрузке обновляются только на изменившихся
+# строках; запрос с фильтрами агрегирует выборку /parcels за один проход.
+
+STATS_COLUMNS = ("region", "price_per_sotka_rub", "area_ha", "land_use", "recommended_usage", "owner", "balance_value")
+STATS_KEY_COLUMNS = ("source_file", "source_row", "cadastral_number")
+STATS_PERCENTILES = (("p10", 0.1), ("p25", 0.25), ("median", 0.5), ("p75", 0.75), ("p90", 0.9))
+STATS_AREA_BINS = tuple(
+    float(part) for part in os.getenv("STATS_AREA_BINS", "0.05,0.1,0.2,0.5,1,2,5,10").split(",") if part.strip()
+)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    position = (len(values) - 1) * q
+    low = math.floor(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def _distribution(values: list[float]) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    summary: Dict[str, Any] = {"count": len(values), "min": values[0], "max": values[-1]}
+    for name, q in STATS_PERCENTILES:
+        summary[name] = round(_percentile(values, q), 4)
+    summary["mean"] = round(math.fsum(values) / len(values), 4)
+    return summary
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _bump(counter: Dict[Any, Any], key: Any, delta: Any) -> None:
+    value = counter.get(key, 0) + delta
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+class RegionAggregate:
+    """Агрегаты по набору строк; строки можно добавлять и убирать по одной."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.prices: list[float] = []
+        self.areas: list[float] = []
+        self.area_bins = [0] * (len(STATS_AREA_BINS) + 1)
+        self.land_use: Dict[str, int] = {}
+        self.usage: Dict[str, int] = {}
+        self.balance: Dict[str, float] = {}
+        self.balance_rows: Dict[str, int] = {}
+        self._summary: Optional[Dict[str, Any]] = None
+
+    def add(self, values: tuple, sign: int = 1, batch: bool = False) -> None:
+        _, price, area, land_use, usage, owner, balance = values
+        self.count += sign
+        self._summary = None
+        if _is_number(price):
+            self._sorted_update(self.prices, float(price), sign, batch)
+        if _is_number(area):
+            self._sorted_update(self.areas, float(area), sign, batch)
+            self.area_bins[bisect.bisect_right(STATS_AREA_BINS, area)] += sign
+        if land_use:
+            _bump(self.land_use, str(land_use).strip(), sign)
+        if usage:
+            # recommended_usage — список кодов через запятую, считаем каждый код.
+            for code in str(usage).split(","):
+                if code.strip():
+                    _bump(self.usage, code.strip(), sign)
+        if _is_number(balance):
+            key = str(owner).strip() if owner else ""
+            _bump(self.balance_rows, key, sign)
+            # Нулевая сумма — тоже сумма: владелец пропадает только вместе с последней строкой.
+            if key in self.balance_rows:
+                self.balance[key] = self.balance.get(key, 0) + sign * balance
+            else:
+                self.balance.pop(key, None)
+
+    @classmethod
+    def merge(cls, parts: list["RegionAggregate"]) -> "RegionAggregate":
+        merged = cls()
+        for part in parts:
+            merged.count += part.count
+            merged.prices.extend(part.prices)
+            merged.areas.extend(part.areas)
+            merged.area_bins = [left + right for left, right in zip(merged.area_bins, part.area_bins)]
+            for target, source in (
+                (merged.land_use, part.land_use),
+                (merged.usage, part.usage),
+                (merged.balance, part.balance),
+                (merged.balance_rows, part.balance_rows),
+            ):
+                for key, value in source.items():
+                    target[key] = target.get(key, 0) + value
+        merged.finish_batch()
+        return merged
+
+    def remove(self, values: tuple) -> None:
+        self.add(values, -1)
+
+    def finish_batch(self) -> None:
+        """Сортирует значения, добавленные с batch=True."""
+        self.prices.sort()
+        self.areas.sort()
+
+    @staticmethod
+    def _sorted_update(values: list[float], value: float, sign: int, batch: bool) -> None:
+        if batch:
+            values.append(value)
+        elif sign > 0:
+            bisect.insort(values, value)
+        else:
+            del values[bisect.bisect_left(values, value)]
+
+    def summary(self) -> Dict[str, Any]:
+        if self._summary is not None:
+            return self._summary
+        edges = (0.0,) + STATS_AREA_BINS + (None,)
+        area = _distribution(self.areas)
+        area["histogram"] = [
+            {"from": edges[index], "to": edges[index + 1], "count": count}
+            for index, count in enumerate(self.area_bins)
+        ]
+        self._summary = {
+            "count": self.count,
+            "price_per_sotka_rub": _distribution(self.prices),
+            "area_ha": area,
+            "land_use": [
+                {"value": value, "count": count}
+                for value, count in sorted(self.land_use.items(), key=lambda item: (-item[1], item[0]))
+            ],
+            "recommended_usage": [
+                {"value": value, "count": count}
+                for value, count in sorted(self.usage.items(), key=lambda item: (-item[1], item[0]))
+            ],
+            "balance_value_by_owner": [
+                {"owner": owner or None, "total": round(total, 2), "count": self.balance_rows[owner]}
+                for owner, total in sorted(self.balance.items(), key=lambda item: (-item[1], item[0]))
+            ],
+        }
+        return self._summary
+
+
+def stats_rows(dataset: ParcelDataset, rows: Optional[Iterator[int]] = None) -> Iterator[tuple]:
+    """Значения STATS_COLUMNS построчно: один проход zip по колонкам."""
+    empty = [None] * dataset.size
+    columns = [dataset.columns.get(name, empty) for name in STATS_COLUMNS]
+    if rows is None:
+        return zip(*columns)
+    return (tuple(column[row] for column in columns) for row in rows)
+
+
+def aggregate_by_region(values: Iterator[tuple]) -> tuple[RegionAggregate, Dict[str, RegionAggregate]]:
+    total = RegionAggregate()
+    regions: Dict[str, RegionAggregate] = {}
+    for row in values:
+        total.add(row, batch=True)
+        region = str(row[0]).strip() if row[0] is not None else ""
+        if region:
+            aggregate = regions.get(region)
+            if aggregate is None:
+                aggregate = regions[region] = RegionAggregate()
+            aggregate.add(row, batch=True)
+    for aggregate in (total, *regions.values()):
+        aggregate.finish_batch()
+    return total, regions
+
+
+def aggregate_selection(dataset: ParcelDataset, rows: list[int]) -> tuple[RegionAggregate, Dict[str, RegionAggregate]]:
+    """
+    Сводки по выборке /parcels: строки группируются по району через
+    region_index, каждая колонка агрегируется отдельным проходом, итог по
+    всей выборке собирается слиянием районных агрегатов.
+    """
+    selected = set(rows)
+    groups: Dict[str, list[int]] = {}
+    for region, region_rows in dataset.region_index.items():
+        group = [row for row in region_rows if row in selected]
+        if group:
+            groups[region] = group
+    grouped = sum(len(group) for group in groups.values())
+    empty = [None] * dataset.size
+    price = dataset.columns.get("price_per_sotka_rub", empty)
+    area = dataset.columns.get("area_ha", empty)
+    land_use = dataset.columns.get("land_use", empty)
+    usage = dataset.columns.get("recommended_usage", empty)
+    owner = dataset.columns.get("owner", empty)
+    balance = dataset.columns.get("balance_value", empty)
+
+    def build(group: list[int]) -> RegionAggregate:
+        aggregate = RegionAggregate()
+        aggregate.count = len(group)
+        aggregate.prices = sorted(float(value) for value in map(price.__getitem__, group) if _is_number(value))
+        aggregate.areas = sorted(float(value) for value in map(area.__getitem__, group) if _is_number(value))
+        for value in aggregate.areas:
+            aggregate.area_bins[bisect.bisect_right(STATS_AREA_BINS, value)] += 1
+        aggregate.land_use = dict(Counter(str(value).strip() for value in map(land_use.__getitem__, group) if value))
+        aggregate.usage = dict(Counter(
+            code.strip()
+            for value in map(usage.__getitem__, group) if value
+            for code in str(value).split(",") if code.strip()
+        ))
+        for row in group:
+            value = balance[row]
+            if _is_number(value):
+                key = str(owner[row]).strip() if owner[row] else ""
+                aggregate.balance[key] = aggregate.balance.get(key, 0) + value
+                aggregate.balance_rows[key] = aggregate.balance_rows.get(key, 0) + 1
+        return aggregate
+
+    regions = {region: build(group) for region, group in groups.items()}
+    parts = list(regions.values())
+    if grouped < len(rows):
+        grouped_rows = {row for group in groups.values() for row in group}
+        parts.append(build([row for row in rows if row not in grouped_rows]))
+    return RegionAggregate.merge(parts), regions
+
+
+class ParcelStats:
+    """
+    Предрассчитанные сводки по каталогу. sync() сравнивает новый каталог с
+    прежним по (source_file, source_row, cadastral_number) и пересчитывает
+    только добавленные, удалённые и изменённые строки.
+    """
+
+    def __init__(self) -> None:
+        self.total = RegionAggregate()
+        self.regions: Dict[str, RegionAggregate] = {}
+        self.version = 0
+        self._rows: Dict[tuple, tuple] = {}
+        self._dataset: Optional[ParcelDataset] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _keyed_rows(dataset: ParcelDataset) -> Dict[tuple, tuple]:
+        empty = [None] * dataset.size
+        keys = zip(*(dataset.columns.get(name, empty) for name in STATS_KEY_COLUMNS))
+        keyed: Dict[tuple, tuple] = {}
+        seen: Dict[tuple, int] = {}
+        for key, values in zip(keys, stats_rows(dataset)):
+            # Повторы ключа различаем порядковым номером повтора.
+            seen[key] = occurrence = seen.get(key, 0) + 1
+            keyed[key + (occurrence,)] = values
+        return keyed
+
+    def sync(self, dataset: ParcelDataset) -> tuple[int, int]:
+        """Приводит сводки к каталогу; возвращает (добавлено, удалено) строк."""
+        with self._lock:
+            if dataset is self._dataset:
+                return 0, 0
+            rows = self._keyed_rows(dataset)
+            if not self._rows:
+                added, removed = list(rows.values()), []
+                self.total, self.regions = aggregate_by_region(added)
+            else:
+                removed = [values for key, values in self._rows.items() if rows.get(key) != values]
+                added = [values for key, values in rows.items() if self._rows.get(key) != values]
+                for values in removed:
+                    self._apply(values, -1)
+                for values in added:
+                    self._apply(values, 1)
+            self._rows = rows
+            self._dataset = dataset
+            if added or removed:
+                self.version += 1
+            return len(added), len(removed)
+
+    def _apply(self, values: tuple, sign: int) -> None:
+        self.total.add(values, sign)
+        region = str(values[0]).strip() if values[0] is not None else ""
+        if not region:
+            return
+        aggregate = self.regions.get(region)
+        if aggregate is None:
+            aggregate = self.regions[region] = RegionAggregate()
+        aggregate.add(values, sign)
+        if not aggregate.count:
+            del self.regions[region]
+
+    def render(self, region: str = "") -> Dict[str, Any]:
+        """
+        Готовый ответ /stats. Агрегаты sync() меняет на месте, поэтому сводки
+        собираются под той же блокировкой, что и обновление.
+        """
+        with self._lock:
+            if region:
+                aggregate = self.regions.get(region, RegionAggregate())
+                payload = render_stats(aggregate, {region: aggregate} if aggregate.count else {})
+            else:
+                payload = render_stats(self.total, self.regions)
+            payload["version"] = self.version
+            return payload
+
+
+_PARCEL_STATS: Optional[ParcelStats] = None
+_PARCEL_STATS_LOCK = threading.Lock()
+
+
+def get_parcel_stats() -> ParcelStats:
+    """Сводки по текущему каталогу; после перезагрузки каталога досчитываются при обращении."""
+    global _PARCEL_STATS
+    if _PARCEL_STATS is None:
+        with _PARCEL_STATS_LOCK:
+            if _PARCEL_STATS is None:
+                _PARCEL_STATS = ParcelStats()
+    _PARCEL_STATS.sync(get_parcel_dataset())
+    return _PARCEL_STATS
+
+
+def render_stats(total: RegionAggregate, regions: Dict[str, RegionAggregate]) -> Dict[str, Any]:
+    return {
+        "total": total.summary(),
+        "regions": [{"name": name, **regions[name].summary()} for name in sorted(regions)],
+    }
+
+
+# --- Upstream HTTP client ----------------------------------------------
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "8"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_IDLE_TIMEOUT = float(os.getenv("UPSTREAM_IDLE_TIMEOUT", "30"))
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+UPSTREAM_CA_FILE = os.getenv("UPSTREAM_CA_FILE", "").strip()
+UPSTREAM_LATENCY_WINDOW = 1024
+
+
+class UpstreamError(RuntimeError):
+    """Сбой запроса к внешнему сервису; status — HTTP-код ответа, None — нет ответа."""
+
+    def __init__(self, message: str, status: Optional[int] = None, details: str = "") -> None:
+        super().__init__(message)
+        self.status = status
+        self.details = details or message
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class CircuitBreaker:
+    """
+    После failures подряд неудачных запросов размыкается на reset_timeout и
+    сразу отказывает; затем пропускает один пробный запрос (half-open).
+    """
+
+    def __init__(self, failures: int = UPSTREAM_BREAKER_FAILURES, reset_timeout: float = UPSTREAM_BREAKER_RESET) -> None:
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._consecutive = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def release_probe(self) -> None:
+        """Пробный запрос так и не ушёл (например, пул занят) — пропустить следующий."""
+        with self._lock:
+            self._probing = False
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._consecutive = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._consecutive += 1
+            if self._probing or self._consecutive >= self.failures:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class UpstreamResponse:
+    """
+    Ответ из пула. Соединение возвращается в пул, только если тело прочитано
+    до конца; иначе (например, брошенный поток) оно закрывается.
+    """
+
+    def __init__(self, pool: "UpstreamPool", conn: http.client.HTTPConnection, response: http.client.HTTPResponse) -> None:
+        self.pool = pool
+        self.status = response.status
+        self.headers = response.headers
+        self._conn = conn
+        self._response = response
+        self._released = False
+
+    def read(self) -> bytes:
+        try:
+            return self._response.read()
+        except (OSError, http.client.HTTPException) as error:
+            raise self._broken(error) from error
+        finally:
+            self.close()
+
+    def __iter__(self) -> Iterator[bytes]:
+        while True:
+            try:
+                line = self._response.readline()
+            except (OSError, http.client.HTTPException) as error:
+                raise self._broken(error) from error
+            if not line:
+                # Без chunked readline() молча отдаёт b"" на обрыве — сверяем с Content-Length.
+                if self._response.length:
+                    raise self._broken(http.client.IncompleteRead(b"", self._response.length))
+                self.close()
+                return
+            yield line
+
+    def _broken(self, error: BaseException) -> "UpstreamError":
+        """Обрыв или таймаут посреди тела: соединение не возвращаем, сбой — в предохранитель."""
+        if not self._released:
+            self._released = True
+            self.pool._failed()
+            self.pool._release(self._conn, False)
+        return UpstreamError(f"{self.pool.name}: {error!r}")
+
+    def close(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        reusable = self._response.isclosed() and not self._response.will_close
+        self.pool._release(self._conn, reusable)
+
+    def __enter__(self) -> "UpstreamResponse":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class UpstreamPool:
+    """
+    Пул keep-alive соединений к одному хосту: не больше max_connections
+    одновременно, раздельные таймауты на соединение и чтение, предохранитель
+    при серии ошибок и статистика задержек до первого байта ответа.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        base_url: str,
+        max_connections: int = UPSTREAM_MAX_CONNECTIONS,
+        connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+        read_timeout: float = 30.0,
+        idle_timeout: float = UPSTREAM_IDLE_TIMEOUT,
+        breaker: Optional[CircuitBreaker] = None,
+        ssl_context: Optional[ssl.SSLContext] = None,
+    ) -> None:
+        parsed = urlparse(base_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise ValueError(f"Unsupported upstream URL: {base_url}")
+        self.name = name
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.origin = f"{self.scheme}://{parsed.netloc}"
+        self.max_connections = max(max_connections, 1)
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.idle_timeout = idle_timeout
+        self.breaker = breaker or CircuitBreaker()
+        if self.scheme == "https" and ssl_context is None:
+            ssl_context = ssl.create_default_context(cafile=UPSTREAM_CA_FILE or None)
+        self.ssl_context = ssl_context
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._idle: list[tuple[http.client.HTTPConnection, float]] = []
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=UPSTREAM_LATENCY_WINDOW)
+        self.in_use = 0
+        self.requests = 0
+        self.errors = 0
+        self.opened = 0
+        self.reused = 0
+        self.rejected = 0
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        body: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> UpstreamResponse:
+        """Ответ 2xx/3xx; на 4xx/5xx, таймаут и сбой соединения — UpstreamError."""
+        if url.startswith(self.origin):
+            url = url[len(self.origin):] or "/"
+        elif not url.startswith("/"):
+            raise ValueError(f"{url} does not belong to upstream {self.origin}")
+
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            METRICS.inc("upstream_requests_total", upstream=self.name, outcome="circuit_open")
+            raise UpstreamError(f"{self.name}: circuit open, retry in {self.breaker.retry_after():.0f}s")
+        if not self._slots.acquire(timeout=self.connect_timeout):
+            self.breaker.release_probe()
+            with self._lock:
+                self.rejected += 1
+            METRICS.inc("upstream_requests_total", upstream=self.name, outcome="pool_busy")
+            raise UpstreamError(f"{self.name}: all {self.max_connections} connections are busy")
+        with self._lock:
+            self.in_use += 1
+            self.requests += 1
+
+        started = time.perf_counter()
+        try:
+            conn, response = self._send(method, url, body, headers or {}, timeout or self.read_timeout)
+        except (OSError, http.client.HTTPException) as error:
+            self._failed()
+            self._release(None, False)
+            outcome = "timeout" if isinstance(error, TimeoutError) else "error"
+            METRICS.inc("upstream_requests_total", upstream=self.name, outcome=outcome)
+            raise UpstreamError(f"{self.name}: {error}") from error
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._latencies.append(elapsed)
+        METRICS.observe("upstream_request_duration_seconds", elapsed, upstream=self.name)
+        METRICS.inc("upstream_requests_total", upstream=self.name, outcome=f"{response.status // 100}xx")
+        result = UpstreamResponse(self, conn, response)
+        if response.status >= 400:
+            details = result.read().decode("utf-8", "replace")
+            if response.status >= 500:
+                self._failed()
+            else:
+                self.breaker.record_success()
+            raise UpstreamError(f"{self.name}: HTTP {response.status}", response.status, details)
+        self.breaker.record_success()
+        return result
+
+    def _send(
+        self, method: str, url: str, body: Optional[bytes], headers: Dict[str, str], timeout: float
+    ) -> tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+        while True:
+            conn, reused = self._checkout()
+            try:
+                if conn.sock is None:
+                    conn.connect()
+                conn.sock.settimeout(timeout)
+                conn.request(method, url, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                conn.close()
+                # Хост мог закрыть простаивавшее соединение — повторяем на новом.
+                if not reused:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+
+    def _checkout(self) -> tuple[http.client.HTTPConnection, bool]:
+        now = time.monotonic()
+        with self._lock:
+            while self._idle:
+                conn, idle_since = self._idle.pop()
+                if now - idle_since < self.idle_timeout:
+                    self.reused += 1
+                    return conn, True
+                conn.close()
+            self.opened += 1
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.connect_timeout, context=self.ssl_context
+            ), False
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.connect_timeout), False
+
+    def _release(self, conn: Optional[http.client.HTTPConnection], reusable: bool) -> None:
+        with self._lock:
+            self.in_use -= 1
+            if conn is not None:
+                if reusable:
+                    self._idle.append((conn, time.monotonic()))
+                else:
+                    conn.close()
+        self._slots.release()
+
+    def _failed(self) -> None:
+        with self._lock:
+            self.errors += 1
+        self.breaker.record_failure()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats: Dict[str, Any] = {
+                "origin": self.origin,
+                "max_connections": self.max_connections,
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "requests": self.requests,
+                "errors": self.errors,
+                "rejected": self.rejected,
+                "connections_opened": self.opened,
+                "connections_reused": self.reused,
+            }
+        stats["circuit"] = self.breaker.state
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000, 1)
+
+        stats["latency_ms"] = {
+            "samples": len(latencies),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1] * 1000, 1) if latencies else None,
+        }
+        return stats
+
+
+_UPSTREAMS: Dict[str, UpstreamPool] = {}
+_UPSTREAMS_LOCK = threading.Lock()
+
+
+def get_upstream(name: str) -> UpstreamPool:
+    """Общие пулы: "map" — map.ru, "yandex_gpt" — YandexGPT, "knowledge" — источник сводки о сайте."""
+    pool = _UPSTREAMS.get(name)
+    if pool is None:
+        with _UPSTREAMS_LOCK:
+            pool = _UPSTREAMS.get(name)
+            if pool is None:
+                if name == "map":
+                    pool = UpstreamPool(name, MAP_API_URL, read_timeout=MAP_API_TIMEOUT)
+                elif name == "yandex_gpt":
+                    pool = UpstreamPool(name, YANDEX_GPT_API_URL, read_timeout=YANDEX_GPT_TIMEOUT)
+                elif name == "knowledge":
+                    pool = UpstreamPool(name, KNOWLEDGE_SOURCE, read_timeout=KNOWLEDGE_TIMEOUT)
+                else:
+                    raise KeyError(name)
+                _UPSTREAMS[name] = pool
+    return pool
+
+
+def upstream_stats() -> Dict[str, Any]:
+    with _UPSTREAMS_LOCK:
+        pools = dict(_UPSTREAMS)
+    return {name: pool.stats() for name, pool in sorted(pools.items())}
+
+
+# --- Columnar dataset file ---------------------------------------------
+#
+# data/parcels.bin — каталог и подборки, собранные build_dataset.py:
+#   b"PARCELS1" | u32 длина манифеста | манифест JSON | блоки, выровненные на 8.
+# Числовая колонка — float64 значения + uint8 тег (пусто/int/float/текст);
+# строковая — словарь (UTF-8 блоб + смещения uint32) и коды uint16/uint32,
+# 0 — пусто. Подборки — списки номеров строк uint32. Файл отображается в
+# память, значения декодируются при обращении.
+
+COLUMNAR_MAGIC = b"PARCELS1"
+COLUMNAR_FORMAT = 1
+NUM_NONE, NUM_INT, NUM_FLOAT, NUM_TEXT = 0, 1, 2, 3
+
+
+def _align8(value: int) -> int:
+    return (value + 7) & ~7
+
+
+def _file_signature(path: Path) -> Dict[str, Any]:
+    stat = path.stat()
+    return {"name": path.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _string_table(values: list[str]) -> tuple[bytes, array]:
+    offsets = array("I", [0])
+    chunks: list[bytes] = []
+    position = 0
+    for value in values:
+        encoded = value.encode("utf-8")
+        chunks.append(encoded)
+        position += len(encoded)
+        offsets.append(position)
+    return b"".join(chunks), offsets
+
+
+def write_columnar(
+    path: Path,
+    columns: Dict[str, list],
+    catalog_rows: int,
+    catalog_source: Path,
+    subsets: Dict[str, tuple[Path, list[str], list[int]]],
+) -> int:
+    """Пишет columnar-файл атомарно; возвращает его размер."""
+    blocks: list[bytes] = []
+    position = 0
+
+    def add(data: Any, count: int) -> list[int]:
+        nonlocal position
+        raw = bytes(data)
+        offset = position
+        blocks.append(raw + b"\0" * (_align8(len(raw)) - len(raw)))
+        position += _align8(len(raw))
+        return [offset, count]
+
+    rows = len(next(iter(columns.values()), []))
+    specs = []
+    for name, values in columns.items():
+        numeric = any(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+        if numeric:
+            numbers = array("d", [0.0]) * rows
+            tags = array("B", [NUM_NONE]) * rows
+            texts: Dict[str, int] = {}
+            for row, value in enumerate(values):
+                if value is None:
+                    continue
+                if isinstance(value, int):
+                    tags[row], numbers[row] = NUM_INT, float(value)
+                elif isinstance(value, float):
+                    tags[row], numbers[row] = NUM_FLOAT, value
+                else:
+                    tags[row], numbers[row] = NUM_TEXT, float(texts.setdefault(str(value), len(texts)))
+            blob, offsets = _string_table(list(texts))
+            specs.append({
+                "name": name,
+                "kind": "num",
+                "values": add(numbers, rows),
+                "tags": add(tags, rows),
+                "offsets": add(offsets, len(offsets)),
+                "blob": add(blob, len(blob)),
+            })
+        else:
+            dictionary: Dict[str, int] = {}
+            codes = [0 if value is None else dictionary.setdefault(str(value), len(dictionary)) + 1 for value in values]
+            code_type = "H" if len(dictionary) < 0xFFFF else "I"
+            blob, offsets = _string_table(list(dictionary))
+            specs.append({
+                "name": name,
+                "kind": "dict",
+                "code_type": code_type,
+                "codes": add(array(code_type, codes), rows),
+                "offsets": add(offsets, len(offsets)),
+                "blob": add(blob, len(blob)),
+            })
+
+    manifest = {
+        "format": COLUMNAR_FORMAT,
+        "byteorder": sys.byteorder,
+        "rows": rows,
+        "catalog_rows": catalog_rows,
+        "catalog": _file_signature(catalog_source),
+        "built_at": time.time(),
+        "columns": specs,
+        "subsets": {
+            name: {
+                "source": _file_signature(source),
+                "columns": subset_columns,
+                "rows": add(array("I", row_ids), len(row_ids)),
+            }
+            for name, (source, subset_columns, row_ids) in subsets.items()
+        },
+    }
+    header = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    prefix = COLUMNAR_MAGIC + len(header).to_bytes(4, "little") + header
+    prefix += b"\0" * (_align8(len(prefix)) - len(prefix))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with tmp_path.open("wb") as fh:
+        fh.write(prefix)
+        for block in blocks:
+            fh.write(block)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+    return len(prefix) + position
+
+
+class StringTable:
+    """Строки словаря из отображённого файла; декодируются при первом обращении."""
+
+    def __init__(self, blob: memoryview, offsets: memoryview) -> None:
+        self._blob = blob
+        self._offsets = offsets
+        self._decoded: list[Optional[str]] = [None] * max(len(offsets) - 1, 0)
+
+    def __getitem__(self, index: int) -> str:
+        value = self._decoded[index]
+        if value is None:
+            value = sys.intern(str(self._blob[self._offsets[index] : self._offsets[index + 1]], "utf-8"))
+            self._decoded[index] = value
+        return value
+
+
+class MappedColumn(abc.ABC):
+    """
+    Колонка columnar-файла как последовательность значений. rows — номера
+    строк представления (подборка); без них — первые size строк файла.
+    """
+
+    def __init__(self, size: int, rows: Optional[memoryview] = None) -> None:
+        self._size = size
+        self._rows = rows
+
+    def view(self, size: int, rows: Optional[memoryview] = None) -> "MappedColumn":
+        column = copy.copy(self)
+        column._size = len(rows) if rows is not None else size
+        column._rows = rows
+        return column
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("column index out of range")
+        return self._value(self._rows[index] if self._rows is not None else index)
+
+    def __iter__(self) -> Iterator[Any]:
+        value = self._value
+        if self._rows is None:
+            return (value(row) for row in range(self._size))
+        return (value(row) for row in self._rows)
+
+    @abc.abstractmethod
+    def _value(self, row: int) -> Any:
+        """Значение строки row файла (не представления)."""
+
+
+class NumericColumn(MappedColumn):
+    def __init__(self, size: int, values: memoryview, tags: memoryview, texts: StringTable) -> None:
+        super().__init__(size)
+        self._values = values
+        self._tags = tags
+        self._texts = texts
+
+    def _value(self, row: int) -> Any:
+        tag = self._tags[row]
+        if tag == NUM_FLOAT:
+            return self._values[row]
+        if tag == NUM_INT:
+            return int(self._values[row])
+        if tag == NUM_TEXT:
+            return self._texts[int(self._values[row])]
+        return None
+
+
+class DictColumn(MappedColumn):
+    def __init__(self, size: int, codes: memoryview, strings: StringTable) -> None:
+        super().__init__(size)
+        self._codes = codes
+        self._strings = strings
+
+    def _value(self, row: int) -> Any:
+        code = self._codes[row]
+        return self._strings[code - 1] if code else None
+
+
+class ColumnarFile:
+    """data/parcels.bin, отображённый в память: общий для всех воркеров через page cache."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with path.open("rb") as fh:
+            self.signature = _file_signature(path)
+            self._map = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if bytes(view[:8]) != COLUMNAR_MAGIC:
+            raise ValueError("not a parcels columnar file")
+        length = int.from_bytes(view[8:12], "little")
+        self.manifest = json.loads(bytes(view[12 : 12 + length]).decode("utf-8"))
+        if self.manifest.get("format") != COLUMNAR_FORMAT:
+            raise ValueError(f"unsupported format {self.manifest.get('format')}")
+        if self.manifest.get("byteorder") != sys.byteorder:
+            raise ValueError("file was built on a machine with different byte order")
+        base = _align8(12 + length)
+
+        def block(spec: list[int], fmt: str) -> memoryview:
+            offset, count = spec
+            size = count * struct.calcsize(fmt)
+            return view[base + offset : base + offset + size].cast(fmt)
+
+        self.rows = self.manifest["rows"]
+        self.catalog_rows = self.manifest["catalog_rows"]
+        self.columns: Dict[str, MappedColumn] = {}
+        for spec in self.manifest["columns"]:
+            strings = StringTable(block(spec["blob"], "B"), block(spec["offsets"], "I"))
+            if spec["kind"] == "num":
+                column: MappedColumn = NumericColumn(self.rows, block(spec["values"], "d"), block(spec["tags"], "B"), strings)
+            else:
+                column = DictColumn(self.rows, block(spec["codes"], spec["code_type"]), strings)
+            self.columns[spec["name"]] = column
+        self._subset_rows = {
+            name: block(spec["rows"], "I") for name, spec in self.manifest.get("subsets", {}).items()
+        }
+
+    @staticmethod
+    def _matches(signature: Dict[str, Any], path: Path) -> bool:
+        try:
+            return signature == _file_signature(path)
+        except OSError:
+            return False
+
+    def is_file_current(self) -> bool:
+        return self._matches(self.signature, self.path)
+
+    def is_current(self, catalog_path: Path) -> bool:
+        return self._matches(self.manifest.get("catalog", {}), catalog_path)
+
+    def has_subset(self, name: str, source: Path) -> bool:
+        spec = self.manifest.get("subsets", {}).get(name)
+        return spec is not None and (not source.exists() or self._matches(spec["source"], source))
+
+    def catalog_columns(self) -> Dict[str, MappedColumn]:
+        return {name: column.view(self.catalog_rows) for name, column in self.columns.items()}
+
+    def subset_columns(self, name: str) -> Dict[str, MappedColumn]:
+        rows = self._subset_rows[name]
+        names = self.manifest["subsets"][name].get("columns") or list(self.columns)
+        return {column_name: self.columns[column_name].view(len(rows), rows) for column_name in names}
+
+
+# --- Dataset hot reload ------------------------------------------------
+
+DATASET_RELOAD_INTERVAL = float(os.getenv("DATASET_RELOAD_INTERVAL", "2"))
+_RELOAD_LOCK = threading.Lock()
+
+
+def reload_parcel_dataset() -> Dict[str, Any]:
+    """
+    Перечитывает каталог и подставляет новый снимок одним присваиванием:
+    запросы, начатые раньше, дорабатывают со старым снимком и не ждут.
+    """
+    global _PARCELS
+    with _RELOAD_LOCK:
+        started = time.perf_counter()
+        current = get_parcel_dataset()
+        columns, source = load_parcel_columns()
+        dataset, summary = current.reload(columns, source)
+        dataset.text_index()
+        with _PARCELS_LOCK:
+            _PARCELS = dataset
+            _PARCEL_SUBSETS.clear()
+        get_parcel_stats()
+        summary.update(
+            version=dataset.version,
+            rows=dataset.size,
+            source=Path(source).name,
+            elapsed_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        print(
+            f"[reload] {summary['source']}: +{summary['added']} ~{summary['changed']} -{summary['removed']}"
+            f"{' (индексы с нуля)' if summary['rebuilt'] else ''} → {dataset.size} строк, "
+            f"снимок {dataset.version}, {summary['elapsed_ms']} ms"
+        )
+        return summary
+
+
+class DatasetWatcher:
+    """
+    Опрашивает mtime/размер файлов каталога и подборок и перезагружает их в
+    фоне. Изменение применяется, когда подпись файла не менялась между двумя
+    опросами, — недописанный файл не читается.
+    """
+
+    def __init__(self, interval: float = DATASET_RELOAD_INTERVAL) -> None:
+        self.interval = interval
+        self.reloads = 0
+        self.failures = 0
+        self.last: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _signatures() -> Dict[str, Optional[tuple[int, int]]]:
+        paths = [PARCELS_CSV_PATH, PARCELS_BIN_PATH] + [PUBLIC_DIR / f"{name}.csv" for name in PARCEL_SUBSETS]
+        signatures: Dict[str, Optional[tuple[int, int]]] = {}
+        for path in paths:
+            try:
+                stat = path.stat()
+                signatures[str(path)] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                signatures[str(path)] = None
+        return signatures
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="dataset-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        applied = self._signatures()
+        pending: Optional[Dict[str, Any]] = None
+        while not self._stop.wait(self.interval):
+            current = self._signatures()
+            if current == applied or current != pending:
+                pending = None if current == applied else current
+                continue
+            try:
+                self.last = reload_parcel_dataset()
+                self.reloads += 1
+            except Exception as error:  # noqa: BLE001
+                # Битый файл не перечитываем по кругу: следующая попытка — после нового изменения.
+                self.failures += 1
+                print(f"[reload] не удалось перезагрузить каталог: {error}")
+            applied, pending = current, None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "reloads": self.reloads,
+            "failures": self.failures,
+            "last": self.last,
+            "version": get_parcel_dataset().version,
+        }
+
+
+_DATASET_WATCHER: Optional[DatasetWatcher] = None
+_DATASET_WATCHER_LOCK = threading.Lock()
+
+
+def get_dataset_watcher() -> DatasetWatcher:
+    global _DATASET_WATCHER
+    if _DATASET_WATCHER is None:
+        with _DATASET_WATCHER_LOCK:
+            if _DATASET_WATCHER is None:
+                _DATASET_WATCHER = DatasetWatcher()
+    return _DATASET_WATCHER
+
+
+# --- Parcel boundaries (map.ru) -----------------------------------------
+
+MAP_API_URL = os.getenv("MAP_API_URL", "").strip() or "https://map.ru/api/kad/search"
+MAP_API_TIMEOUT = float(os.getenv("MAP_API_TIMEOUT", "10"))
+GEOMETRY_DB_PATH = DATA_DIR / "geometry.sqlite3"
+MAP_CACHE_TTL = float(os.getenv("MAP_CACHE_TTL", str(30 * 24 * 3600)))
+MAP_CACHE_STALE_TTL = float(os.getenv("MAP_CACHE_STALE_TTL", str(365 * 24 * 3600)))
+MAP_CACHE_NEGATIVE_TTL = float(os.getenv("MAP_CACHE_NEGATIVE_TTL", str(24 * 3600)))
+MAP_CACHE_MAX_BYTES = int(os.getenv("MAP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Время последнего обращения обновляем не чаще раза в минуту, чтобы чтение не превращалось в запись.
+MAP_CACHE_TOUCH_INTERVAL = 60.0
+# Ниже этого масштаба участки отдаются точками-центрами, а не полигонами.
+MAP_POLYGON_MIN_ZOOM = 12
+MAP_WITHIN_MAX_FEATURES = 5000
+MAP_FEATURE_ATTRIBUTES = ("region", "article", "area_ha", "price_per_sotka_rub", "price_per_plot_rub")
+# Уровни упрощения границ: (минимальный zoom, допуск Дугласа—Пекера в метрах,
+# знаков после запятой в координатах). Ниже MAP_POLYGON_MIN_ZOOM — только точки.
+GEOMETRY_BANDS = (
+    (MAP_POLYGON_MIN_ZOOM, 4.0, 5),
+    (14, 1.0, 6),
+    (16, 0.0, 7),
+)
+TILE_CACHE_MAX_BYTES = int(os.getenv("TILE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TILE_MAX_ZOOM = 20
+
+
+class SingleFlight:
+    """Склеивает одновременные вызовы с одинаковым ключом в один вызов fn."""
+
+    class _Call:
+        __slots__ = ("done", "result", "error")
+
+        def __init__(self) -> None:
+            self.done = threading.Event()
+            self.result: Any = None
+            self.error: Optional[BaseException] = None
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, "SingleFlight._Call"] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Возвращает (результат, shared): shared=True, если ждали чужой вызов."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as error:  # noqa: BLE001
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self, key: str) -> bool:
+        with self._lock:
+            return key in self._calls
+
+
+class TokenBucket:
+    """Ограничитель частоты: rate токенов в секунду, запас до capacity."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def fetch_map_boundary(cadastral: str) -> bytes:
+    target_url = f"{MAP_API_URL}?query={quote(cadastral, safe=':')}"
+    with get_upstream("map").request("GET", target_url, headers={"User-Agent": "Mozilla/5.0"}) as response:
+        return response.read()
+
+
+def is_map_not_found(body: bytes) -> bool:
+    try:
+        payload = json.loads(body.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return False
+    if not isinstance(payload, dict):
+        return False
+    return payload.get("success") is False or not payload.get("features")
+
+
+EARTH_RADIUS_M = 6378137.0
+
+
+def mercator_to_lonlat(coords: Any) -> Any:
+    """EPSG:3857 → EPSG:4326 для вложенных массивов координат GeoJSON."""
+    if coords and isinstance(coords[0], (int, float)):
+        x, y = coords[0], coords[1]
+        lon = math.degrees(x / EARTH_RADIUS_M)
+        lat = math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS_M)) - math.pi / 2)
+        return [round(lon, 7), round(lat, 7)]
+    return [mercator_to_lonlat(item) for item in coords]
+
+
+def geometry_bbox(coords: Any) -> list[float]:
+    min_x = min_y = math.inf
+    max_x = max_y = -math.inf
+    stack = [coords]
+    while stack:
+        item = stack.pop()
+        if item and isinstance(item[0], (int, float)):
+            min_x, max_x = min(min_x, item[0]), max(max_x, item[0])
+            min_y, max_y = min(min_y, item[1]), max(max_y, item[1])
+        else:
+            stack.extend(item)
+    return [min_x, min_y, max_x, max_y]
+
+
+def geometry_band(zoom: int) -> int:
+    band = 0
+    for index, (min_zoom, _, _) in enumerate(GEOMETRY_BANDS):
+        if zoom >= min_zoom:
+            band = index
+    return band
+
+
+def simplify_ring(ring: list, tolerance_m: float, precision: int) -> list:
+    """Дуглас—Пекер в локальной метрической проекции плюс квантование координат."""
+    if tolerance_m > 0 and len(ring) > 4:
+        kx = 111320.0 * math.cos(math.radians(ring[0][1]))
+        ky = 110540.0
+        points = [(x * kx, y * ky) for x, y, *_ in ring]
+        keep = [False] * len(points)
+        keep[0] = keep[-1] = True
+        stack = [(0, len(points) - 1)]
+        while stack:
+            start, end = stack.pop()
+            ax, ay = points[start]
+            bx, by = points[end]
+            dx, dy = bx - ax, by - ay
+            length_sq = dx * dx + dy * dy
+            farthest, max_distance = -1, tolerance_m
+            for index in range(start + 1, end):
+                px, py = points[index]
+                if length_sq == 0:
+                    distance = math.hypot(px - ax, py - ay)
+                else:
+                    distance = abs(dy * px - dx * py + bx * ay - by * ax) / math.sqrt(length_sq)
+                if distance > max_distance:
+                    farthest, max_distance = index, distance
+            if farthest >= 0:
+                keep[farthest] = True
+                stack.append((start, farthest))
+                stack.append((farthest, end))
+        simplified = [point for point, kept in zip(ring, keep) if kept]
+        # Кольцо из трёх точек уже не полигон — оставляем исходное.
+        if len(simplified) >= 4:
+            ring = simplified
+
+    quantized: list = []
+    for x, y, *_ in ring:
+        point = [round(x, precision), round(y, precision)]
+        if not quantized or quantized[-1] != point:
+            quantized.append(point)
+    return quantized if len(quantized) >= 4 else [[round(x, precision), round(y, precision)] for x, y, *_ in ring]
+
+
+def simplify_geometry(geometry: Dict[str, Any], tolerance_m: float, precision: int) -> Dict[str, Any]:
+    kind = geometry.get("type")
+    coordinates = geometry.get("coordinates")
+    if kind == "Polygon":
+        coordinates = [simplify_ring(ring, tolerance_m, precision) for ring in coordinates]
+    elif kind == "MultiPolygon":
+        coordinates = [[simplify_ring(ring, tolerance_m, precision) for ring in polygon] for polygon in coordinates]
+    return {"type": kind, "coordinates": coordinates}
+
+
+def geometry_levels(geometry: Dict[str, Any]) -> list[str]:
+    """Заранее упрощённые версии геометрии для каждого уровня GEOMETRY_BANDS (JSON-строки)."""
+    return [
+        json.dumps(simplify_geometry(geometry, tolerance, precision), separators=(",", ":"))
+        for _, tolerance, precision in GEOMETRY_BANDS
+    ]
+
+
+def tile_bbox(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    scale = 2**z
+
+    def lat(tile_y: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / scale))))
+
+    return (x / scale * 360.0 - 180.0, lat(y + 1), (x + 1) / scale * 360.0 - 180.0, lat(y))
+
+
+def feature_from_map_response(cadastral: str, body: bytes) -> Optional[Dict[str, Any]]:
+    """Первый объект из ответа map.ru в виде GeoJSON Feature (WGS84) или None."""
+    try:
+        payload = json.loads(body.decode("utf-8"))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+    features = payload.get("features") if isinstance(payload, dict) else None
+    if not features:
+        return None
+    source = features[0] or {}
+    geometry = source.get("geometry") or {}
+    if geometry.get("type") not in ("Polygon", "MultiPolygon", "Point") or not geometry.get("coordinates"):
+        return None
+    coordinates = mercator_to_lonlat(geometry["coordinates"])
+    return {
+        "type": "Feature",
+        "id": cadastral,
+        "bbox": geometry_bbox(coordinates),
+        "geometry": {"type": geometry["type"], "coordinates": coordinates},
+        "properties": {"cadastral_number": cadastral, **(source.get("properties") or {})},
+    }
+
+
+class FeatureStore:
+    """Постоянное хранилище границ участков (GeoJSON, WGS84) с bbox для выборок по карте."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS features ("
+            " cadastral TEXT PRIMARY KEY,"
+            " geometry TEXT NOT NULL,"
+            " properties TEXT NOT NULL,"
+            " min_lon REAL NOT NULL, min_lat REAL NOT NULL,"
+            " max_lon REAL NOT NULL, max_lat REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS feature_levels ("
+            " cadastral TEXT NOT NULL,"
+            " band INTEGER NOT NULL,"
+            " geometry TEXT NOT NULL,"
+            " PRIMARY KEY (cadastral, band))"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+        return conn
+
+    def upsert(self, feature: Dict[str, Any]) -> None:
+        levels = geometry_levels(feature["geometry"])
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(conn, feature)
+            self._write_levels(conn, feature["id"], levels)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _write_levels(conn: sqlite3.Connection, cadastral: str, levels: list[str]) -> None:
+        conn.executemany(
+            "INSERT OR REPLACE INTO feature_levels (cadastral, band, geometry) VALUES (?, ?, ?)",
+            [(cadastral, band, geometry) for band, geometry in enumerate(levels)],
+        )
+
+    def backfill_levels(self) -> int:
+        """Досчитывает упрощённые версии для границ, сохранённых до появления уровней."""
+        conn = self._conn()
+        rows = conn.execute(
+            "SELECT cadastral, geometry FROM features f WHERE "
+            "(SELECT COUNT(*) FROM feature_levels l WHERE l.cadastral = f.cadastral) < ?",
+            (len(GEOMETRY_BANDS),),
+        ).fetchall()
+        for cadastral, geometry in rows:
+            levels = geometry_levels(json.loads(geometry))
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_levels(conn, cadastral, levels)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, feature: Dict[str, Any]) -> None:
+        min_lon, min_lat, max_lon, max_lat = feature["bbox"]
+        conn.execute(
+            "INSERT INTO features (cadastral, geometry, properties, min_lon, min_lat, max_lon, max_lat, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(cadastral) DO UPDATE SET geometry=excluded.geometry, properties=excluded.properties, "
+            "min_lon=excluded.min_lon, min_lat=excluded.min_lat, max_lon=excluded.max_lon, "
+            "max_lat=excluded.max_lat, updated_at=excluded.updated_at",
+            (
+                feature["id"],
+                json.dumps(feature["geometry"], separators=(",", ":")),
+                json.dumps(feature["properties"], ensure_ascii=False, separators=(",", ":")),
+                min_lon,
+                min_lat,
+                max_lon,
+                max_lat,
+                time.time(),
+            ),
+        )
+
+    def upsert_from_response(self, cadastral: str, body: bytes) -> bool:
+        feature = feature_from_map_response(normalize_cadastral(cadastral), body)
+        if feature is None:
+            return False
+        self.upsert(feature)
+        return True
+
+    def has(self, cadastral: str) -> bool:
+        return (
+            self._conn().execute("SELECT 1 FROM features WHERE cadastral=?", (cadastral,)).fetchone()
+            is not None
+        )
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM features").fetchone()[0]
+
+    def iter_features(self) -> Iterator[Dict[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT cadastral, geometry, properties, min_lon, min_lat, max_lon, max_lat FROM features"
+        )
+        for cadastral, geometry, properties, *bbox in rows:
+            yield {
+                "type": "Feature",
+                "id": cadastral,
+                "bbox": bbox,
+                "geometry": json.loads(geometry),
+                "properties": json.loads(properties),
+            }
+
+
+class GeometryCache:
+    """
+    Дисковый LRU-кеш ответов map.ru по нормализованному кадастровому номеру.
+
+    Свежая запись отдаётся сразу; устаревшая (но моложе ttl + stale_ttl) тоже
+    отдаётся сразу, а обновление уходит в фон. Одинаковые одновременные
+    промахи склеиваются в один запрос к map.ru. «Не найдено» кешируется на
+    negative_ttl. При ошибке map.ru отдаём любую сохранённую копию.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        fetch: Callable[[str], bytes] = fetch_map_boundary,
+        ttl: float = MAP_CACHE_TTL,
+        stale_ttl: float = MAP_CACHE_STALE_TTL,
+        negative_ttl: float = MAP_CACHE_NEGATIVE_TTL,
+        max_bytes: int = MAP_CACHE_MAX_BYTES,
+        features: Optional[FeatureStore] = None,
+    ) -> None:
+        self.path = path
+        self.fetch = fetch
+        self.features = features
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS map_cache ("
+            " key TEXT PRIMARY KEY,"
+            " found INTEGER NOT NULL,"
+            " body BLOB NOT NULL,"
+            " fetched_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " size INTEGER NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS map_cache_accessed ON map_cache (accessed_at)")
+        # Общий объём кеша ведут триггеры в той же базе: его видят все воркеры и
+        # prefetch_boundaries.py, а чтение не сканирует таблицу с телами ответов.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS map_cache_size ("
+                " id INTEGER PRIMARY KEY CHECK (id = 0),"
+                " total INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO map_cache_size (id, total) "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM map_cache"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS map_cache_size_insert AFTER INSERT ON map_cache "
+                "BEGIN UPDATE map_cache_size SET total = total + new.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS map_cache_size_update AFTER UPDATE OF size ON map_cache "
+                "BEGIN UPDATE map_cache_size SET total = total + new.size - old.size; END"
+            )
+            conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS map_cache_size_delete AFTER DELETE ON map_cache "
+                "BEGIN UPDATE map_cache_size SET total = total - old.size; END"
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+        return conn
+
+    def is_fresh(self, cadastral: str) -> bool:
+        row = self._conn().execute(
+            "SELECT found, fetched_at FROM map_cache WHERE key=?", (normalize_cadastral(cadastral),)
+        ).fetchone()
+        if row is None:
+            return False
+        found, fetched_at = row
+        return time.time() - fetched_at < (self.ttl if found else self.negative_ttl)
+
+    def get(self, cadastral: str) -> tuple[bytes, str]:
+        """Возвращает (тело ответа map.ru, состояние кеша: HIT/STALE/MISS/COALESCED)."""
+        key = normalize_cadastral(cadastral)
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT found, body, fetched_at, accessed_at FROM map_cache WHERE key=?", (key,)
+        ).fetchone()
+        if row is not None:
+            found, body, fetched_at, accessed_at = row
+            age = now - fetched_at
+            fresh_for = self.ttl if found else self.negative_ttl
+            if age < fresh_for:
+                self._touch(key, accessed_at, now)
+                return bytes(body), "HIT"
+            if found and age < fresh_for + self.stale_ttl:
+                self._touch(key, accessed_at, now)
+                self._revalidate_in_background(key)
+                return bytes(body), "STALE"
+
+        try:
+            body, shared = self._flight.do(key, lambda: self._refresh(key))
+        except Exception:
+            if row is not None:
+                return bytes(row[1]), "STALE"
+            raise
+        return body, "COALESCED" if shared else "MISS"
+
+    def _touch(self, key: str, accessed_at: float, now: float) -> None:
+        if now - accessed_at >= MAP_CACHE_TOUCH_INTERVAL:
+            self._conn().execute("UPDATE map_cache SET accessed_at=? WHERE key=?", (now, key))
+
+    def _revalidate_in_background(self, key: str) -> None:
+        if self._flight.in_flight(key):
+            return
+
+        def worker() -> None:
+            try:
+                self._flight.do(key, lambda: self._refresh(key))
+            except Exception as error:  # noqa: BLE001
+                print(f"[map-cache] не удалось обновить {key}: {error}")
+
+        threading.Thread(target=worker, name=f"map-refresh-{key}", daemon=True).start()
+
+    def _refresh(self, key: str) -> bytes:
+        body = self.fetch(key)
+        self.store(key, body)
+        return body
+
+    def store(self, key: str, body: bytes) -> None:
+        now = time.time()
+        found = 0 if is_map_not_found(body) else 1
+        conn = self._conn()
+        with self._lock:
+            # Кеш общий для воркеров и prefetch_boundaries.py: объём перечитываем
+            # из базы внутри той же транзакции, а не считаем по записям своего процесса.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT INTO map_cache (key, found, body, fetched_at, accessed_at, size) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET found=excluded.found, body=excluded.body, "
+                    "fetched_at=excluded.fetched_at, accessed_at=excluded.accessed_at, size=excluded.size",
+                    (key, found, body, now, now, len(body)),
+                )
+                total = conn.execute("SELECT total FROM map_cache_size").fetchone()[0]
+                if total > self.max_bytes:
+                    self._evict(conn, total)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if found and self.features is not None:
+            # Кеш ответов может вытесняться, а границы для карты храним всегда.
+            self.features.upsert_from_response(key, body)
+
+    def _evict(self, conn: sqlite3.Connection, total: int) -> None:
+        # Вытесняем давно не запрошенные записи, пока не освободим ~10% лимита.
+        target = int(self.max_bytes * 0.9)
+        rows = conn.execute("SELECT key, size FROM map_cache ORDER BY accessed_at").fetchall()
+        victims = []
+        for key, size in rows:
+            if total <= target:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM map_cache WHERE key=?", victims)
+
+
+class STRTree:
+    """
+    R-дерево, упакованное методом Sort-Tile-Recursive: строится один раз по
+    готовому набору прямоугольников и отвечает на запросы пересечения с bbox.
+    """
+
+    def __init__(self, boxes: list[tuple[float, float, float, float]], node_capacity: int = 16) -> None:
+        self.node_capacity = max(node_capacity, 2)
+        self.boxes = boxes
+        self.root: Optional[tuple] = None
+        if not boxes:
+            return
+        # Узел: (min_x, min_y, max_x, max_y, дети). У листа дети — индексы boxes,
+        # у внутреннего узла — узлы следующего уровня.
+        level = self._pack([(*box, index) for index, box in enumerate(boxes)], leaf=True)
+        while len(level) > 1:
+            level = self._pack(level, leaf=False)
+        self.root = level[0]
+
+    def _pack(self, entries: list[tuple], leaf: bool) -> list[tuple]:
+        capacity = self.node_capacity
+        node_count = math.ceil(len(entries) / capacity)
+        slice_count = math.ceil(math.sqrt(node_count))
+        slice_size = slice_count * capacity
+        entries = sorted(entries, key=lambda entry: entry[0] + entry[2])
+        nodes = []
+        for start in range(0, len(entries), slice_size):
+            vertical = sorted(entries[start : start + slice_size], key=lambda entry: entry[1] + entry[3])
+            for offset in range(0, len(vertical), capacity):
+                group = vertical[offset : offset + capacity]
+                nodes.append(
+                    (
+                        min(entry[0] for entry in group),
+                        min(entry[1] for entry in group),
+                        max(entry[2] for entry in group),
+                        max(entry[3] for entry in group),
+                        [entry[4] for entry in group] if leaf else group,
+                    )
+                )
+        return nodes
+
+    def query(self, min_x: float, min_y: float, max_x: float, max_y: float) -> list[int]:
+        if self.root is None:
+            return []
+        found: list[int] = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node[0] > max_x or node[2] < min_x or node[1] > max_y or node[3] < min_y:
+                continue
+            children = node[4]
+            if children and isinstance(children[0], int):
+                boxes = self.boxes
+                for index in children:
+                    box = boxes[index]
+                    if not (box[0] > max_x or box[2] < min_x or box[1] > max_y or box[3] < min_y):
+                        found.append(index)
+            else:
+                stack.extend(children)
+        return found
+
+
+class ParcelMapIndex:
+    """
+    Снимок всех сохранённых границ с пространственным индексом. Пересобирается
+    целиком, когда в FeatureStore появились новые записи; запросы тем временем
+    обслуживает прежний снимок.
+    """
+
+    RECHECK_INTERVAL = 5.0
+
+    def __init__(self, features: FeatureStore) -> None:
+        self.features = features
+        self._lock = threading.Lock()
+        self._signature: Optional[tuple] = None
+        self._checked_at = 0.0
+        self.version = 0
+        self.content_tag = ""
+        self.snapshot: tuple[list[str], list[tuple], list[list[str]], STRTree] = ([], [], [], STRTree([]))
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.RECHECK_INTERVAL and self._signature is not None:
+            return
+        if not self._lock.acquire(blocking=self._signature is None):
+            return
+        try:
+            self._checked_at = now
+            conn = self.features._conn()
+            signature = conn.execute("SELECT COUNT(*), MAX(updated_at) FROM features").fetchone()
+            if signature == self._signature:
+                return
+            self.features.backfill_levels()
+            rows = conn.execute(
+                "SELECT cadastral, min_lon, min_lat, max_lon, max_lat FROM features ORDER BY cadastral"
+            ).fetchall()
+            ids = [row[0] for row in rows]
+            positions = {cadastral: index for index, cadastral in enumerate(ids)}
+            boxes = [(row[1], row[2], row[3], row[4]) for row in rows]
+            levels: list[list[str]] = [[""] * len(ids) for _ in GEOMETRY_BANDS]
+            for cadastral, band, geometry in conn.execute("SELECT cadastral, band, geometry FROM feature_levels"):
+                position = positions.get(cadastral)
+                if position is not None and band < len(levels):
+                    levels[band][position] = geometry
+            tree = STRTree(boxes)
+            # Подменяем одним присваиванием кортежа — читатель не увидит смесь старого и нового.
+            self.snapshot = (ids, boxes, levels, tree)
+            self.version += 1
+            # Из (COUNT, MAX(updated_at)) — одинаково во всех воркерах над одной базой.
+            self.content_tag = hashlib.blake2b(repr(tuple(signature)).encode(), digest_size=6).hexdigest()
+            self._signature = signature
+        finally:
+            self._lock.release()
+
+    def query(
+        self, bbox: tuple[float, float, float, float]
+    ) -> tuple[list[str], list[tuple], list[list[str]], list[int]]:
+        """(ids, bbox-ы, геометрии по уровням упрощения, индексы попавших в bbox)."""
+        self._refresh()
+        ids, boxes, levels, tree = self.snapshot
+        return ids, boxes, levels, tree.query(*bbox)
+
+    def render(
+        self,
+        bbox: tuple[float, float, float, float],
+        zoom: int,
+        dataset: "ParcelDataset",
+        allowed_rows: Optional[set[int]] = None,
+        extra: str = "",
+    ) -> bytes:
+        """FeatureCollection участков в bbox с атрибутами из каталога, уже в виде JSON."""
+        ids, boxes, levels, hits = self.query(bbox)
+        as_points = zoom < MAP_POLYGON_MIN_ZOOM
+        geometries = levels[geometry_band(zoom)] if levels else []
+        parts: list[str] = []
+        truncated = False
+        for index in hits:
+            cadastral = ids[index]
+            rows = dataset.cadastral_rows.get(cadastral, [])
+            if allowed_rows is not None:
+                rows = [row for row in rows if row in allowed_rows]
+                if not rows:
+                    continue
+            if len(parts) >= MAP_WITHIN_MAX_FEATURES:
+                truncated = True
+                break
+            properties: Dict[str, Any] = {"cadastral_number": cadastral}
+            if rows:
+                properties["row_id"] = rows[0]
+                for name in MAP_FEATURE_ATTRIBUTES:
+                    properties[name] = dataset.columns[name][rows[0]]
+            if as_points:
+                min_x, min_y, max_x, max_y = boxes[index]
+                geometry = json.dumps(
+                    {"type": "Point", "coordinates": [round((min_x + max_x) / 2, 6), round((min_y + max_y) / 2, 6)]}
+                )
+            else:
+                geometry = geometries[index]
+            # Геометрия уже лежит строкой JSON — вклеиваем без повторной сериализации.
+            parts.append(
+                f'{{"type":"Feature","id":{json.dumps(cadastral)},"geometry":{geometry},'
+                f'"properties":{json.dumps(properties, ensure_ascii=False)}}}'
+            )
+        return (
+            f'{{"type":"FeatureCollection","zoom":{zoom},{extra}"truncated":{"true" if truncated else "false"},'
+            f'"features":[{",".join(parts)}]}}'
+        ).encode("utf-8")
+
+
+class TileCache:
+    """
+    LRU готовых gzip-тайлов (GeoJSON) с ограничением по байтам. Ключ включает
+    метки содержимого ParcelMapIndex и каталога, так что после пересборки старые
+    тайлы просто перестают запрашиваться и вытесняются.
+    """
+
+    def __init__(self, max_bytes: int = TILE_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_build(self, key: tuple, build: Callable[[], bytes]) -> bytes:
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+        compressed = gzip.compress(build(), compresslevel=6)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = compressed
+                self._bytes += len(compressed)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+        return compressed
+
+
+_GEOMETRY_CACHE: Optional[GeometryCache] = None
+_PARCEL_MAP_INDEX: Optional[ParcelMapIndex] = None
+_TILE_CACHE = TileCache()
+_FEATURE_STORE: Optional[FeatureStore] = None
+_GEOMETRY_CACHE_LOCK = threading.Lock()
+
+
+def get_feature_store() -> FeatureStore:
+    global _FEATURE_STORE
+    if _FEATURE_STORE is None:
+        with _GEOMETRY_CACHE_LOCK:
+            if _FEATURE_STORE is None:
+                _FEATURE_STORE = FeatureStore(GEOMETRY_DB_PATH)
+    return _FEATURE_STORE
+
+
+def get_parcel_map_index() -> ParcelMapIndex:
+    global _PARCEL_MAP_INDEX
+    if _PARCEL_MAP_INDEX is None:
+        features = get_feature_store()
+        with _GEOMETRY_CACHE_LOCK:
+            if _PARCEL_MAP_INDEX is None:
+                _PARCEL_MAP_INDEX = ParcelMapIndex(features)
+    return _PARCEL_MAP_INDEX
+
+
+def get_geometry_cache() -> GeometryCache:
+    global _GEOMETRY_CACHE
+    if _GEOMETRY_CACHE is None:
+        features = get_feature_store()
+        with _GEOMETRY_CACHE_LOCK:
+            if _GEOMETRY_CACHE is None:
+                _GEOMETRY_CACHE = GeometryCache(GEOMETRY_DB_PATH, features=features)
+    return _GEOMETRY_CACHE
+
+
+def parse_etags(header: str) -> set[str]:
+    return {tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()}
+
+
+def humanize_value(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "да" if value else "нет"
+    if isinstance(value, (int, float)):
+        return f"{value:,}".replace(",", " ")
+    return str(value).strip()
+
+
+def build_prompt(record: Dict[str, Any], existing_note: Any, instruction: Any) -> str:
+    lines: list[str] = []
+    for label, key in SUMMARY_FIELDS:
+        value = humanize_value(record.get(key))
+        if value:
+            lines.append(f"- {label}: {value}")
+
+    if not lines:
+        lines.append("- информации почти нет — коротко отметь это, не выдумывая фактов.")
+
+    extras: list[str] = []
+    if instruction:
+        extras.append(f"- Особые пожелания менеджера: {instruction}")
+    if existing_note:
+        extras.append(f"- Текущий черновик клиента (если нужно улучшить): {existing_note}")
+
+    prompt_sections = [
+        "Исходные данные по участку (используй факты без искажений):",
+        "\n".join(lines),
+    ]
+
+    if extras:
+        prompt_sections.extend(["", "Дополнительные пометки:", *extras])
+
+    prompt_sections.append("")
+    prompt_sections.append(
+        "Сформируй текст по требуемой структуре. Если данных не хватает, упоминай это лаконично и не добавляй выдуманных сведений."
+    )
+
+    return "\n".join(prompt_sections)
+
+
+def build_completion_body(prompt: str) -> Dict[str, Any]:
+    body: Dict[str, Any] = {
+        "modelUri": YANDEX_GPT_MODEL_URI,
+        "completionOptions": dict(YANDEX_GPT_COMPLETION_OPTIONS),
+        "messages": [
+            {
+                "role": "system",
+                "text": SYSTEM_PROMPT,
+            },
+            {"role": "user", "text": prompt},
+        ],
+    }
+    if YANDEX_GPT_FOLDER_ID:
+        body["folderId"] = YANDEX_GPT_FOLDER_ID
+    return body
+
+
+class YandexGPTError(UpstreamError):
+    """Ошибка обращения к YandexGPT; status — HTTP-код ответа, None — сбой соединения."""
+
+
+def open_yandex_gpt(prompt: str, stream: bool = False) -> UpstreamResponse:
+    if not YANDEX_GPT_ENABLED:
+        raise RuntimeError("YandexGPT is not configured")
+
+    body = build_completion_body(prompt)
+    if stream:
+        body["completionOptions"]["stream"] = True
+    request_data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    try:
+        return get_upstream("yandex_gpt").request(
+            "POST",
+            YANDEX_GPT_API_URL,
+            body=request_data,
+            headers={
+                "Content-Type": "application/json; charset=utf-8",
+                "Authorization": f"Api-Key {YANDEX_GPT_API_KEY}",
+            },
+        )
+    except UpstreamError as error:
+        if error.status is None:
+            raise YandexGPTError(f"Не удалось подключиться к YandexGPT: {error}") from error
+        raise YandexGPTError(f"YandexGPT API error: {error.details}", error.status) from error
+
+
+def extract_completion_text(payload: Dict[str, Any]) -> str:
+    alternatives = (
+        payload.get("result", {})
+        .get("alternatives", [])
+    )
+    for alternative in alternatives:
+        message = alternative.get("message") or {}
+        text = message.get("text", "").strip()
+        if text:
+            return text
+    return ""
+
+
+def call_yandex_gpt(prompt: str) -> str:
+    with open_yandex_gpt(prompt) as response:
+        payload = json.loads(response.read().decode("utf-8"))
+
+    text = extract_completion_text(payload)
+    if text:
+        return text
+
+    raise RuntimeError("YandexGPT вернул пустой ответ")
+
+
+def stream_yandex_gpt(prompt: str) -> Iterator[str]:
+    """
+    Потоковая генерация: YandexGPT присылает JSON построчно, в каждой строке —
+    весь текст на текущий момент. Закрытие генератора обрывает запрос к API.
+    """
+    with open_yandex_gpt(prompt, stream=True) as response:
+        for line in response:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                payload = json.loads(line.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError) as error:
+                raise RuntimeError(f"YandexGPT вернул некорректный поток: {error}") from error
+            if "error" in payload:
+                raise YandexGPTError(f"YandexGPT API error: {payload['error']}")
+            text = extract_completion_text(payload)
+            if text:
+                yield text
+
+
+# --- Site knowledge context ---------------------------------------------
+#
+# Справочная сводка о сайте для чат-бота в n8n: filatiev-ai-content.json
+# сворачивается в текст один раз при изменении источника, а не на каждом
+# сообщении. Версия — хеш текста, поэтому ETag совпадает у всех воркеров.
+
+KNOWLEDGE_SOURCE = (
+    os.getenv("KNOWLEDGE_SOURCE", "").strip() or "https://retro.filatiev.pro:8444/filatiev-ai-content.json"
+)
+KNOWLEDGE_REFRESH_SECONDS = float(os.getenv("KNOWLEDGE_REFRESH_SECONDS", "300"))
+# Пока сводки нет вовсе, недоступный источник переспрашиваем не чаще раза в столько секунд.
+KNOWLEDGE_RETRY_SECONDS = float(os.getenv("KNOWLEDGE_RETRY_SECONDS", "5"))
+KNOWLEDGE_TIMEOUT = float(os.getenv("KNOWLEDGE_TIMEOUT", "10"))
+KNOWLEDGE_MAX_WINDOWS = 8
+KNOWLEDGE_WINDOW_CHARS = 240
+
+
+def _knowledge_entries(value: Any) -> list[Dict[str, Any]]:
+    """Элементы-объекты списка; строки и прочий мусор в выгрузке сайта пропускаем."""
+    return [entry for entry in value if isinstance(entry, dict)] if isinstance(value, list) else []
+
+
+def summarize_knowledge(data: Dict[str, Any]) -> str:
+    """Та же сводка, что раньше собирал узел «Build Context Summary» в n8n."""
+    sections = []
+    meta = data.get("meta") if isinstance(data.get("meta"), dict) else {}
+    meta_bits = []
+    if meta.get("title"):
+        meta_bits.append(f"Название: {meta['title']}")
+    if meta.get("description"):
+        meta_bits.append(f"Описание: {meta['description']}")
+    if meta_bits:
+        sections.append("META\n" + "\n".join(meta_bits))
+    start_menu = data.get("startMenu") if isinstance(data.get("startMenu"), dict) else {}
+    items = _knowledge_entries(start_menu.get("items"))
+    if items:
+        sections.append("МЕНЮ\n" + ", ".join(str(item.get("label", "")) for item in items))
+    contacts = _knowledge_entries(start_menu.get("contacts"))
+    if contacts:
+        sections.append("КОНТАКТЫ\n" + "\n".join(f"{c.get('label', '')} — {c.get('url', '')}" for c in contacts))
+    icons = _knowledge_entries(data.get("desktopIcons"))
+    if icons:
+        sections.append("РАБОЧИЙ СТОЛ\n" + ", ".join(str(icon.get("label", "")) for icon in icons))
+    windows = [window for window in _knowledge_entries(data.get("windows")) if window.get("title")]
+    if windows:
+        sections.append(
+            "ОКНА\n"
+            + "\n".join(
+                f"{window['title']}: {str(window.get('content') or '')[:KNOWLEDGE_WINDOW_CHARS]}"
+                for window in windows[:KNOWLEDGE_MAX_WINDOWS]
+            )
+        )
+    return "\n\n".join(sections)
+
+
+class KnowledgeContext:
+    """
+    Сводка из KNOWLEDGE_SOURCE (URL или файл) в памяти процесса. Источник
+    проверяется не чаще раза в refresh секунд: файл — по mtime и размеру,
+    URL — условным запросом с ETag/Last-Modified. Пока один поток проверяет,
+    остальные отдают прежнюю сводку; при сбое источника она тоже остаётся.
+    Если сводки ещё нет, после сбоя источник спрашиваем снова через retry
+    секунд, а до тех пор сразу отвечаем ошибкой.
+    """
+
+    def __init__(
+        self,
+        source: str = KNOWLEDGE_SOURCE,
+        refresh: float = KNOWLEDGE_REFRESH_SECONDS,
+        retry: float = KNOWLEDGE_RETRY_SECONDS,
+    ) -> None:
+        self.source = source
+        self.refresh = refresh
+        self.retry = retry
+        self.is_url = urlparse(source).scheme in ("http", "https")
+        self.path = None if self.is_url else (ROOT_DIR / source)
+        self.version = ""
+        self.error: Optional[str] = None
+        self.fetches = 0
+        self.not_modified = 0
+        self._etag = ""
+        self._payload = b""
+        self._validators: Dict[str, str] = {}
+        self._next_check = float("-inf")
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def snapshot(self) -> tuple[str, bytes]:
+        """(ETag, JSON); UpstreamError — сводки ещё нет, а источник недоступен."""
+        with self._lock:
+            stale = time.monotonic() >= self._next_check
+            ready = bool(self._payload)
+        if stale and self._refresh_lock.acquire(blocking=not ready):
+            try:
+                if time.monotonic() >= self._next_check:
+                    self._refresh()
+            finally:
+                self._refresh_lock.release()
+        with self._lock:
+            if not self._payload:
+                raise UpstreamError(self.error or "knowledge: source unavailable")
+            return self._etag, self._payload
+
+    def _refresh(self) -> None:
+        try:
+            loaded = self._load()
+            if loaded is not None:
+                data, validators = loaded
+                summary = summarize_knowledge(data)
+        except Exception as error:  # noqa: BLE001
+            # Валидаторы источника не запоминаем: следующая проверка перечитает его целиком.
+            self.error = str(error) if isinstance(error, UpstreamError) else f"knowledge: {error}"
+            print(f"[knowledge] {self.source}: {error!r}", file=sys.stderr)
+            # Прежняя сводка остаётся в силе до следующего окна; без неё — короткая пауза,
+            # чтобы запросы не ждали источник и не дёргали его каждый раз.
+            self._next_check = time.monotonic() + (self.refresh if self._payload else min(self.retry, self.refresh))
+            return
+        self.error = None
+        self._next_check = time.monotonic() + self.refresh
+        if loaded is None:
+            return
+        self._validators = validators
+        version = hashlib.sha256(summary.encode("utf-8")).hexdigest()[:16]
+        if version == self.version:
+            return
+        # Тело зависит только от сводки: один ETag у всех воркеров — одни и те же байты.
+        payload = json.dumps(
+            {"version": version, "summary": summary, "source": self.public_source},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        with self._lock:
+            self.version = version
+            self._etag = f'"knowledge-{version}"'
+            self._payload = payload
+
+    @property
+    def public_source(self) -> str:
+        """Источник для ответа API: URL как есть, у файла — только имя."""
+        return self.source if self.path is None else self.path.name
+
+    def _load(self) -> Optional[tuple[Dict[str, Any], Dict[str, str]]]:
+        """(JSON источника, его валидаторы); None — источник не менялся с прошлой проверки."""
+        self.fetches += 1
+        if self.path is not None:
+            stat = self.path.stat()
+            signature = f"{stat.st_mtime_ns}:{stat.st_size}"
+            if signature == self._validators.get("file"):
+                self.not_modified += 1
+                return None
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+            validators = {"file": signature}
+        else:
+            headers = {"Accept": "application/json"}
+            if self._payload:
+                if self._validators.get("etag"):
+                    headers["If-None-Match"] = self._validators["etag"]
+                if self._validators.get("last_modified"):
+                    headers["If-Modified-Since"] = self._validators["last_modified"]
+            with get_upstream("knowledge").request("GET", self.source, headers=headers) as response:
+                if response.status == HTTPStatus.NOT_MODIFIED:
+                    response.read()
+                    self.not_modified += 1
+                    return None
+                data = json.loads(response.read().decode("utf-8"))
+                validators = {
+                    "etag": response.headers.get("ETag", ""),
+                    "last_modified": response.headers.get("Last-Modified", ""),
+                }
+        if not isinstance(data, dict):
+            raise ValueError("source must be a JSON object")
+        return data, validators
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "source": self.public_source,
+            "version": self.version,
+            "etag": self._etag,
+            "refresh_seconds": self.refresh,
+            "fetches": self.fetches,
+            "not_modified": self.not_modified,
+            "error": self.error,
+        }
+
+
+_KNOWLEDGE: Optional[KnowledgeContext] = None
+_KNOWLEDGE_LOCK = threading.Lock()
+
+
+def get_knowledge_context() -> KnowledgeContext:
+    global _KNOWLEDGE
+    if _KNOWLEDGE is None:
+        with _KNOWLEDGE_LOCK:
+            if _KNOWLEDGE is None:
+                _KNOWLEDGE = KnowledgeContext()
+    return _KNOWLEDGE
+
+
+# --- AI generation cache ------------------------------------------------
+
+AI_CACHE_DB_PATH = DATA_DIR / "ai_cache.sqlite3"
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+AI_CACHE_MAX_AGE = float(os.getenv("AI_CACHE_MAX_AGE", str(90 * 24 * 3600)))
+
+
+def completion_cache_key(prompt: str) -> str:
+    """Адрес генерации: всё, что влияет на ответ модели, кроме случайности."""
+    material = json.dumps(
+        [SYSTEM_PROMPT, YANDEX_GPT_MODEL_URI, YANDEX_GPT_COMPLETION_OPTIONS, prompt],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class AiCache:
+    """
+    Постоянный кеш готовых текстов YandexGPT по хешу запроса. Вытесняет записи
+    старше max_age и самые давно востребованные, если объём превышает max_bytes.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = AI_CACHE_MAX_BYTES, max_age: float = AI_CACHE_MAX_AGE) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS ai_cache ("
+            " key TEXT PRIMARY KEY,"
+            " text TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT text, created_at FROM ai_cache WHERE key=?", (key,)).fetchone()
+        if row is None or now - row[1] > self.max_age:
+            return None
+        conn.execute("UPDATE ai_cache SET accessed_at=?, hits=hits+1 WHERE key=?", (now, key))
+        return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        now = time.time()
+        conn = self._conn()
+        with self._lock:
+            conn.execute(
+                "INSERT OR REPLACE INTO ai_cache (key, text, created_at, accessed_at, size, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, text, now, now, len(text.encode("utf-8"))),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM ai_cache WHERE created_at < ?", (now - self.max_age,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM ai_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM ai_cache ORDER BY accessed_at"):
+            if total <= self.max_bytes * 0.9:
+                break
+            victims.append((key,))
+            total -= size
+        conn.executemany("DELETE FROM ai_cache WHERE key=?", victims)
+
+    def lookup(self, key: str, force: bool = False) -> Optional[str]:
+        """Готовый текст по ключу с учётом в счётчиках hit/miss; force — считать промахом."""
+        cached = None if force else self.get(key)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return cached
+
+    def generate(
+        self, prompt: str, force: bool = False, producer: Optional[Callable[[str], str]] = None
+    ) -> tuple[str, bool]:
+        """Текст для prompt и признак попадания в кеш; force — всегда идти в YandexGPT."""
+        producer = producer or call_yandex_gpt
+        key = completion_cache_key(prompt)
+        cached = self.lookup(key, force)
+        if cached is not None:
+            return cached, True
+
+        def produce() -> str:
+            text = producer(prompt)
+            self.put(key, text)
+            return text
+
+        # Повторные клики «сгенерировать» по тому же участку ждут один запрос.
+        text, _ = self._flight.do(key, produce)
+        return text, False
+
+    def stats(self) -> Dict[str, Any]:
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ai_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "max_age_seconds": self.max_age,
+        }
+
+
+_AI_CACHE: Optional[AiCache] = None
+_AI_CACHE_LOCK = threading.Lock()
+
+
+def get_ai_cache() -> AiCache:
+    global _AI_CACHE
+    if _AI_CACHE is None:
+        with _AI_CACHE_LOCK:
+            if _AI_CACHE is None:
+                _AI_CACHE = AiCache(AI_CACHE_DB_PATH)
+    return _AI_CACHE
+
+
+# --- Batch generation jobs ----------------------------------------------
+
+AI_JOBS_DB_PATH = DATA_DIR / "ai_jobs.sqlite3"
+AI_BATCH_WORKERS = int(os.getenv("AI_BATCH_WORKERS", "2"))
+AI_BATCH_RATE = float(os.getenv("AI_BATCH_RATE", "1"))
+AI_BATCH_RETRIES = int(os.getenv("AI_BATCH_RETRIES", "5"))
+AI_BATCH_BACKOFF = float(os.getenv("AI_BATCH_BACKOFF", "2"))
+AI_BATCH_MAX_ITEMS = int(os.getenv("AI_BATCH_MAX_ITEMS", "1000"))
+
+
+class AiJobQueue:
+    """
+    Очередь пакетной генерации описаний. Задания и их участки лежат в SQLite,
+    поэтому переживают перезапуск; пул потоков разбирает участки по одному,
+    соблюдая общий лимит частоты к YandexGPT и повторяя запросы на 429/5xx.
+    Готовый текст сразу записывается в заметки участка.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        workers: int = AI_BATCH_WORKERS,
+        rate: float = AI_BATCH_RATE,
+        retries: int = AI_BATCH_RETRIES,
+        backoff: float = AI_BATCH_BACKOFF,
+    ) -> None:
+        self.path = path
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.limiter = TokenBucket(rate)
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " created_at REAL NOT NULL,"
+            " finished_at REAL,"
+            " instruction TEXT,"
+            " force INTEGER NOT NULL DEFAULT 0,"
+            " overwrite INTEGER NOT NULL DEFAULT 0,"
+            " total INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_items ("
+            " job_id TEXT NOT NULL,"
+            " position INTEGER NOT NULL,"
+            " cadastral TEXT NOT NULL,"
+            " record TEXT,"
+            " status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " text TEXT,"
+            " error TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (job_id, position))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS job_items_status ON job_items(status)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = connect_sqlite(self.path)
+            self._local.conn = conn
+        return conn
+
+    def start(self) -> None:
+        """
+        Запускает пул. Очередь разбирает ровно один процесс (при --workers —
+        воркер 0), поэтому «running» от прошлой жизни можно вернуть в очередь.
+        """
+        if self._threads:
+            return
+        self._conn().execute("UPDATE job_items SET status='pending' WHERE status='running'")
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"ai-batch-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Останавливает пул после текущих участков; незавершённые остаются в очереди."""
+        self._stopping.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads.clear()
+
+    def submit(
+        self,
+        items: list[tuple[str, Optional[Dict[str, Any]]]],
+        instruction: Optional[str] = None,
+        force: bool = False,
+        overwrite: bool = False,
+    ) -> str:
+        """items — (кадастровый номер, запись каталога или None, если участок не найден)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, created_at, instruction, force, overwrite, total) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, now, instruction, int(force), int(overwrite), len(items)),
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, position, cadastral, record, status, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        job_id,
+                        position,
+                        cadastral,
+                        json.dumps(record, ensure_ascii=False) if record is not None else None,
+                        "pending" if record is not None else "failed",
+                        None if record is not None else "Участок не найден в каталоге",
+                        now,
+                    )
+                    for position, (cadastral, record) in enumerate(items)
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._finish_if_done(conn, job_id)
+        # В другом процессе пул подхватит задание при следующем опросе.
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return job_id
+
+    def _claim(self) -> Optional[tuple]:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT i.job_id, i.position, i.cadastral, i.record, j.instruction, j.force, j.overwrite "
+                "FROM job_items i JOIN jobs j ON j.id = i.job_id "
+                "WHERE i.status='pending' ORDER BY j.created_at, i.position LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE job_items SET status='running', updated_at=? WHERE job_id=? AND position=?",
+                    (time.time(), row[0], row[1]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _worker(self) -> None:
+        while not self._stopping.is_set():
+            item = None
+            try:
+                item = self._claim()
+                if item is None:
+                    with self._wakeup:
+                        self._wakeup.wait(timeout=5)
+                    continue
+                self._process(*item)
+            except Exception as failure:  # noqa: BLE001
+                # Поток пула не должен умирать молча: участок помечаем failed,
+                # иначе он навсегда останется «running», а пул тихо опустеет.
+                print(f"[ai-batch] {threading.current_thread().name}: {failure!r}", file=sys.stderr)
+                if item is not None:
+                    self._mark_failed(item[0], item[1], f"{type(failure).__name__}: {failure}")
+                self._stopping.wait(1)
+
+    def _mark_failed(self, job_id: str, position: int, error: str) -> None:
+        try:
+            conn = self._conn()
+            conn.execute(
+                "UPDATE job_items SET status='failed', error=?, updated_at=? WHERE job_id=? AND position=?",
+                (error, time.time(), job_id, position),
+            )
+            self._finish_if_done(conn, job_id)
+        except sqlite3.Error as failure:
+            print(f"[ai-batch] не удалось отметить участок {job_id}/{position}: {failure!r}", file=sys.stderr)
+
+    def _process(
+        self,
+        job_id: str,
+        position: int,
+        cadastral: str,
+        record_json: str,
+        instruction: Optional[str],
+        force: int,
+        overwrite: int,
+    ) -> None:
+        store = get_notes_store()
+        attempts = [0]
+        status, text, error = "done", None, None
+        try:
+            note = store.get(cadastral) or {}
+            if note.get("description") and not overwrite:
+                status = "skipped"
+            else:
+                prompt = build_prompt(json.loads(record_json), None, instruction)
+
+                def produce(prompt: str) -> str:
+                    return self._call_with_retry(prompt, attempts)
+
+                text, _ = get_ai_cache().generate(prompt, force=bool(force), producer=produce)
+                store.upsert(cadastral, {"description": text})
+                get_notes_cache().invalidate()
+        except RuntimeError as failure:
+            status, error = "failed", str(failure)
+        except Exception as failure:  # noqa: BLE001
+            status, error = "failed", f"{type(failure).__name__}: {failure}"
+
+        conn = self._conn()
+        conn.execute(
+            "UPDATE job_items SET status=?, attempts=?, text=?, error=?, updated_at=? WHERE job_id=? AND position=?",
+            (status, attempts[0], text, error, time.time(), job_id, position),
+        )
+        self._finish_if_done(conn, job_id)
+
+    def _call_with_retry(self, prompt: str, attempts: list[int]) -> str:
+        while True:
+            self.limiter.acquire()
+            attempts[0] += 1
+            try:
+                return call_yandex_gpt(prompt)
+            except YandexGPTError as error:
+                if not error.retryable or attempts[0] > self.retries:
+                    raise
+            time.sleep(self.backoff * (2 ** (attempts[0] - 1)) * (0.5 + random.random()))
+
+    def _finish_if_done(self, conn: sqlite3.Connection, job_id: str) -> None:
+        conn.execute(
+            "UPDATE jobs SET finished_at=? WHERE id=? AND finished_at IS NULL AND NOT EXISTS ("
+            " SELECT 1 FROM job_items WHERE job_id=? AND status IN ('pending', 'running'))",
+            (time.time(), job_id, job_id),
+        )
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = self._conn()
+        job = conn.execute(
+            "SELECT created_at, finished_at, instruction, force, overwrite, total FROM jobs WHERE id=?",
+            (job_id,),
+        ).fetchone()
+        if job is None:
+            return None
+        created_at, finished_at, instruction, force, overwrite, total = job
+        counts = {"pending": 0, "running": 0, "done": 0, "skipped": 0, "failed": 0}
+        items = []
+        for cadastral, status, attempts, text, error in conn.execute(
+            "SELECT cadastral, status, attempts, text, error FROM job_items WHERE job_id=? ORDER BY position",
+            (job_id,),
+        ):
+            counts[status] += 1
+            item: Dict[str, Any] = {"cadastral_number": cadastral, "status": status, "attempts": attempts}
+            if text is not None:
+                item["text"] = text
+            if error is not None:
+                item["error"] = error
+            items.append(item)
+        finished = total - counts["pending"] - counts["running"]
+        if finished_at is None:
+            state = "running" if finished or counts["running"] else "queued"
+        else:
+            state = "failed" if counts["failed"] == total and total else "done"
+        return {
+            "id": job_id,
+            "status": state,
+            "created_at": created_at,
+            "finished_at": finished_at,
+            "instruction": instruction,
+            "force": bool(force),
+            "overwrite": bool(overwrite),
+            "total": total,
+            "progress": round(finished / total, 4) if total else 1.0,
+            "counts": counts,
+            "items": items,
+        }
+
+
+BATCH_FILTER_KEYS = frozenset(
+    {"region", "cadastral", "article", "sort", "subset"}
+    | {f"{prefix}_{bound}" for prefix in RANGE_PARAMS for bound in ("min", "max")}
+)
+
+
+def collect_batch_items(payload: Dict[str, Any]) -> list[tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Участки пакета: список cadastral_numbers или filter с теми же полями, что у
+    GET /parcels (включая subset). Ключ — первый номер из ячейки, как у заметок
+    в интерфейсе.
+    """
+    dataset = get_parcel_dataset()
+    numbers = payload.get("cadastral_numbers")
+    rows: list[Optional[int]] = []
+    keys: list[str] = []
+    if numbers is not None:
+        if not isinstance(numbers, list):
+            raise ValueError("Field 'cadastral_numbers' must be a list")
+        for value in numbers:
+            for number in split_cadastral_numbers(str(value)):
+                found = dataset.cadastral_rows.get(number)
+                keys.append(number)
+                rows.append(found[0] if found else None)
+    else:
+        filters = payload.get("filter")
+        if not isinstance(filters, dict):
+            raise ValueError("Expected 'cadastral_numbers' or 'filter'")
+        unknown = sorted(set(filters) - BATCH_FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unsupported filter fields: {', '.join(unknown)}")
+        params = {key: [str(value)] for key, value in filters.items() if value is not None}
+        subset_name = params.pop("subset", [""])[0].strip()
+        if subset_name:
+            dataset = get_parcel_subset(subset_name)
+            if dataset is None:
+                raise ValueError(f"Unknown subset '{subset_name}'")
+        for row in dataset.query(**parse_parcel_filters(params)):
+            primary = split_cadastral_numbers(dataset.columns["cadastral_number"][row])
+            if primary:
+                keys.append(primary[0])
+                rows.append(row)
+
+    items: list[tuple[str, Optional[Dict[str, Any]]]] = []
+    seen: set[str] = set()
+    for key, row in zip(keys, rows):
+        if key in seen:
+            continue
+        seen.add(key)
+        items.append((key, dataset.record(row) if row is not None else None))
+    if len(items) > AI_BATCH_MAX_ITEMS:
+        raise ValueError(f"Too many parcels in one batch: {len(items)} > {AI_BATCH_MAX_ITEMS}")
+    return items
+
+
+_AI_JOB_QUEUE: Optional[AiJobQueue] = None
+_AI_JOB_QUEUE_LOCK = threading.Lock()
+
+
+def get_ai_job_queue() -> AiJobQueue:
+    global _AI_JOB_QUEUE
+    if _AI_JOB_QUEUE is None:
+        with _AI_JOB_QUEUE_LOCK:
+            if _AI_JOB_QUEUE is None:
+                _AI_JOB_QUEUE = AiJobQueue(AI_JOBS_DB_PATH)
+    return _AI_JOB_QUEUE
+
+
+# --- Static files -------------------------------------------------------
+
+STATIC_CACHE_MAX_BYTES = int(os.getenv("STATIC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+STATIC_CACHE_MAX_FILE_BYTES = int(os.getenv("STATIC_CACHE_MAX_FILE_BYTES", str(16 * 1024 * 1024)))
+STATIC_COMPRESS_MIN_BYTES = 1024
+# Несжатое тело файлов крупнее этого порога не держим в памяти: его отдаёт sendfile.
+STATIC_SENDFILE_MIN_BYTES = int(os.getenv("STATIC_SENDFILE_MIN_BYTES", str(256 * 1024)))
+STATIC_CHUNK_BYTES = 256 * 1024
+STATIC_COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "image/svg+xml", "application/xml")
+STATIC_IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_DEFAULT_CACHE_CONTROL = "no-cache"
+# script.3f2a9c1d.js, styles-5d41402abc.css — имя с хешем содержимого не меняет смысла.
+FINGERPRINT_RE = re.compile(r"[.-][0-9a-f]{8,}\.[a-z0-9]+$", re.IGNORECASE)
+
+
+class StaticAsset:
+    """
+    Метаданные файла и тела, которые стоит держать в памяти: сжатые варианты
+    и несжатый — только для небольших файлов. Всё, чего нет в variants,
+    отдаётся с диска. load=False — только метаданные (файл слишком велик).
+    """
+
+    __slots__ = ("mtime_ns", "size", "etag", "last_modified", "content_type", "variants", "cost")
+
+    def __init__(self, path: Path, stat: os.stat_result, load: bool = True) -> None:
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+        self.last_modified = formatdate(stat.st_mtime, usegmt=True)
+        content_type, _ = mimetypes.guess_type(path.name)
+        self.content_type = content_type or "application/octet-stream"
+        if self.content_type.startswith("text/") or self.content_type == "application/javascript":
+            self.content_type += "; charset=utf-8"
+        # Варианты по Content-Encoding; сжатый хранится, только если заметно меньше.
+        self.variants: Dict[str, bytes] = {}
+        if not load:
+            self.cost = 0
+            return
+        data = path.read_bytes()
+        if len(data) < STATIC_SENDFILE_MIN_BYTES:
+            self.variants["identity"] = data
+        if len(data) >= STATIC_COMPRESS_MIN_BYTES and self.content_type.startswith(STATIC_COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(data, compresslevel=6, mtime=0)
+            if len(compressed) < len(data) * 0.9:
+                self.variants["gzip"] = compressed
+            if brotli is not None:
+                compressed = brotli.compress(data, quality=9)
+                if len(compressed) < len(data) * 0.9:
+                    self.variants["br"] = compressed
+        self.cost = sum(len(body) for body in self.variants.values())
+
+    def etag_for(self, encoding: str) -> str:
+        return f'"{self.etag}"' if encoding == "identity" else f'"{self.etag}-{encoding}"'
+
+    def matches(self, if_none_match: str) -> bool:
+        tags = parse_etags(if_none_match)
+        return "*" in tags or any(self.etag_for(encoding) in tags for encoding in ("identity", *self.variants))
+
+
+def parse_byte_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    Один диапазон из Range: bytes=a-b, bytes=a-, bytes=-n → (start, end)
+    включительно. None — заголовок игнорируем и отдаём файл целиком
+    (несколько диапазонов, другая единица, синтаксическая ошибка);
+    ValueError — диапазон вне файла (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, separator, last = spec.strip().partition("-")
+    if not separator or not (first or last) or not (first + last).isdigit():
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise ValueError("Range Not Satisfiable")
+        return max(size - suffix, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and start > end:
+        return None
+    if start >= size:
+        raise ValueError("Range Not Satisfiable")
+    return start, min(end, size - 1)
+
+
+def choose_encoding(accept_encoding: str, available: Any) -> str:
+    """Лучшая доступная кодировка из Accept-Encoding (br > gzip > identity), q=0 — запрет."""
+    accepted: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
 
-    prompt_sections.append("")
-    prompt_sections.append(
-        "Сформируй текст по требуемой структуре. Если данных не хватает, упоминай это лаконично и не добавляй выдуманных сведений."
-    )
 
-    return "\n".join(prompt_sections)
+class StaticCache:
+    """
+    Файлы public/ в памяти вместе с gzip/brotli-вариантами. Запись сверяется с
+    mtime и размером файла на каждом запросе, так что правка на диске видна
+    сразу; при переполнении вытесняются давно не запрошенные файлы.
+    """
 
+    def __init__(self, max_bytes: int = STATIC_CACHE_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Path, StaticAsset]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
 
-def call_yandex_gpt(prompt: str) -> str:
-    if not YANDEX_GPT_ENABLED:
-        raise RuntimeError("YandexGPT is not configured")
+    def get(self, path: Path) -> StaticAsset:
+        """Актуальный StaticAsset; для слишком больших файлов — только метаданные."""
+        stat = path.stat()
+        with self._lock:
+            asset = self._entries.get(path)
+            if asset is not None and asset.mtime_ns == stat.st_mtime_ns and asset.size == stat.st_size:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return asset
+            self.misses += 1
+        load = stat.st_size <= STATIC_CACHE_MAX_FILE_BYTES
+        asset, _ = self._flight.do(str(path), lambda: StaticAsset(path, stat, load))
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self._bytes -= previous.cost
+            self._entries[path] = asset
+            self._bytes += asset.cost
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.cost
+        return asset
 
-    body = {
-        "modelUri": YANDEX_GPT_MODEL_URI,
-        "completionOptions": {
-            "temperature": 0.25,
-            "maxTokens": 1000,
-        },
-        "messages": [
-            {
-                "role": "system",
-                "text": SYSTEM_PROMPT,
-            },
-            {"role": "user", "text": prompt},
-        ],
-    }
-    if YANDEX_GPT_FOLDER_ID:
-        body["folderId"] = YANDEX_GPT_FOLDER_ID
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
 
-    request_data = json.dumps(body, ensure_ascii=False).encode("utf-8")
-    request = urllib.request.Request(
-        YANDEX_GPT_API_URL,
-        data=request_data,
-        headers={
-            "Content-Type": "application/json; charset=utf-8",
-            "Authorization": f"Api-Key {YANDEX_GPT_API_KEY}",
-        },
-        method="POST",
-    )
 
-    try:
-        with urllib.request.urlopen(request, timeout=60) as response:
-            payload = json.loads(response.read().decode("utf-8"))
-    except urllib.error.HTTPError as error:
-        try:
-            details = error.read().decode("utf-8")
-        except Exception:  # noqa: BLE001
-            details = error.reason
-        raise RuntimeError(f"YandexGPT API error: {details}") from error
-    except urllib.error.URLError as error:
-        raise RuntimeError(f"Не удалось подключиться к YandexGPT: {error}") from error
+_STATIC_CACHE = StaticCache()
 
-    alternatives = (
-        payload.get("result", {})
-        .get("alternatives", [])
-    )
-    for alternative in alternatives:
-        message = alternative.get("message") or {}
-        text = message.get("text", "").strip()
-        if text:
-            return text
 
-    raise RuntimeError("YandexGPT вернул пустой ответ")
+def static_cache_control(path: str, query: str) -> str:
+    if FINGERPRINT_RE.search(path) or "v" in parse_qs(query):
+        return STATIC_IMMUTABLE_CACHE_CONTROL
+    return STATIC_DEFAULT_CACHE_CONTROL
 
 
 class NotesHandler(BaseHTTPRequestHandler):
     server_version = "NotesServer/1.0"
+    _trace: Optional[RequestTrace] = None
+
+    def parse_request(self) -> bool:
+        # Запрос прочитан — отсюда до конца handle_one_request идёт замер маршрута.
+        parsed = super().parse_request()
+        if parsed:
+            self._trace = begin_request_trace(f"{self.command} {self.path}")
+            self._response_status = 0
+            self._response_bytes = 0
+        return parsed
+
+    def handle_one_request(self) -> None:
+        self._trace = None
+        try:
+            super().handle_one_request()
+        finally:
+            trace, self._trace = self._trace, None
+            if trace is not None:
+                status = str(self._response_status) if self._response_status else "error"
+                end_request_trace(trace, self.command, route_label(self.path), status, self._response_bytes)
+
+    def send_response(self, code: int, message: Optional[str] = None) -> None:
+        self._response_status = int(code)
+        super().send_response(code, message)
+
+    def send_header(self, keyword: str, value: str) -> None:
+        if keyword.lower() == "content-length":
+            self._response_bytes = int(value)
+        super().send_header(keyword, value)
 
     def _set_cors_headers(self) -> None:
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, If-None-Match")
+        self.send_header("Access-Control-Expose-Headers", "ETag, X-Notes-Version, X-Notes-Epoch")
 
     def do_OPTIONS(self) -> None:  # noqa: N802
         self.send_response(HTTPStatus.NO_CONTENT)
@@ -217,56 +4602,165 @@ class NotesHandler(BaseHTTPRequestHandler):
         if parsed.path == "/proxy-map":
             params = parse_qs(parsed.query)
             value = params.get("query", [""])[0].strip()
-            if not value:
+            if not normalize_cadastral(value):
                 self.send_error(HTTPStatus.BAD_REQUEST, "Missing query param")
                 return
 
-            target_url = f"https://map.ru/api/kad/search?query={value}"
             try:
-                request = urllib.request.Request(
-                    target_url,
-                    headers={"User-Agent": "Mozilla/5.0"},
-                )
-                with urllib.request.urlopen(request, timeout=10) as response:
-                    body = response.read()
+                body, cache_state = get_geometry_cache().get(value)
             except Exception as error:  # noqa: BLE001
                 self.send_error(HTTPStatus.BAD_GATEWAY, f"Proxy error: {error}")
                 return
 
+            with _GEOMETRY_CACHE_COUNTS_LOCK:
+                _GEOMETRY_CACHE_COUNTS["hit" if cache_state == "HIT" else "miss"] += 1
+            self._send_json(body, headers={"X-Cache": cache_state})
+            return
+        if parsed.path == "/notes":
+            self._handle_notes_get(parse_qs(parsed.query))
+            return
+        if parsed.path.startswith("/notes/"):
+            self._handle_note_get(unquote(parsed.path[len("/notes/"):]).strip())
+            return
+        if parsed.path == "/parcels":
+            self._handle_parcels(parse_qs(parsed.query))
+            return
+        if parsed.path == "/parcels/regions":
+            dataset = self._parcel_dataset(parse_qs(parsed.query))
+            if dataset is not None:
+                self._send_json({"regions": dataset.regions()})
+            return
+        if parsed.path == "/parcels/subsets":
+            self._send_json({"subsets": parcel_subsets_summary()})
+            return
+        if parsed.path == "/parcels/snapshot":
+            self._send_json(get_dataset_watcher().stats())
+            return
+        if parsed.path.startswith("/ai/jobs/"):
+            self._handle_ai_job(parsed.path[len("/ai/jobs/"):])
+            return
+        if parsed.path == "/upstreams":
+            self._send_json(upstream_stats())
+            return
+        if parsed.path == "/metrics":
+            body = METRICS.render().encode("utf-8")
             self.send_response(HTTPStatus.OK)
             self._set_cors_headers()
-            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
             self.send_header("Content-Length", str(len(body)))
             self.end_headers()
             self.wfile.write(body)
             return
-        if parsed.path == "/notes":
-            with LOCK:
-                notes = load_notes()
-
-            payload = json.dumps(notes, ensure_ascii=False).encode("utf-8")
-            self.send_response(HTTPStatus.OK)
-            self._set_cors_headers()
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(payload)))
-            self.end_headers()
-            self.wfile.write(payload)
+        if parsed.path == "/ai/cache":
+            self._send_json(get_ai_cache().stats())
+            return
+        if parsed.path == "/knowledge/context":
+            self._handle_knowledge_context()
+            return
+        if parsed.path.startswith("/tiles/"):
+            self._handle_tile(parsed.path)
+            return
+        if parsed.path == "/parcels/within":
+            self._handle_parcels_within(parse_qs(parsed.query))
+            return
+        if parsed.path == "/stats":
+            self._handle_stats(parse_qs(parsed.query))
+            return
+        if parsed.path == "/parcels/search":
+            self._handle_parcels_search(parse_qs(parsed.query))
+            return
+        if parsed.path == "/parcels/suggest":
+            self._handle_parcels_suggest(parse_qs(parsed.query))
             return
 
-        self.serve_static(parsed.path)
+        self.serve_static(self.path)
 
     def do_POST(self) -> None:  # noqa: N802
-        if self.path == "/notes":
+        parsed = urlparse(self.path)
+        if parsed.path == "/notes":
             self._handle_notes_post()
             return
-        if self.path == "/ai/describe":
-            self._handle_ai_describe()
+        if parsed.path == "/ai/describe":
+            stream = parse_qs(parsed.query).get("stream", [""])[0].lower() in ("1", "true", "yes")
+            self._handle_ai_describe(stream)
+            return
+        if parsed.path == "/ai/describe/batch":
+            self._handle_ai_batch()
             return
 
         self.send_error(HTTPStatus.NOT_FOUND, "Endpoint not found")
 
+    def _send_json(
+        self,
+        payload: Any,
+        status: HTTPStatus = HTTPStatus.OK,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        body = payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self._set_cors_headers()
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
     # --- Notes endpoints -------------------------------------------------
 
+    def _handle_notes_get(self, params: Dict[str, list[str]]) -> None:
+        cache = get_notes_cache()
+        store = cache.store
+        version, etag, payload = cache.snapshot()
+        headers = {
+            "ETag": etag,
+            "Cache-Control": "no-cache",
+            "X-Notes-Version": str(version),
+            "X-Notes-Epoch": store.epoch(),
+        }
+
+        since_raw = params.get("since", [""])[0].strip()
+        if since_raw:
+            try:
+                since = int(since_raw)
+            except ValueError:
+                self.send_error(HTTPStatus.BAD_REQUEST, "Parameter 'since' must be an integer")
+                return
+            epoch = store.epoch()
+            client_epoch = params.get("epoch", [epoch])[0]
+            if client_epoch != epoch or since > version:
+                # Счётчик версий начался заново — отдаём всё целиком.
+                changes = store.all()
+                full = True
+            else:
+                changes = store.changes_since(since) if since < version else {}
+                full = False
+            self._send_json(
+                {"version": version, "epoch": epoch, "full": full, "changes": changes},
+                headers={"Cache-Control": "no-cache"},
+            )
+            return
+
+        if etag in parse_etags(self.headers.get("If-None-Match", "")):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._set_cors_headers()
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        self._send_json(payload, headers=headers)
+
+    def _handle_note_get(self, cadastral: str) -> None:
+        if not cadastral:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Missing cadastral number")
+            return
+        entry = get_notes_store().get(cadastral)
+        if entry is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Note not found")
+            return
+        self._send_json(entry, headers={"Cache-Control": "no-cache"})
+
     def _handle_notes_post(self) -> None:
         content_length = int(self.headers.get("Content-Length", "0"))
         if content_length <= 0:
@@ -285,30 +4779,194 @@ class NotesHandler(BaseHTTPRequestHandler):
             self.send_error(HTTPStatus.BAD_REQUEST, "Missing cadastral_number")
             return
 
-        description = payload.get("description")
-        avito_link = payload.get("avito_link")
+        fields = {key: payload[key] for key in NOTE_FIELDS if payload.get(key) is not None}
+        store = get_notes_store()
+        store.upsert(cadastral, fields)
+        get_notes_cache().invalidate()
 
-        with LOCK:
-            notes = load_notes()
-            entry = notes.get(cadastral, {})
-            if description is not None:
-                entry["description"] = description
-            if avito_link is not None:
-                entry["avito_link"] = avito_link
-            notes[cadastral] = entry
-            save_notes(notes)
+        self._send_json({"status": "ok", "version": store.version()})
 
-        response = json.dumps({"status": "ok"}).encode("utf-8")
-        self.send_response(HTTPStatus.OK)
-        self._set_cors_headers()
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Content-Length", str(len(response)))
-        self.end_headers()
-        self.wfile.write(response)
+    # --- Parcels endpoints -----------------------------------------------
+
+    def _parcel_dataset(self, params: Dict[str, list[str]]) -> Optional[ParcelDataset]:
+        name = params.get("subset", [""])[0].strip()
+        if not name:
+            return get_parcel_dataset()
+        subset = get_parcel_subset(name)
+        if subset is None:
+            self.send_error(HTTPStatus.NOT_FOUND, f"Unknown subset '{name}'")
+        return subset
+
+    def _handle_parcels(self, params: Dict[str, list[str]]) -> None:
+        try:
+            filters = parse_parcel_filters(params)
+            offset = max(int(params.get("offset", ["0"])[0] or 0), 0)
+            limit = int(params.get("limit", [str(PARCELS_PAGE_LIMIT)])[0] or PARCELS_PAGE_LIMIT)
+        except ValueError as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(error))
+            return
+        limit = min(max(limit, 1), PARCELS_MAX_LIMIT)
+
+        dataset = self._parcel_dataset(params)
+        if dataset is None:
+            return
+        rows = dataset.query(**filters)
+        self._send_json(
+            {
+                "total": len(rows),
+                "offset": offset,
+                "limit": limit,
+                "items": [dataset.record(row) for row in rows[offset : offset + limit]],
+            }
+        )
+
+    def _handle_stats(self, params: Dict[str, list[str]]) -> None:
+        try:
+            filters = parse_parcel_filters({**params, "sort": [""]})
+        except ValueError as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(error))
+            return
+        dataset = self._parcel_dataset(params)
+        if dataset is None:
+            return
+        started = time.perf_counter()
+        narrowed = bool(filters["cadastral"] or filters["article"]) or any(
+            bound is not None for bounds in filters["ranges"].values() for bound in bounds
+        )
+        precomputed = dataset is get_parcel_dataset() and not narrowed
+        if precomputed:
+            payload = get_parcel_stats().render(filters["region"])
+        else:
+            rows = dataset.query(**filters)
+            payload = render_stats(*aggregate_selection(dataset, rows))
+        payload["precomputed"] = precomputed
+        payload["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self._send_json(payload)
+
+    def _handle_parcels_search(self, params: Dict[str, list[str]]) -> None:
+        query = params.get("q", [""])[0].strip()
+        if not query:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Parameter 'q' is required")
+            return
+        try:
+            filters = parse_parcel_filters({**params, "sort": [""]})
+            offset = max(int(params.get("offset", ["0"])[0] or 0), 0)
+            limit = int(params.get("limit", [str(PARCELS_PAGE_LIMIT)])[0] or PARCELS_PAGE_LIMIT)
+        except ValueError as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(error))
+            return
+        limit = min(max(limit, 1), PARCELS_MAX_LIMIT)
+
+        dataset = self._parcel_dataset(params)
+        if dataset is None:
+            return
+        has_filters = any(
+            [filters["region"], filters["cadastral"], filters["article"]]
+            + [bound is not None for bounds in filters["ranges"].values() for bound in bounds]
+        )
+        allowed = set(dataset.query(**filters)) if has_filters else None
+        found = dataset.search(query, allowed)
+        terms, phrases = parse_search_query(query)
+        items = []
+        for row, score in found[offset : offset + limit]:
+            item = dataset.record(row)
+            item["score"] = round(score, 4)
+            items.append(item)
+        self._send_json(
+            {
+                "query": query,
+                "terms": terms,
+                "phrases": [" ".join(phrase) for phrase in phrases],
+                "total": len(found),
+                "offset": offset,
+                "limit": limit,
+                "items": items,
+            }
+        )
+
+    def _handle_parcels_suggest(self, params: Dict[str, list[str]]) -> None:
+        query = params.get("q", [""])[0]
+        field = params.get("field", ["all"])[0]
+        if field not in ("all", "cadastral", "article"):
+            self.send_error(HTTPStatus.BAD_REQUEST, "Parameter 'field' must be all, cadastral or article")
+            return
+        try:
+            limit = int(params.get("limit", [str(SUGGEST_LIMIT)])[0] or SUGGEST_LIMIT)
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Parameter 'limit' must be an integer")
+            return
+        limit = min(max(limit, 1), SUGGEST_MAX_LIMIT)
+
+        dataset = get_parcel_dataset()
+        payload: Dict[str, Any] = {"query": query}
+        if field in ("all", "cadastral"):
+            payload["cadastral"] = dataset.suggest_cadastral(query, limit) if query.strip() else []
+        if field in ("all", "article"):
+            payload["article"] = dataset.suggest_article(query, limit)
+        self._send_json(payload)
+
+    def _handle_parcels_within(self, params: Dict[str, list[str]]) -> None:
+        try:
+            bbox = tuple(float(part) for part in params.get("bbox", [""])[0].split(","))
+            if len(bbox) != 4:
+                raise ValueError
+        except ValueError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Parameter 'bbox' must be minLon,minLat,maxLon,maxLat")
+            return
+        try:
+            zoom = int(float(params.get("zoom", [str(MAP_POLYGON_MIN_ZOOM)])[0]))
+            filters = parse_parcel_filters(params)
+        except ValueError as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(error) or "Invalid parameters")
+            return
+
+        dataset = get_parcel_dataset()
+        has_filters = any(
+            [filters["region"], filters["cadastral"], filters["article"]]
+            + [bound is not None for bounds in filters["ranges"].values() for bound in bounds]
+        )
+        allowed_rows = set(dataset.query(**{**filters, "sort": ""})) if has_filters else None
+
+        self._send_json(get_parcel_map_index().render(bbox, zoom, dataset, allowed_rows))
+
+    def _handle_tile(self, path: str) -> None:
+        match = re.fullmatch(r"/tiles/(\d+)/(\d+)/(\d+)\.geojson", path)
+        if not match:
+            self.send_error(HTTPStatus.NOT_FOUND, "Tile not found")
+            return
+        z, x, y = (int(part) for part in match.groups())
+        if z > TILE_MAX_ZOOM or x >= 2**z or y >= 2**z:
+            self.send_error(HTTPStatus.NOT_FOUND, "Tile out of range")
+            return
+
+        index = get_parcel_map_index()
+        dataset = get_parcel_dataset()
+        bbox = tile_bbox(z, x, y)
+        index.query(bbox)  # подтягивает свежий снимок до вычисления ключа
+        etag = f'"tile-{index.content_tag}.{dataset.content_tag}-{z}-{x}-{y}"'
+        headers = {"ETag": etag, "Cache-Control": "public, max-age=300", "Vary": "Accept-Encoding"}
+        if etag in parse_etags(self.headers.get("If-None-Match", "")):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._set_cors_headers()
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        compressed = _TILE_CACHE.get_or_build(
+            (index.content_tag, dataset.content_tag, z, x, y),
+            lambda: index.render(bbox, z, dataset, extra=f'"tile":[{z},{x},{y}],'),
+        )
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+            body = compressed
+        else:
+            body = gzip.decompress(compressed)
+        self._send_json(body, headers=headers)
 
     # --- AI integration ---------------------------------------------------
 
-    def _handle_ai_describe(self) -> None:
+    def _handle_ai_describe(self, stream: bool = False) -> None:
         if not YANDEX_GPT_ENABLED:
             self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "YandexGPT is not configured")
             return
@@ -332,40 +4990,166 @@ class NotesHandler(BaseHTTPRequestHandler):
 
         existing_note = payload.get("existing_note")
         instruction = payload.get("instruction")
+        force = bool(payload.get("force"))
+
+        if stream:
+            self._stream_ai_describe(build_prompt(record, existing_note, instruction), force)
+            return
 
         try:
             prompt = build_prompt(record, existing_note, instruction)
-            gpt_text = call_yandex_gpt(prompt)
+            gpt_text, cached = get_ai_cache().generate(prompt, force=force)
         except RuntimeError as error:
-            payload = json.dumps(
+            self._send_json(
                 {
                     "error": "YandexGPT request failed",
                     "details": str(error),
                 },
-                ensure_ascii=False,
-            ).encode("utf-8")
-            self.send_response(HTTPStatus.BAD_GATEWAY)
-            self._set_cors_headers()
-            self.send_header("Content-Type", "application/json; charset=utf-8")
-            self.send_header("Content-Length", str(len(payload)))
-            self.end_headers()
-            self.wfile.write(payload)
+                status=HTTPStatus.BAD_GATEWAY,
+            )
             return
 
-        response = json.dumps({"text": gpt_text}, ensure_ascii=False).encode("utf-8")
+        self._send_json({"text": gpt_text, "cached": cached}, headers={"X-Cache": "HIT" if cached else "MISS"})
+
+    def _stream_ai_describe(self, prompt: str, force: bool) -> None:
+        """
+        SSE-ответ /ai/describe?stream=1: события delta с приростом текста, reset —
+        если модель переписала начало, done — итог, error — сбой. Если клиент
+        ушёл, запрос к YandexGPT обрывается, не дожидаясь конца генерации.
+        """
+        cache = get_ai_cache()
+        key = completion_cache_key(prompt)
+        cached = cache.lookup(key, force)
+
         self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("X-Accel-Buffering", "no")
+        self.send_header("X-Cache", "HIT" if cached is not None else "MISS")
         self._set_cors_headers()
-        self.send_header("Content-Type", "application/json; charset=utf-8")
-        self.send_header("Content-Length", str(len(response)))
         self.end_headers()
-        self.wfile.write(response)
+        self.close_connection = True
+
+        if cached is not None:
+            self._send_event("done", {"text": cached, "cached": True})
+            return
+
+        sent = ""
+        chunks = stream_yandex_gpt(prompt)
+        try:
+            for text in chunks:
+                if self._client_disconnected():
+                    return
+                if text.startswith(sent):
+                    delivered = self._send_event("delta", {"text": text[len(sent):]})
+                else:
+                    delivered = self._send_event("reset", {"text": text})
+                if not delivered:
+                    return
+                sent = text
+        except (RuntimeError, OSError, http.client.HTTPException) as error:
+            # Заголовки 200 уже ушли: о сбое сообщаем событием, а не статусом.
+            self._send_event("error", {"error": "YandexGPT request failed", "details": str(error)})
+            return
+        finally:
+            chunks.close()
+
+        if not sent:
+            self._send_event("error", {"error": "YandexGPT request failed", "details": "YandexGPT вернул пустой ответ"})
+            return
+        cache.put(key, sent)
+        self._send_event("done", {"text": sent, "cached": False})
+
+    def _send_event(self, event: str, data: Dict[str, Any]) -> bool:
+        chunk = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+        try:
+            self.wfile.write(chunk)
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+        self._response_bytes += len(chunk)
+        return True
+
+    def _client_disconnected(self) -> bool:
+        # Тело запроса уже прочитано, так что «читаемый» сокет означает EOF от клиента.
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except (OSError, ValueError):
+            return True
+
+    def _handle_ai_batch(self) -> None:
+        if not YANDEX_GPT_ENABLED:
+            self.send_error(HTTPStatus.SERVICE_UNAVAILABLE, "YandexGPT is not configured")
+            return
+
+        content_length = int(self.headers.get("Content-Length", "0"))
+        if content_length <= 0:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Empty body")
+            return
+
+        body = self.rfile.read(content_length).decode("utf-8")
+        try:
+            payload = json.loads(body)
+        except json.JSONDecodeError:
+            self.send_error(HTTPStatus.BAD_REQUEST, "Invalid JSON")
+            return
+        if not isinstance(payload, dict):
+            self.send_error(HTTPStatus.BAD_REQUEST, "Expected JSON object")
+            return
+
+        try:
+            items = collect_batch_items(payload)
+        except ValueError as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, str(error))
+            return
+        if not items:
+            self.send_error(HTTPStatus.BAD_REQUEST, "No parcels matched")
+            return
+
+        instruction = payload.get("instruction")
+        job_id = get_ai_job_queue().submit(
+            items,
+            instruction=str(instruction) if instruction else None,
+            force=bool(payload.get("force")),
+            overwrite=bool(payload.get("overwrite")),
+        )
+        self._send_json(
+            {"job_id": job_id, "total": len(items), "status_url": f"/ai/jobs/{job_id}"},
+            status=HTTPStatus.ACCEPTED,
+            headers={"Location": f"/ai/jobs/{job_id}"},
+        )
+
+    def _handle_ai_job(self, job_id: str) -> None:
+        status = get_ai_job_queue().status(unquote(job_id))
+        if status is None:
+            self.send_error(HTTPStatus.NOT_FOUND, "Job not found")
+            return
+        self._send_json(status)
+
+    def _handle_knowledge_context(self) -> None:
+        try:
+            etag, payload = get_knowledge_context().snapshot()
+        except UpstreamError as error:
+            self.send_error(HTTPStatus.BAD_GATEWAY, str(error))
+            return
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in parse_etags(self.headers.get("If-None-Match", "")):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self._set_cors_headers()
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+        self._send_json(payload, headers=headers)
 
     def serve_static(self, path: str) -> None:
         if not PUBLIC_DIR.exists():
             self.send_error(HTTPStatus.NOT_FOUND, "Static directory missing")
             return
 
-        requested = unquote(path.split("?", 1)[0])
+        requested, _, query = path.partition("?")
+        requested = unquote(requested)
         if requested == "/" or not requested:
             requested = "/index.html"
 
@@ -397,40 +5181,479 @@ class NotesHandler(BaseHTTPRequestHandler):
             self.send_error(HTTPStatus.NOT_FOUND, "File not found")
             return
 
-        content_type, _ = mimetypes.guess_type(target.name)
-        if not content_type:
-            content_type = "application/octet-stream"
+        self._send_static_asset(target, _STATIC_CACHE.get(target), static_cache_control(target.name, query))
 
-        data = target.read_bytes()
-        self.send_response(HTTPStatus.OK)
-        self.send_header("Content-Type", content_type)
-        self.send_header("Content-Length", str(len(data)))
+    def _send_static_asset(self, path: Path, asset: StaticAsset, cache_control: str) -> None:
+        encoding = choose_encoding(self.headers.get("Accept-Encoding", ""), asset.variants)
+        byte_range = None
+        range_header = self.headers.get("Range")
+        if range_header and self._if_range_matches(asset):
+            try:
+                byte_range = parse_byte_range(range_header, asset.size)
+            except ValueError:
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header("Content-Range", f"bytes */{asset.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if byte_range is not None:
+                # Диапазоны считаются по несжатому файлу.
+                encoding = "identity"
+        headers = {
+            "ETag": asset.etag_for(encoding),
+            "Last-Modified": asset.last_modified,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+            "Accept-Ranges": "bytes",
+        }
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            not_modified = asset.matches(if_none_match)
+        else:
+            not_modified = self._not_modified_since(asset)
+        if not_modified:
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        body = asset.variants.get(encoding)
+        start, end = byte_range or (0, asset.size - 1)
+        if byte_range is not None:
+            self.send_response(HTTPStatus.PARTIAL_CONTENT)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{asset.size}")
+        else:
+            self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", asset.content_type)
+        self.send_header("Content-Length", str(end - start + 1 if body is None or byte_range else len(body)))
+        if encoding != "identity":
+            self.send_header("Content-Encoding", encoding)
+        for name, value in headers.items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(data)
+        if body is not None:
+            self.wfile.write(memoryview(body)[start : end + 1] if byte_range else body)
+        elif asset.size:
+            self._send_file(path, start, end - start + 1)
+
+    def _send_file(self, path: Path, offset: int, length: int) -> None:
+        """Тело с диска: sendfile прямо в сокет, без сокета (asyncio-режим) — кусками."""
+        with path.open("rb") as fh:
+            sendfile = getattr(self.connection, "sendfile", None)
+            if sendfile is not None:
+                sendfile(fh, offset, length)
+                return
+            fh.seek(offset)
+            while length > 0:
+                chunk = fh.read(min(STATIC_CHUNK_BYTES, length))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+    def _if_range_matches(self, asset: StaticAsset) -> bool:
+        # If-Range: диапазон действует, только если у клиента та же версия файла.
+        header = self.headers.get("If-Range")
+        if not header:
+            return True
+        if header.strip().startswith(('"', "W/")):
+            return header.strip() == asset.etag_for("identity")
+        return header.strip() == asset.last_modified
+
+    def _not_modified_since(self, asset: StaticAsset) -> bool:
+        header = self.headers.get("If-Modified-Since")
+        if not header:
+            return False
+        try:
+            since = parsedate_to_datetime(header)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        return asset.mtime_ns // 1_000_000_000 <= int(since.timestamp())
+
+
+# --- Asyncio server mode ------------------------------------------------
+
+ASYNC_WORKER_THREADS = int(os.getenv("ASYNC_WORKER_THREADS", "32"))
+ASYNC_KEEPALIVE_TIMEOUT = float(os.getenv("ASYNC_KEEPALIVE_TIMEOUT", "15"))
+ASYNC_DRAIN_TIMEOUT = float(os.getenv("ASYNC_DRAIN_TIMEOUT", "30"))
+ASYNC_MAX_HEADER_BYTES = 64 * 1024
+ASYNC_UPSTREAM_LIMITS = {
+    "map": int(os.getenv("ASYNC_MAP_CONCURRENCY", str(UPSTREAM_MAX_CONNECTIONS))),
+    "yandex_gpt": int(os.getenv("ASYNC_AI_CONCURRENCY", str(UPSTREAM_MAX_CONNECTIONS))),
+}
+CONTENT_LENGTH_RE = re.compile(rb"\r\ncontent-length:[ \t]*(\d+)", re.IGNORECASE)
+
+
+def upstream_for_route(method: str, path: str) -> Optional[str]:
+    """Какой внешний сервис может надолго занять обработчик этого маршрута."""
+    if path == "/proxy-map":
+        return "map"
+    if method == "POST" and path == "/ai/describe":
+        return "yandex_gpt"
+    return None
+
+
+class _LoopWriter:
+    """wfile обработчика, работающего в потоке: пишет в транспорт asyncio и ждёт drain."""
+
+    def __init__(self, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop) -> None:
+        self._writer = writer
+        self._loop = loop
+
+    @property
+    def closing(self) -> bool:
+        return self._writer.is_closing()
+
+    def write(self, data: bytes) -> int:
+        if self._writer.is_closing():
+            raise BrokenPipeError("client connection closed")
+        asyncio.run_coroutine_threadsafe(self._write(bytes(data)), self._loop).result()
+        return len(data)
+
+    async def _write(self, data: bytes) -> None:
+        self._writer.write(data)
+        await self._writer.drain()
+
+    def flush(self) -> None:
+        pass
+
+
+class AsyncBridgeHandler(NotesHandler):
+    """
+    NotesHandler поверх уже прочитанного asyncio-сервером запроса: те же
+    маршруты и ответы, но сокетом владеет цикл событий, а HTTP/1.1 keep-alive
+    решается по заголовкам клиента.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def __init__(
+        self,
+        raw_request: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        loop: asyncio.AbstractEventLoop,
+        client_address: tuple,
+    ) -> None:
+        # BaseRequestHandler.__init__ сразу обслуживает сокет — здесь он не нужен.
+        self.rfile = io.BytesIO(raw_request)
+        self.wfile = _LoopWriter(writer, loop)
+        self.client_address = client_address
+        self.server = None
+        self.connection = None
+        self.close_connection = True
+        self._reader = reader
+
+    def run(self) -> bool:
+        """Обслуживает запрос; True — соединение можно оставить открытым."""
+        try:
+            self.handle_one_request()
+        except ConnectionError:
+            return False
+        except Exception as error:  # noqa: BLE001
+            print(f"[async] {self.client_address[0]} {getattr(self, 'requestline', '')}: {error!r}")
+            return False
+        return not self.close_connection
+
+    def _client_disconnected(self) -> bool:
+        return self._reader.at_eof() or self.wfile.closing
+
+
+class AsyncNotesServer:
+    """
+    Сервер на asyncio: соединения и keep-alive живут в цикле событий, а
+    обработчики исполняются в ограниченном пуле потоков. Маршруты, которые
+    ходят в map.ru или YandexGPT, дополнительно ограничены семафором на
+    каждый внешний сервис, поэтому всплеск таких запросов ждёт в очереди
+    цикла, а не плодит потоки. По SIGINT/SIGTERM сервер перестаёт принимать
+    соединения, закрывает простаивающие и дожидается начатых запросов.
+    """
+
+    def __init__(self, host: str, port: int, threads: int = ASYNC_WORKER_THREADS, reuse_port: bool = False) -> None:
+        self.host = host
+        self.port = port
+        self.threads = threads
+        self.reuse_port = reuse_port
+        self._connections: Dict[asyncio.Task, bool] = {}
+        self._closing = False
+
+    async def serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="async-handler")
+        self._limits = {name: asyncio.Semaphore(max(limit, 1)) for name, limit in ASYNC_UPSTREAM_LIMITS.items()}
+        server = await asyncio.start_server(
+            self._handle_connection,
+            self.host or None,
+            self.port,
+            limit=ASYNC_MAX_HEADER_BYTES,
+            backlog=HTTP_LISTEN_BACKLOG,
+            reuse_address=True,
+            reuse_port=self.reuse_port or None,
+        )
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(signum)
+            await self._shutdown(server)
+
+    async def _shutdown(self, server: asyncio.AbstractServer) -> None:
+        self._closing = True
+        server.close()
+        busy = []
+        for task, active in list(self._connections.items()):
+            if active:
+                busy.append(task)
+            else:
+                task.cancel()
+        if busy:
+            print(f"Ждём завершения {len(busy)} запросов (до {ASYNC_DRAIN_TIMEOUT:.0f} с)...")
+            _, unfinished = await asyncio.wait(busy, timeout=ASYNC_DRAIN_TIMEOUT)
+            for task in unfinished:
+                task.cancel()
+        await server.wait_closed()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections[task] = False
+        peer = writer.get_extra_info("peername") or ("", 0)
+        try:
+            while not self._closing:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), ASYNC_KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+                    break
+                self._connections[task] = True
+                match = CONTENT_LENGTH_RE.search(head)
+                body = await reader.readexactly(int(match.group(1))) if match else b""
+                if not await self._dispatch(head + body, reader, writer, peer):
+                    break
+                self._connections[task] = False
+        except (asyncio.CancelledError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, asyncio.CancelledError):
+                pass
+
+    async def _dispatch(
+        self, raw_request: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, peer: tuple
+    ) -> bool:
+        loop = asyncio.get_running_loop()
+        method, _, rest = raw_request.partition(b" ")
+        target = rest.split(b" ", 1)[0].decode("latin-1")
+        handler = AsyncBridgeHandler(raw_request, reader, writer, loop, peer)
+        limit = self._limits.get(upstream_for_route(method.decode("latin-1"), urlparse(target).path))
+        if limit is None:
+            keep_alive = await loop.run_in_executor(self._executor, handler.run)
+        else:
+            async with limit:
+                keep_alive = await loop.run_in_executor(self._executor, handler.run)
+        return keep_alive and not self._closing
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Сервер каталога участков, заметок и карты.")
+    parser.add_argument("--host", default="", help="адрес для прослушивания (по умолчанию все интерфейсы)")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--async",
+        dest="async_mode",
+        action="store_true",
+        help="asyncio-сервер с keep-alive и ограничением одновременных запросов к map.ru/YandexGPT",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.getenv("SERVER_WORKERS", "1")),
+        help="число процессов-воркеров на общем порту (SO_REUSEPORT); 1 — один процесс",
+    )
+    return parser.parse_args()
+
+
+# --- Prefork workers ----------------------------------------------------
+
+WORKER_MIN_UPTIME = 2.0
+WORKER_MAX_QUICK_FAILURES = 5
+# Очередь ещё не принятых соединений. Стандартные 5 переполняются уже при десятке
+# одновременных клиентов: лишние SYN теряются, и клиент ждёт повтора около секунды.
+HTTP_LISTEN_BACKLOG = int(os.getenv("HTTP_LISTEN_BACKLOG", "128"))
+
+
+class NotesHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer с очередью приёма на HTTP_LISTEN_BACKLOG соединений."""
+
+    request_queue_size = HTTP_LISTEN_BACKLOG
+
+
+class ReusePortHTTPServer(NotesHTTPServer):
+    """NotesHTTPServer, делящий порт с соседними процессами через SO_REUSEPORT."""
+
+    def server_bind(self) -> None:
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+def serve(args: argparse.Namespace, worker: Optional[int] = None) -> None:
+    """Один процесс-обработчик: worker=None — единственный процесс, иначе номер воркера."""
+    global WORKER_INDEX
+    WORKER_INDEX = worker
+    get_notes_store()
+    get_dataset_watcher().start()
+    if YANDEX_GPT_ENABLED and not worker:
+        # Незавершённые пакеты с прошлого запуска продолжают обрабатываться.
+        get_ai_job_queue().start()
+    reuse_port = worker is not None
+    try:
+        if args.async_mode:
+            asyncio.run(AsyncNotesServer(args.host, args.port, reuse_port=reuse_port).serve())
+        else:
+            server_class = ReusePortHTTPServer if reuse_port else NotesHTTPServer
+            httpd = server_class((args.host, args.port), NotesHandler)
+            if reuse_port:
+                signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=httpd.shutdown).start())
+            try:
+                httpd.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                httpd.server_close()
+    finally:
+        store = get_notes_store()
+        store.compact()
+        store.close()
+
+
+def run_supervisor(args: argparse.Namespace) -> None:
+    """
+    Prefork: каталог загружается один раз до fork и делится между воркерами
+    копированием при записи. Каждый воркер слушает тот же порт (SO_REUSEPORT),
+    ядро распределяет соединения. Упавший воркер перезапускается; если воркеры
+    падают сразу после старта несколько раз подряд, супервизор сдаётся.
+    """
+    children: Dict[int, tuple[int, float]] = {}
+    stopping = False
+    quick_failures = 0
+
+    def spawn(index: int) -> None:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.default_int_handler)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                serve(args, worker=index)
+            except BaseException as error:  # noqa: BLE001
+                if not isinstance(error, (KeyboardInterrupt, SystemExit)):
+                    print(f"[worker {index}] {error!r}", file=sys.stderr)
+                    code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+
+    def stop(signum: int, _frame: Any) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(args.workers):
+        spawn(index)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        if pid not in children:
+            continue
+        index, started = children.pop(pid)
+        if stopping:
+            continue
+        code = os.waitstatus_to_exitcode(status)
+        quick_failures = quick_failures + 1 if time.monotonic() - started < WORKER_MIN_UPTIME else 0
+        if quick_failures >= WORKER_MAX_QUICK_FAILURES:
+            print(f"Воркеры падают при старте (последний код {code}) — останавливаюсь.", file=sys.stderr)
+            stop(signal.SIGTERM, None)
+            continue
+        print(f"[supervisor] воркер {index} (pid {pid}) завершился с кодом {code}, перезапускаю")
+        spawn(index)
 
 
 def main() -> None:
-    ensure_data_file()
-    server_address = ("", 8080)
-    httpd = ThreadingHTTPServer(server_address, NotesHandler)
-    host, port = httpd.server_address
-    url = f"http://localhost:{port}"
-    print(f"Backend server is running at {url}")
+    args = parse_args()
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        raise SystemExit("--workers требует SO_REUSEPORT (Linux, macOS)")
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    started = time.perf_counter()
+    dataset = get_parcel_dataset()
+    get_parcel_stats()  # до fork, чтобы воркеры получили готовые сводки и индексы
+    dataset.text_index()
+    print(
+        f"Parcels: {dataset.size} rows from {Path(dataset.source).name} "
+        f"({(time.perf_counter() - started) * 1000:.0f} ms)"
+    )
+    url = f"http://localhost:{args.port}"
+    mode = "asyncio" if args.async_mode else "threads"
+    if args.workers > 1:
+        mode += f", {args.workers} workers"
+    print(f"Backend server is running at {url} ({mode})")
+    print(f"Notes backend: {NOTES_BACKEND}")
+    if DATASET_RELOAD_INTERVAL > 0:
+        print(f"Dataset hot reload: проверка файлов каталога каждые {DATASET_RELOAD_INTERVAL:g} с")
+    if SLOW_REQUEST_SECONDS > 0:
+        print(f"Slow request log: запросы дольше {SLOW_REQUEST_SECONDS:g} с со стеками (сэмпл каждые {SLOW_REQUEST_SAMPLE_INTERVAL:g} с)")
     print("Endpoints:")
-    print("  GET  /notes")
+    print("  GET  /notes  (ETag/If-None-Match, ?since=<version> — только изменения)")
+    print("  GET  /notes/<cad>")
     print("  POST /notes  (JSON: cadastral_number, description?, avito_link?)")
-    print("  GET  /proxy-map?query=<cad>  (границы участка через map.ru)")
+    print("  GET  /parcels?region=&cadastral=&article=&area_min=&area_max=&price_min=&price_max=&sort=&offset=&limit=&subset=")
+    print("  GET  /parcels/regions  (?subset= — то же для подборки)")
+    print("  GET  /parcels/snapshot  (версия снимка каталога и последняя горячая перезагрузка)")
+    print("  GET  /parcels/subsets  (urgent_sales, kedrograd, avito_mentions; ?subset= у /parcels)")
+    print("  GET  /stats  (сводки по районам: цены, площади, назначение, балансовая стоимость; фильтры как у /parcels)")
+    print('  GET  /parcels/search?q=  (полнотекстовый поиск BM25 по описаниям; "фраза", фильтры как у /parcels)')
+    print("  GET  /parcels/suggest?q=&field=all|cadastral|article")
+    print("  GET  /parcels/within?bbox=minLon,minLat,maxLon,maxLat&zoom=")
+    print("  GET  /tiles/<z>/<x>/<y>.geojson  (gzip, упрощённые границы под масштаб)")
+    print("  GET  /proxy-map?query=<cad>  (границы участка через map.ru, с кешем в data/geometry.sqlite3)")
+    print("  GET  /metrics  (Prometheus: маршруты, внешние сервисы, блокировки, потоки, кеши)")
+    print("  GET  /upstreams  (пулы соединений к map.ru и YandexGPT: задержки, ошибки, предохранитель)")
+    print(f"  GET  /knowledge/context  (сводка о сайте для чат-бота n8n, ETag/If-None-Match; источник {KNOWLEDGE_SOURCE})")
     if YANDEX_GPT_ENABLED:
-        print("  POST /ai/describe  (генерация текста через YandexGPT)")
+        print("  POST /ai/describe  (генерация текста через YandexGPT, кеш ответов; force=true — мимо кеша)")
+        print("  POST /ai/describe?stream=1  (то же, потоком Server-Sent Events)")
+        print("  GET  /ai/cache  (статистика кеша генераций)")
+        print("  POST /ai/describe/batch  (JSON: cadastral_numbers[] или filter{}, instruction?, force?, overwrite?)")
+        print("  GET  /ai/jobs/<id>  (прогресс и результаты пакетной генерации)")
         if YANDEX_GPT_SYSTEM_PROMPT:
             print("    ↳ системный промт берётся из YANDEX_GPT_SYSTEM_PROMPT")
     else:
         print("  POST /ai/describe  (недоступно — нет переменных YANDEX_GPT_API_KEY/URI)")
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        print("\nShutting down...")
-        httpd.server_close()
+    if args.workers > 1:
+        run_supervisor(args)
+    else:
+        serve(args)
+    print("\nShutting down...")
 
 
 if __name__ == "__main__":
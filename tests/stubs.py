@@ -0,0 +1,71 @@
+"""
+Локальные HTTP-заглушки вместо map.ru и YandexGPT для тестов server.py.
+Заодно кладёт корень репозитория в sys.path, чтобы тесты импортировали server.
+"""
+
+from __future__ import annotations
+
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+Responder = Callable[[str, str, Dict[str, str], bytes], tuple[int, Dict[str, str], bytes]]
+
+
+class StubServer:
+    """
+    ThreadingHTTPServer на свободном порту. responder(method, path, headers, body)
+    возвращает (status, headers, body); все запросы копятся в calls.
+    """
+
+    def __init__(self, responder: Responder) -> None:
+        self.responder = responder
+        self.calls: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+                pass
+
+            def _respond(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", "0") or 0))
+                with stub._lock:
+                    stub.calls.append((self.command, self.path))
+                status, headers, payload = stub.responder(self.command, self.path, dict(self.headers), body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if "Content-Length" in headers:
+                    # Заявленная длина больше тела — имитация обрыва посреди ответа.
+                    self.close_connection = True
+                else:
+                    self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = _respond  # noqa: N815
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self.calls)
+
+    def __enter__(self) -> "StubServer":
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,129 @@
+import json
+import sqlite3
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from stubs import StubServer
+
+import server
+
+
+def completion(text: str) -> bytes:
+    return json.dumps({"result": {"alternatives": [{"message": {"role": "assistant", "text": text}}]}}).encode()
+
+
+class AiJobQueueTest(unittest.TestCase):
+    """Пакетная генерация против локальной заглушки YandexGPT."""
+
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp(prefix="ai-jobs-"))
+        self.throttled: set[str] = set()
+        self.stub = StubServer(self.respond).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+
+        patcher = mock.patch.object(server, "NOTES_LOCK", server.FileLock(self.tmp / "notes.lock"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        store = server.SqliteNotesStore(self.tmp / "notes.sqlite3")
+        for patcher in (
+            mock.patch.multiple(
+                server,
+                YANDEX_GPT_ENABLED=True,
+                YANDEX_GPT_API_URL=f"{self.stub.url}/foundationModels/v1/completion",
+                YANDEX_GPT_API_KEY="test",
+                YANDEX_GPT_MODEL_URI="gpt://test/yandexgpt-lite",
+                _NOTES_STORE=store,
+                _NOTES_CACHE=server.NotesCache(store),
+                _AI_CACHE=server.AiCache(self.tmp / "ai_cache.sqlite3"),
+            ),
+            mock.patch.dict(server._UPSTREAMS, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.store = store
+
+    def respond(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        prompt = json.loads(body)["messages"][-1]["text"]
+        if "THROTTLE" in prompt and prompt not in self.throttled:
+            self.throttled.add(prompt)
+            return 429, {}, b'{"error": "rate limited"}'
+        if "REJECT" in prompt:
+            return 400, {}, b'{"error": "bad request"}'
+        return 200, {"Content-Type": "application/json"}, completion(f"Описание #{len(self.stub.calls)}")
+
+    def make_queue(self, workers: int, start: bool = True) -> server.AiJobQueue:
+        queue = server.AiJobQueue(self.tmp / "ai_jobs.sqlite3", workers=workers, rate=0, retries=2, backoff=0.01)
+        if start:
+            queue.start()
+        self.addCleanup(queue.stop, 5)
+        return queue
+
+    def wait(self, queue: server.AiJobQueue, job_id: str) -> dict:
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            status = queue.status(job_id)
+            if status["finished_at"] is not None:
+                return status
+            time.sleep(0.02)
+        self.fail(f"job {job_id} did not finish: {queue.status(job_id)}")
+
+    def test_job_generates_retries_and_fails_per_item(self) -> None:
+        queue = self.make_queue(workers=2)
+        job_id = queue.submit(
+            [
+                ("22:01:000001:1", {"cadastral_number": "22:01:000001:1", "region": "Алтай"}),
+                ("22:01:000001:2", {"cadastral_number": "22:01:000001:2", "region": "THROTTLE"}),
+                ("22:01:000001:3", {"cadastral_number": "22:01:000001:3", "region": "REJECT"}),
+                ("22:01:000001:4", None),
+            ]
+        )
+        items = {item["cadastral_number"]: item for item in self.wait(queue, job_id)["items"]}
+
+        self.assertEqual(items["22:01:000001:1"]["status"], "done")
+        self.assertEqual(items["22:01:000001:2"]["status"], "done")
+        self.assertEqual(items["22:01:000001:2"]["attempts"], 2)
+        self.assertEqual(items["22:01:000001:3"]["status"], "failed")
+        self.assertEqual(items["22:01:000001:3"]["attempts"], 1)
+        self.assertEqual(items["22:01:000001:4"]["status"], "failed")
+        self.assertEqual(self.store.get("22:01:000001:1")["description"], items["22:01:000001:1"]["text"])
+        self.assertIsNone(self.store.get("22:01:000001:3"))
+
+    def test_unexpected_errors_fail_the_item_and_keep_the_worker(self) -> None:
+        original_upsert = self.store.upsert
+
+        def upsert(cadastral: str, fields: dict) -> None:
+            if cadastral == "broken":
+                raise sqlite3.OperationalError("database is locked")
+            original_upsert(cadastral, fields)
+
+        queue = self.make_queue(workers=1, start=False)
+        first = queue.submit([("broken", {"region": "Алтай"}), ("bad-record", {"region": "x"})])
+        queue._conn().execute("UPDATE job_items SET record='{' WHERE cadastral='bad-record'")
+        with mock.patch.object(self.store, "upsert", upsert):
+            queue.start()
+            items = {item["cadastral_number"]: item for item in self.wait(queue, first)["items"]}
+        self.assertEqual(items["broken"]["status"], "failed")
+        self.assertIn("OperationalError", items["broken"]["error"])
+        self.assertEqual(items["bad-record"]["status"], "failed")
+        self.assertIn("JSONDecodeError", items["bad-record"]["error"])
+
+        # Тот же единственный поток разбирает следующее задание.
+        second = queue.submit([("22:01:000002:1", {"region": "Алтай"})])
+        self.assertEqual(self.wait(queue, second)["items"][0]["status"], "done")
+        self.assertTrue(all(thread.is_alive() for thread in queue._threads))
+
+    def test_worker_marks_item_failed_when_processing_raises(self) -> None:
+        queue = self.make_queue(workers=1)
+        with mock.patch.object(queue, "_process", side_effect=KeyError("record")):
+            job_id = queue.submit([("22:01:000003:1", {"region": "Алтай"})])
+            item = self.wait(queue, job_id)["items"][0]
+        self.assertEqual(item["status"], "failed")
+        self.assertIn("KeyError", item["error"])
+        self.assertTrue(all(thread.is_alive() for thread in queue._threads))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+import http.client
+import json
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+from stubs import StubServer
+
+import server
+
+
+class AiDescribeStreamTest(unittest.TestCase):
+    """POST /ai/describe?stream=1 против заглушки YandexGPT, обрывающей поток."""
+
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp(prefix="ai-stream-"))
+        self.lines = [{"result": {"alternatives": [{"message": {"text": "Участок у реки"}}]}}]
+        self.truncate = False
+        self.stub = StubServer(self.respond).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        patcher = mock.patch.multiple(
+            server,
+            YANDEX_GPT_ENABLED=True,
+            YANDEX_GPT_API_URL=f"{self.stub.url}/foundationModels/v1/completion",
+            YANDEX_GPT_API_KEY="test",
+            YANDEX_GPT_MODEL_URI="gpt://test/yandexgpt-lite",
+            _AI_CACHE=server.AiCache(self.tmp / "ai_cache.sqlite3"),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        upstreams = mock.patch.dict(server._UPSTREAMS, clear=True)
+        upstreams.start()
+        self.addCleanup(upstreams.stop)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), server.NotesHandler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.addCleanup(self.httpd.server_close)
+        self.addCleanup(self.httpd.shutdown)
+
+    def respond(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        payload = b"".join(json.dumps(line, ensure_ascii=False).encode() + b"\n" for line in self.lines)
+        if self.truncate:
+            return 200, {"Content-Length": str(len(payload) + 500)}, payload
+        return 200, {}, payload
+
+    def stream(self) -> tuple[dict, list[tuple[str, dict]]]:
+        conn = http.client.HTTPConnection("127.0.0.1", self.httpd.server_address[1], timeout=10)
+        conn.request("POST", "/ai/describe?stream=1", body=json.dumps({"record": {"region": "Алтай"}}))
+        response = conn.getresponse()
+        events = []
+        for block in response.read().decode("utf-8").split("\n\n"):
+            if block.strip():
+                event, data = block.split("\n", 1)
+                events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+        return dict(response.getheaders()), events
+
+    def test_complete_stream(self) -> None:
+        headers, events = self.stream()
+        self.assertEqual(headers["Access-Control-Allow-Origin"], "*")
+        self.assertEqual([name for name, _ in events], ["delta", "done"])
+        self.assertEqual(events[-1][1]["text"], "Участок у реки")
+
+    def test_stream_cut_off_mid_body_ends_with_error_event(self) -> None:
+        self.truncate = True
+        with mock.patch("sys.stderr"):
+            _, events = self.stream()
+        self.assertEqual(events[0][0], "delta")
+        self.assertEqual(events[-1][0], "error")
+        self.assertEqual(server.get_upstream("yandex_gpt").errors, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
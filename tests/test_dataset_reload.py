@@ -0,0 +1,163 @@
+import random
+import unittest
+
+import server
+
+COLUMNS = (
+    "region",
+    "number",
+    "source_row",
+    "cadastral_number",
+    "cadastral_number_raw",
+    "article",
+    "area_ha",
+    "price_per_plot_rub",
+    "price_per_sotka_rub",
+    "context",
+    "location_description",
+)
+REGIONS = ("Алтайский край", " Алтайский край ", "Республика Алтай", "Новосибирская обл.", "", None)
+ARTICLES = ("ИЖС", " ижс ", "Сельхоз", "ЛПХ", "", None)
+WORDS = ("река", "реки", "лес", "берёза", "дорога", "озеро", "газ", "электричество", "посёлок", "вид")
+
+
+def random_cadastral(rng: random.Random) -> str:
+    number = f"22:{rng.randint(1, 3):02d}:{rng.randint(1, 4):06d}:{rng.randint(1, 30)}"
+    if rng.random() < 0.15:
+        number += f"; 22:{rng.randint(1, 3):02d}:{rng.randint(1, 4):06d}:{rng.randint(1, 30)}"
+    return number
+
+
+def random_value(rng: random.Random, column: str, source_row: int) -> object:
+    if column == "region":
+        return rng.choice(REGIONS)
+    if column == "number":
+        return rng.choice([rng.randint(1, 50), rng.randint(1, 50), None, "н/д"])
+    if column == "source_row":
+        # Пустой source_row даёт равные ключи порядка — их разводит только номер строки.
+        return source_row if rng.random() < 0.7 else None
+    if column == "cadastral_number":
+        return random_cadastral(rng)
+    if column == "cadastral_number_raw":
+        return rng.choice([random_cadastral(rng) + "  ", " " + random_cadastral(rng), "", None])
+    if column == "article":
+        return rng.choice(ARTICLES)
+    if column == "area_ha":
+        return rng.choice([round(rng.uniform(0.05, 5), 2), rng.randint(1, 3), None, "—"])
+    if column.startswith("price"):
+        return rng.choice([rng.randint(1, 40) * 50_000, None])
+    if rng.random() < 0.1:
+        return None
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 6)))
+
+
+def random_row(rng: random.Random, source_row: int) -> tuple:
+    return tuple(random_value(rng, column, source_row) for column in COLUMNS)
+
+
+def mutate(rng: random.Random, rows: list[tuple], next_source_row: int) -> tuple[list[tuple], int]:
+    """Правки, удаления, повторы, вставки и перенос блока — в сумме меньше половины строк."""
+    rows = list(rows)
+    for _ in range(rng.randint(0, 4)):
+        row = rng.randrange(len(rows))
+        column = rng.randrange(len(COLUMNS))
+        if COLUMNS[column] == "source_row":
+            continue
+        values = list(rows[row])
+        values[column] = random_value(rng, COLUMNS[column], next_source_row)
+        rows[row] = tuple(values)
+    for _ in range(rng.randint(0, 3)):
+        del rows[rng.randrange(len(rows))]
+    for _ in range(rng.randint(0, 2)):
+        rows.insert(rng.randrange(len(rows) + 1), rows[rng.randrange(len(rows))])
+    for _ in range(rng.randint(0, 3)):
+        rows.insert(rng.randrange(len(rows) + 1), random_row(rng, next_source_row))
+        next_source_row += 1
+    if rng.random() < 0.7:
+        start = rng.randrange(len(rows))
+        block = rows[start : start + rng.randint(1, 8)]
+        del rows[start : start + len(block)]
+        position = rng.randrange(len(rows) + 1)
+        rows[position:position] = block
+    return rows, next_source_row
+
+
+def to_columns(rows: list[tuple]) -> dict[str, list]:
+    return {column: [row[index] for row in rows] for index, column in enumerate(COLUMNS)}
+
+
+def trie_rows(trie: server.CadastralTrie) -> dict[str, list[int]]:
+    result: dict[str, list[int]] = {}
+    stack = [("", trie.root)]
+    while stack:
+        path, node = stack.pop()
+        assert node.keys == sorted(node.children), path
+        if node.rows:
+            result[path] = list(node.rows)
+        stack.extend((f"{path}:{key}" if path else key, node.children[key]) for key in node.keys)
+    return result
+
+
+def indexes(dataset: server.ParcelDataset) -> dict[str, object]:
+    text = dataset.text_index()
+    return {
+        "region_index": {key: list(rows) for key, rows in dataset.region_index.items()},
+        "sorted_columns": {
+            name: (list(column.values), list(column.rows), list(column.rank), column.missing)
+            for name, column in dataset.sorted_columns.items()
+        },
+        "default_order": list(dataset.default_order),
+        "default_rank": list(dataset.default_rank),
+        "cadastral_lower": dataset.cadastral_lower,
+        "article_lower": dataset.article_lower,
+        "cadastral_trigrams": {gram: sorted(rows) for gram, rows in dataset.cadastral_trigrams.postings.items()},
+        "article_trigrams": {gram: sorted(rows) for gram, rows in dataset.article_trigrams.postings.items()},
+        "cadastral_trie": trie_rows(dataset.cadastral_trie),
+        "cadastral_rows": dataset.cadastral_rows,
+        "article_rows": dataset.article_rows,
+        "raw_cadastral_keys": dataset.raw_cadastral_keys,
+        "match_total": dataset.match_total,
+        "text_fields": text.fields,
+        "text_lengths": list(text.lengths),
+        "text_postings": text.postings,
+        "text_average_length": text.average_length,
+    }
+
+
+class DatasetReloadTest(unittest.TestCase):
+    """Индексы после ParcelDataset.reload совпадают с построенными с нуля."""
+
+    def test_incremental_reload_matches_fresh_build(self) -> None:
+        for seed in range(25):
+            rng = random.Random(seed)
+            rows = [random_row(rng, source_row) for source_row in range(80)]
+            next_source_row = len(rows)
+            dataset = server.ParcelDataset(to_columns(rows))
+            dataset.text_index()
+            for step in range(6):
+                rows, next_source_row = mutate(rng, rows, next_source_row)
+                columns = to_columns(rows)
+                reloaded, summary = dataset.reload(columns)
+                self.assertEqual(summary["rebuilt"], 0)
+                fresh = server.ParcelDataset(to_columns(rows))
+                expected, actual = indexes(fresh), indexes(reloaded)
+                for name in expected:
+                    with self.subTest(seed=seed, step=step, index=name):
+                        self.assertEqual(actual[name], expected[name])
+                for needle in ("22:01", "22:02:000003", "ижс"):
+                    with self.subTest(seed=seed, step=step, query=needle):
+                        self.assertEqual(reloaded.cadastral_trie.search(needle, 50), fresh.cadastral_trie.search(needle, 50))
+                        self.assertEqual(reloaded.article_trigrams.search(needle), fresh.article_trigrams.search(needle))
+                dataset = reloaded
+
+    def test_unchanged_columns_keep_the_snapshot(self) -> None:
+        rng = random.Random(7)
+        rows = [random_row(rng, source_row) for source_row in range(20)]
+        dataset = server.ParcelDataset(to_columns(rows))
+        reloaded, summary = dataset.reload(to_columns(rows))
+        self.assertIs(reloaded, dataset)
+        self.assertEqual((summary["added"], summary["changed"], summary["removed"]), (0, 0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
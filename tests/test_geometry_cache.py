@@ -0,0 +1,145 @@
+import json
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from stubs import StubServer
+
+import server
+
+FOUND = "22:01:000001:1"
+MISSING = "22:01:000001:404"
+
+
+class GeometryCacheTest(unittest.TestCase):
+    """GeometryCache поверх настоящего fetch_map_boundary и локальной заглушки map.ru."""
+
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp(prefix="map-cache-"))
+        self.gate = threading.Event()
+        self.gate.set()
+        self.failing = False
+        self.stub = StubServer(self.respond).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        for patcher in (
+            mock.patch.object(server, "MAP_API_URL", f"{self.stub.url}/api/kad/search"),
+            mock.patch.dict(server._UPSTREAMS, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def respond(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        self.gate.wait(5)
+        if self.failing:
+            return 503, {}, b"unavailable"
+        query = parse_qs(urlparse(path).query)["query"][0]
+        if query == MISSING:
+            return 200, {}, b'{"success": true, "features": []}'
+        feature = {
+            "geometry": {"type": "Point", "coordinates": [9_500_000, 6_600_000]},
+            "properties": {"cn": query, "call": self.stub.count()},
+        }
+        return 200, {}, json.dumps({"success": True, "features": [feature]}).encode()
+
+    def make_cache(self, **options: float) -> server.GeometryCache:
+        return server.GeometryCache(self.tmp / "geometry.sqlite3", **options)
+
+    @staticmethod
+    def call_number(body: bytes) -> int:
+        return json.loads(body)["features"][0]["properties"]["call"]
+
+    def test_fresh_hit_then_expired_refetch(self) -> None:
+        cache = self.make_cache(ttl=0.2, stale_ttl=0)
+        body, state = cache.get(FOUND)
+        self.assertEqual((state, self.call_number(body)), ("MISS", 1))
+        body, state = cache.get(FOUND)
+        self.assertEqual((state, self.call_number(body)), ("HIT", 1))
+        self.assertEqual(self.stub.count(), 1)
+
+        time.sleep(0.25)
+        body, state = cache.get(FOUND)
+        self.assertEqual((state, self.call_number(body)), ("MISS", 2))
+
+    def test_stale_while_revalidate(self) -> None:
+        cache = self.make_cache(ttl=0.1, stale_ttl=60)
+        cache.get(FOUND)
+        time.sleep(0.15)
+        body, state = cache.get(FOUND)
+        self.assertEqual((state, self.call_number(body)), ("STALE", 1))
+
+        deadline = time.monotonic() + 5
+        while cache.is_fresh(FOUND) is False and time.monotonic() < deadline:
+            time.sleep(0.01)
+        body, state = cache.get(FOUND)
+        self.assertEqual((state, self.call_number(body)), ("HIT", 2))
+        self.assertEqual(self.stub.count(), 2)
+
+    def test_stale_copy_served_when_upstream_fails(self) -> None:
+        cache = self.make_cache(ttl=0.1, stale_ttl=0)
+        cache.get(FOUND)
+        time.sleep(0.15)
+        self.failing = True
+        body, state = cache.get(FOUND)
+        self.assertEqual((state, self.call_number(body)), ("STALE", 1))
+
+    def test_negative_caching(self) -> None:
+        cache = self.make_cache(negative_ttl=0.2, stale_ttl=60)
+        self.assertEqual(cache.get(MISSING)[1], "MISS")
+        self.assertEqual(cache.get(MISSING)[1], "HIT")
+        self.assertEqual(self.stub.count(), 1)
+
+        # «Не найдено» не отдаётся как устаревшее: после negative_ttl идём в map.ru синхронно.
+        time.sleep(0.25)
+        self.assertEqual(cache.get(MISSING)[1], "MISS")
+        self.assertEqual(self.stub.count(), 2)
+
+    def test_concurrent_misses_coalesce_into_one_upstream_call(self) -> None:
+        cache = self.make_cache()
+        self.gate.clear()
+        states: list[str] = []
+        bodies: list[bytes] = []
+        lock = threading.Lock()
+
+        def get() -> None:
+            body, state = cache.get(FOUND)
+            with lock:
+                states.append(state)
+                bodies.append(body)
+
+        threads = [threading.Thread(target=get) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while self.stub.count() < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        self.gate.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(self.stub.count(), 1)
+        self.assertEqual(states.count("MISS"), 1)
+        self.assertEqual(states.count("COALESCED"), 7)
+        self.assertEqual(len(set(bodies)), 1)
+
+    def test_eviction_counts_writes_from_other_processes(self) -> None:
+        # Два экземпляра на одной базе — как воркеры --workers N или prefetch_boundaries.py.
+        body = json.dumps({"success": True, "features": [{"properties": {"pad": "x" * 1000}}]}).encode()
+        caches = [self.make_cache(max_bytes=20 * len(body)) for _ in range(2)]
+        for index in range(60):
+            caches[index % 2].store(f"22:01:000009:{index}", body)
+        conn = caches[0]._conn()
+        total, count = conn.execute("SELECT SUM(size), COUNT(*) FROM map_cache").fetchone()
+        self.assertLessEqual(total, 20 * len(body))
+        self.assertEqual(conn.execute("SELECT total FROM map_cache_size").fetchone()[0], total)
+        # Вытесняются самые давно запрошенные — остаются последние записи.
+        self.assertIsNotNone(conn.execute("SELECT 1 FROM map_cache WHERE key=?", ("22:01:000009:59",)).fetchone())
+        self.assertLess(count, 60)
+
+
+if __name__ == "__main__":
+    unittest.main()
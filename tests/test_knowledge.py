@@ -0,0 +1,81 @@
+import json
+import threading
+import time
+import unittest
+from unittest import mock
+
+from stubs import StubServer
+
+import server
+
+SOURCE = {"desktopIcons": [{"label": "Каталог"}], "windows": [{"title": "О сайте", "content": "Земельные участки"}]}
+
+
+class KnowledgeContextTest(unittest.TestCase):
+    """KnowledgeContext против заглушки источника, которая то падает, то отвечает."""
+
+    def setUp(self) -> None:
+        self.failing = True
+        self.stub = StubServer(self.respond).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        self.source = f"{self.stub.url}/knowledge.json"
+        for patcher in (
+            mock.patch.object(server, "KNOWLEDGE_SOURCE", self.source),
+            mock.patch.dict(server._UPSTREAMS, clear=True),
+            mock.patch("sys.stderr"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def respond(self, method: str, path: str, headers: dict, body: bytes) -> tuple[int, dict, bytes]:
+        if self.failing:
+            return 503, {}, b"unavailable"
+        return 200, {"ETag": '"v1"'}, json.dumps(SOURCE, ensure_ascii=False).encode()
+
+    def test_failing_source_without_payload_backs_off(self) -> None:
+        context = server.KnowledgeContext(self.source, refresh=300, retry=0.3)
+        errors: list[Exception] = []
+
+        def fetch() -> None:
+            try:
+                context.snapshot()
+            except server.UpstreamError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=fetch) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(errors), 8)
+        self.assertEqual(context.fetches, 1)
+
+        started = time.monotonic()
+        with self.assertRaises(server.UpstreamError):
+            context.snapshot()
+        self.assertLess(time.monotonic() - started, 0.1)
+        self.assertEqual(context.fetches, 1)
+
+        self.failing = False
+        time.sleep(0.35)
+        etag, payload = context.snapshot()
+        self.assertEqual(context.fetches, 2)
+        self.assertEqual(etag, f'"knowledge-{context.version}"')
+        self.assertIn("Каталог", json.loads(payload)["summary"])
+
+    def test_failure_keeps_previous_payload_for_the_refresh_window(self) -> None:
+        self.failing = False
+        context = server.KnowledgeContext(self.source, refresh=0.2, retry=0.01)
+        etag, payload = context.snapshot()
+        self.failing = True
+        time.sleep(0.25)
+        self.assertEqual(context.snapshot(), (etag, payload))
+        self.assertEqual(context.fetches, 2)
+        self.assertIsNotNone(context.error)
+        time.sleep(0.05)
+        self.assertEqual(context.snapshot(), (etag, payload))
+        self.assertEqual(context.fetches, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import stubs  # noqa: F401  (корень репозитория в sys.path)
+
+import server
+
+
+class JsonNotesStoreTest(unittest.TestCase):
+    """Два экземпляра на одном notes.json — как процессы --workers."""
+
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp(prefix="notes-json-"))
+        self.path = self.tmp / "notes.json"
+        patcher = mock.patch.object(server, "NOTES_LOCK", server.FileLock(self.tmp / "notes.lock"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.first = server.JsonNotesStore(self.path)
+        self.second = server.JsonNotesStore(self.path)
+
+    def test_write_through_one_worker_is_visible_in_the_other(self) -> None:
+        cache = server.NotesCache(self.second)
+        version, etag, payload = cache.snapshot()
+        self.assertEqual(json.loads(payload), {})
+
+        self.first.upsert("22:01:000001:1", {"description": "новая"})
+        new_version, new_etag, new_payload = cache.snapshot()
+        self.assertGreater(new_version, version)
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(json.loads(new_payload)["22:01:000001:1"]["description"], "новая")
+        self.assertEqual(self.second.epoch(), self.first.epoch())
+        self.assertEqual(list(self.second.changes_since(version)), ["22:01:000001:1"])
+
+    def test_manual_edit_starts_a_new_epoch(self) -> None:
+        self.first.upsert("22:01:000001:1", {"description": "a"})
+        epoch, version = self.second.epoch(), self.second.version()
+        self.path.write_text(json.dumps({"22:01:000001:2": {"description": "руками"}}), encoding="utf-8")
+
+        self.assertNotEqual(self.second.epoch(), epoch)
+        self.assertGreater(self.second.version(), version)
+        self.assertEqual(self.first.epoch(), self.second.epoch())
+        _, _, payload = server.NotesCache(self.second).snapshot()
+        self.assertEqual(list(json.loads(payload)), ["22:01:000001:2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import random
+import unittest
+
+import server
+
+REGIONS = ("Алтайский край", " Алтайский край ", "Республика Алтай", "Новосибирская обл.", "", None)
+LAND_USE = ("ИЖС", "Сельхоз", " ЛПХ ", "", None)
+USAGE = ("house", "farm,house", "farm, garden", "", None)
+OWNERS = ("Администрация", "Фонд", "", None)
+
+
+def random_row(rng: random.Random, source_row: int) -> dict:
+    return {
+        "source_file": rng.choice(("a.csv", "b.csv")),
+        "source_row": source_row,
+        "cadastral_number": f"22:{rng.randint(1, 3):02d}:{rng.randint(1, 4):06d}:{rng.randint(1, 40)}",
+        "region": rng.choice(REGIONS),
+        # Цены и суммы кратны 1/4 — двоичные дроби складываются точно в любом порядке.
+        "price_per_sotka_rub": rng.choice([rng.randint(1, 400) * 250.25, rng.randint(1, 50) * 1000, None, "—"]),
+        "area_ha": rng.choice([rng.randint(1, 800) / 16, rng.randint(1, 5), None]),
+        "land_use": rng.choice(LAND_USE),
+        "recommended_usage": rng.choice(USAGE),
+        "owner": rng.choice(OWNERS),
+        "balance_value": rng.choice([rng.randint(-4, 4) * 1000.25, 0, None]),
+    }
+
+
+def to_columns(rows: list[dict]) -> dict[str, list]:
+    names = list(rows[0])
+    return {name: [row[name] for row in rows] for name in names}
+
+
+def rendered(stats: server.ParcelStats, region: str = "") -> dict:
+    payload = stats.render(region)
+    payload.pop("version")
+    return payload
+
+
+class ParcelStatsSyncTest(unittest.TestCase):
+    """Сводки после sync() по изменённому каталогу совпадают с посчитанными заново."""
+
+    def test_sync_after_random_edits_matches_fresh_stats(self) -> None:
+        for seed in range(20):
+            rng = random.Random(seed)
+            rows = [random_row(rng, source_row) for source_row in range(120)]
+            next_source_row = len(rows)
+            stats = server.ParcelStats()
+            stats.sync(server.ParcelDataset(to_columns(rows)))
+            for step in range(5):
+                rows = [dict(row) for row in rows]
+                for _ in range(rng.randint(0, 10)):
+                    row = rng.choice(rows)
+                    replacement = random_row(rng, row["source_row"])
+                    name = rng.choice([name for name in replacement if name != "source_row"])
+                    row[name] = replacement[name]
+                for _ in range(rng.randint(0, 10)):
+                    del rows[rng.randrange(len(rows))]
+                for _ in range(rng.randint(0, 3)):
+                    rows.insert(rng.randrange(len(rows) + 1), dict(rng.choice(rows)))
+                for _ in range(rng.randint(0, 8)):
+                    rows.append(random_row(rng, next_source_row))
+                    next_source_row += 1
+
+                dataset = server.ParcelDataset(to_columns(rows))
+                stats.sync(dataset)
+                fresh = server.ParcelStats()
+                fresh.sync(dataset)
+                for region in ["", "Алтайский край", "Республика Алтай", "Новосибирская обл.", "Нет такого"]:
+                    with self.subTest(seed=seed, step=step, region=region):
+                        self.assertEqual(rendered(stats, region), rendered(fresh, region))
+
+    def test_sync_counts_and_version(self) -> None:
+        rng = random.Random(3)
+        rows = [random_row(rng, source_row) for source_row in range(10)]
+        stats = server.ParcelStats()
+        self.assertEqual(stats.sync(server.ParcelDataset(to_columns(rows))), (10, 0))
+        self.assertEqual(stats.sync(server.ParcelDataset(to_columns(rows))), (0, 0))
+        self.assertEqual(stats.version, 1)
+        rows[4] = {**rows[4], "area_ha": 123.5}
+        self.assertEqual(stats.sync(server.ParcelDataset(to_columns(rows[:-1]))), (1, 2))
+        self.assertEqual(stats.version, 2)
+        self.assertEqual(stats.render()["total"]["count"], 9)
+
+
+class AggregateSelectionTest(unittest.TestCase):
+    """Сводки /stats по отфильтрованной выборке: итог — слияние районных агрегатов."""
+
+    def setUp(self) -> None:
+        rng = random.Random(11)
+        self.dataset = server.ParcelDataset(to_columns([random_row(rng, source_row) for source_row in range(300)]))
+
+    def test_merged_total_matches_region_parts(self) -> None:
+        for params in (
+            {"area_min": ["2"]},
+            {"price_max": ["30000"]},
+            {"region": ["Республика Алтай"], "area_max": ["20"]},
+            {"cadastral": ["22:01"]},
+            {"area_min": ["1000"]},
+        ):
+            with self.subTest(params=params):
+                filters = server.parse_parcel_filters({**params, "sort": [""]})
+                rows = self.dataset.query(**filters)
+                total, regions = server.aggregate_selection(self.dataset, rows)
+                expected_total, expected_regions = server.aggregate_by_region(server.stats_rows(self.dataset, rows))
+                self.assertEqual(
+                    server.render_stats(total, regions), server.render_stats(expected_total, expected_regions)
+                )
+
+                merged = server.RegionAggregate.merge(list(regions.values()))
+                unassigned = len(rows) - sum(aggregate.count for aggregate in regions.values())
+                self.assertEqual(total.count, merged.count + unassigned)
+                if not unassigned:
+                    self.assertEqual(total.summary(), merged.summary())
+                for name, aggregate in regions.items():
+                    self.assertEqual(aggregate.count, len([row for row in rows if row in self.dataset.region_index[name]]))
+
+
+if __name__ == "__main__":
+    unittest.main()
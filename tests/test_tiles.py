@@ -0,0 +1,54 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import server
+
+
+def feature(cadastral: str, lon: float) -> dict:
+    ring = [[lon, 53.0], [lon + 0.01, 53.0], [lon + 0.01, 53.01], [lon, 53.0]]
+    return {
+        "id": cadastral,
+        "geometry": {"type": "Polygon", "coordinates": [ring]},
+        "properties": {"cn": cadastral},
+        "bbox": [lon, 53.0, lon + 0.01, 53.01],
+    }
+
+
+class TileEtagTest(unittest.TestCase):
+    """Метки для ETag тайлов совпадают у независимых воркеров над одними данными."""
+
+    def setUp(self) -> None:
+        self.tmp = Path(tempfile.mkdtemp(prefix="tiles-"))
+
+    def test_map_index_tag_is_shared_and_follows_content(self) -> None:
+        path = self.tmp / "geometry.sqlite3"
+        server.FeatureStore(path).upsert(feature("22:01:000001:1", 83.0))
+        first, second = (server.ParcelMapIndex(server.FeatureStore(path)) for _ in range(2))
+        first.query((80.0, 50.0, 90.0, 60.0))
+        second.query((80.0, 50.0, 90.0, 60.0))
+        second.query((80.0, 50.0, 90.0, 60.0))
+        self.assertTrue(first.content_tag)
+        self.assertEqual(first.content_tag, second.content_tag)
+
+        server.FeatureStore(path).upsert(feature("22:01:000001:2", 84.0))
+        third = server.ParcelMapIndex(server.FeatureStore(path))
+        third.query((80.0, 50.0, 90.0, 60.0))
+        self.assertNotEqual(third.content_tag, first.content_tag)
+
+    def test_dataset_tag_ignores_snapshot_numbering(self) -> None:
+        source = self.tmp / "parcels.csv"
+        source.write_text("cadastral_number\n22:01:000001:1\n", encoding="utf-8")
+        columns = {"cadastral_number": ["22:01:000001:1"]}
+        loaded = server.ParcelDataset(columns, source=str(source))
+        reloaded = server.ParcelDataset(columns, source=str(source), version=3)
+        self.assertEqual(loaded.content_tag, reloaded.content_tag)
+
+        stat = source.stat()
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        self.assertNotEqual(server.ParcelDataset(columns, source=str(source)).content_tag, loaded.content_tag)
+
+
+if __name__ == "__main__":
+    unittest.main()
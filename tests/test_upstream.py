@@ -0,0 +1,78 @@
+import time
+import unittest
+
+from stubs import StubServer
+
+import server
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.status = 500
+        self.stub = StubServer(lambda method, path, headers, body: (self.status, {}, b"{}")).__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        self.breaker = server.CircuitBreaker(failures=2, reset_timeout=0.2)
+        self.pool = server.UpstreamPool("test", self.stub.url, max_connections=1, connect_timeout=0.1, breaker=self.breaker)
+
+    def get(self) -> bytes:
+        with self.pool.request("GET", "/ping") as response:
+            return response.read()
+
+    def open_circuit(self) -> None:
+        for _ in range(2):
+            with self.assertRaises(server.UpstreamError):
+                self.get()
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_open_half_open_closed(self) -> None:
+        self.open_circuit()
+        with self.assertRaisesRegex(server.UpstreamError, "circuit open"):
+            self.get()
+        self.assertEqual(self.stub.count(), 2)
+
+        time.sleep(0.25)
+        self.assertEqual(self.breaker.state, "half-open")
+        self.status = 200
+        self.assertEqual(self.get(), b"{}")
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_failed_probe_reopens(self) -> None:
+        self.open_circuit()
+        time.sleep(0.25)
+        with self.assertRaisesRegex(server.UpstreamError, "HTTP 500"):
+            self.get()
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_probe_rejected_by_busy_pool_does_not_stick(self) -> None:
+        self.open_circuit()
+        time.sleep(0.25)
+        self.pool._slots.acquire()
+        try:
+            with self.assertRaisesRegex(server.UpstreamError, "busy"):
+                self.get()
+        finally:
+            self.pool._slots.release()
+        self.status = 200
+        self.assertEqual(self.get(), b"{}")
+        self.assertEqual(self.breaker.state, "closed")
+
+
+class TruncatedBodyTest(unittest.TestCase):
+    def test_broken_body_is_an_upstream_failure(self) -> None:
+        respond = lambda method, path, headers, body: (200, {"Content-Length": "1000"}, b'{"partial"')  # noqa: E731
+        with StubServer(respond) as stub:
+            breaker = server.CircuitBreaker(failures=1, reset_timeout=60)
+            pool = server.UpstreamPool("test", stub.url, breaker=breaker)
+            for consume in (lambda response: response.read(), lambda response: list(response)):
+                with self.subTest(consume=consume):
+                    breaker.record_success()
+                    with self.assertRaises(server.UpstreamError):
+                        with pool.request("GET", "/") as response:
+                            consume(response)
+                    self.assertEqual(breaker.state, "open")
+                    self.assertEqual(pool.in_use, 0)
+                    self.assertEqual(pool.stats()["idle"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
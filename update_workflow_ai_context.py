@@ -1,80 +1,79 @@
 #!/usr/bin/env python3
 """
-Augment the Filatiev AI workflow with site knowledge fetching/context summary.
+Augment the Filatiev AI workflow with the site knowledge context served by
+the backend (GET /knowledge/context, conditional requests by ETag).
+
+Examples:
+    python update_workflow_ai_context.py
+    python update_workflow_ai_context.py --workflow-id o7Lz9xJb1bn9Fe2w --workflow-id AbC123 \
+        --context-url https://retro.filatiev.pro:8444/knowledge/context
 """
 
 from __future__ import annotations
 
+import argparse
 import json
+import os
 import sqlite3
 from pathlib import Path
 
 WORKFLOW_ID = "o7Lz9xJb1bn9Fe2w"
 DB_PATH = Path.home() / ".n8n" / "database.sqlite"
+CONTEXT_URL = os.getenv("KNOWLEDGE_CONTEXT_URL", "").strip() or "http://127.0.0.1:8080/knowledge/context"
 
 
-def load_workflow(conn: sqlite3.Connection) -> tuple[list[dict], dict]:
+def load_workflow(conn: sqlite3.Connection, workflow_id: str) -> tuple[list[dict], dict]:
     row = conn.execute(
-        "SELECT nodes, connections FROM workflow_entity WHERE id=?", (WORKFLOW_ID,)
+        "SELECT nodes, connections FROM workflow_entity WHERE id=?", (workflow_id,)
     ).fetchone()
     if not row:
-        raise SystemExit("Workflow not found")
+        raise SystemExit(f"Workflow not found: {workflow_id}")
     nodes = json.loads(row[0])
     connections = json.loads(row[1])
     return nodes, connections
 
 
-def save_workflow(conn: sqlite3.Connection, nodes: list[dict], connections: dict) -> None:
+def save_workflow(conn: sqlite3.Connection, workflow_id: str, nodes: list[dict], connections: dict) -> None:
     conn.execute(
         "UPDATE workflow_entity SET nodes=?, connections=?, updatedAt=STRFTIME('%Y-%m-%d %H:%M:%f','now') WHERE id=?",
-        (json.dumps(nodes, ensure_ascii=False), json.dumps(connections, ensure_ascii=False), WORKFLOW_ID),
+        (json.dumps(nodes, ensure_ascii=False), json.dumps(connections, ensure_ascii=False), workflow_id),
     )
-    conn.commit()
 
 
 FETCH_NODE_ID = "c8f60d3b-8888-4fd8-9b1d-knowledge"
-CONTEXT_NODE_ID = "2dd6f126-75aa-4b1e-85f1-context123"
 
 
-def ensure_nodes(nodes: list[dict]) -> None:
+def ensure_nodes(nodes: list[dict], context_url: str) -> None:
     fetch_node = next((n for n in nodes if n["name"] == "Fetch Site Knowledge"), None)
     context_node = next((n for n in nodes if n["name"] == "Build Context Summary"), None)
 
+    # Сводку готовит backend (GET /knowledge/context); узел хранит её вместе с ETag
+    # в static data workflow и перекачивает только после смены версии.
     fetch_code = (
-        "const url = 'https://retro.filatiev.pro:8444/filatiev-ai-content.json';\n"
-        "let knowledgeBase = {};\n"
+        f"const url = {json.dumps(context_url)};\n"
+        "const cache = getWorkflowStaticData('global');\n"
         "try {\n"
-        "  knowledgeBase = await this.helpers.httpRequest({ method: 'GET', uri: url, json: true });\n"
+        "  const response = await this.helpers.httpRequest({\n"
+        "    method: 'GET',\n"
+        "    url,\n"
+        "    headers: cache.knowledgeEtag ? { 'If-None-Match': cache.knowledgeEtag } : {},\n"
+        "    json: true,\n"
+        "    returnFullResponse: true,\n"
+        "    ignoreHttpStatusErrors: true,\n"
+        "    timeout: 5000,\n"
+        "  });\n"
+        "  if (response.statusCode === 200 && response.body && typeof response.body.summary === 'string') {\n"
+        "    cache.knowledgeEtag = response.headers.etag;\n"
+        "    cache.knowledgeVersion = response.body.version;\n"
+        "    cache.knowledgeSummary = response.body.summary;\n"
+        "  } else if (response.statusCode !== 304) {\n"
+        "    console.error('Сводка знаний сайта недоступна: HTTP', response.statusCode);\n"
+        "  }\n"
         "} catch (error) {\n"
         "  console.error('Не удалось загрузить знания сайта', error.message);\n"
         "}\n"
-        "return items.map(item => ({ json: { ...item.json, knowledgeBase } }));"
-    )
-
-    context_code = (
-        "const data = $json.knowledgeBase || {};\n"
-        "const sections = [];\n"
-        "if (data.meta) {\n"
-        "  const metaBits = [];\n"
-        "  if (data.meta.title) metaBits.push(`Название: ${data.meta.title}`);\n"
-        "  if (data.meta.description) metaBits.push(`Описание: ${data.meta.description}`);\n"
-        "  if (metaBits.length) sections.push('META\\n' + metaBits.join('\\n'));\n"
-        "}\n"
-        "if (Array.isArray(data.startMenu?.items) && data.startMenu.items.length) {\n"
-        "  sections.push('МЕНЮ\\n' + data.startMenu.items.map(i => i.label).join(', '));\n"
-        "}\n"
-        "if (Array.isArray(data.startMenu?.contacts) && data.startMenu.contacts.length) {\n"
-        "  sections.push('КОНТАКТЫ\\n' + data.startMenu.contacts.map(c => `${c.label} — ${c.url}`).join('\\n'));\n"
-        "}\n"
-        "if (Array.isArray(data.desktopIcons) && data.desktopIcons.length) {\n"
-        "  sections.push('РАБОЧИЙ СТОЛ\\n' + data.desktopIcons.map(i => i.label).join(', '));\n"
-        "}\n"
-        "const windowSummaries = (data.windows || [])\n"
-        "  .filter(w => w.title)\n"
-        "  .slice(0, 8)\n"
-        "  .map(w => `${w.title}: ${(w.content || '').slice(0, 240)}`);\n"
-        "if (windowSummaries.length) sections.push('ОКНА\\n' + windowSummaries.join('\\n'));\n"
-        "return [{ json: { ...$json, contextSummary: sections.join('\\n\\n') } }];"
+        "const contextSummary = cache.knowledgeSummary || '';\n"
+        "return items.map(item => ({ json: { ...item.json, contextSummary } }));"
     )
 
     if fetch_node:
@@ -93,18 +92,8 @@ def ensure_nodes(nodes: list[dict]) -> None:
         )
 
     if context_node:
-        context_node["parameters"]["functionCode"] = context_code
-    else:
-        nodes.append(
-            {
-                "parameters": {"functionCode": context_code},
-                "id": CONTEXT_NODE_ID,
-                "name": "Build Context Summary",
-                "type": "n8n-nodes-base.function",
-                "typeVersion": 1,
-                "position": [-96, 320],
-            }
-        )
+        # Сводка приходит готовой от backend'а, отдельный узел больше не нужен.
+        nodes.remove(context_node)
 
     prompt_expression = (
         "={{ [\n"
@@ -132,18 +121,43 @@ def ensure_nodes(nodes: list[dict]) -> None:
 
 def update_connections(connections: dict) -> None:
     connections["Edit Fields"] = {"main": [[{"node": "Fetch Site Knowledge", "type": "main", "index": 0}]]}
-    connections["Fetch Site Knowledge"] = {"main": [[{"node": "Build Context Summary", "type": "main", "index": 0}]]}
-    connections["Build Context Summary"] = {"main": [[{"node": "Basic LLM Chain", "type": "main", "index": 0}]]}
+    connections["Fetch Site Knowledge"] = {"main": [[{"node": "Basic LLM Chain", "type": "main", "index": 0}]]}
+    connections.pop("Build Context Summary", None)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--workflow-id",
+        dest="workflow_ids",
+        action="append",
+        help=f"workflow to patch; repeat for several (default {WORKFLOW_ID})",
+    )
+    parser.add_argument("--db", type=Path, default=DB_PATH, help="n8n SQLite database")
+    parser.add_argument("--context-url", default=CONTEXT_URL, help="backend GET /knowledge/context URL")
+    return parser.parse_args()
 
 
 def main() -> None:
-    conn = sqlite3.connect(DB_PATH)
-    nodes, connections = load_workflow(conn)
-    ensure_nodes(nodes)
-    update_connections(connections)
-    save_workflow(conn, nodes, connections)
-    conn.close()
-    print("Workflow updated with knowledge context.")
+    args = parse_args()
+    workflow_ids = list(dict.fromkeys(args.workflow_ids or [WORKFLOW_ID]))
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        # Все workflow в одной транзакции: если какого-то нет, не меняется ни один.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for workflow_id in workflow_ids:
+                nodes, connections = load_workflow(conn, workflow_id)
+                ensure_nodes(nodes, args.context_url)
+                update_connections(connections)
+                save_workflow(conn, workflow_id, nodes, connections)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    print(f"Updated {len(workflow_ids)} workflow(s) with knowledge context from {args.context_url}.")
 
 
 if __name__ == "__main__":